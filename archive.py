@@ -0,0 +1,117 @@
+# Offline bulk ingestion from an archive of saved roster pages: no network, and no BeautifulSoup.
+# The team and season of each page are read from its path, below the archive directory:
+#   .../<team_id>/<year>.html[.gz]    a mirror of Hockey-Reference's /teams/<team_id>/<year>.html
+#   .../<team_id>_<year>.html[.gz]    a flat directory ("-" is accepted instead of "_")
+# A local HTML cache of scraper.py (with "keys" and "objects" directories) is read through its keys.
+# Pages are read and parsed by a process pool; database.add_to_database_from_archive writes them
+# all in one transaction.
+
+import gzip, html, os, re
+from concurrent.futures import ProcessPoolExecutor
+
+########################################################################
+# Function signatures for functions herein:
+#
+# extract_roster(page, team_id, year)
+# find_roster_pages(archive_dir)
+# parse_archive(pages, processes=None)
+# read_roster_page(path)
+#
+########################################################################
+
+_PAGE_PATH = re.compile(r"(?:^|/)([A-Za-z0-9]+)[/_-](\d{4})\.html?(?:\.gz)?$")
+
+_ROSTER_TABLE = re.compile(rb"<table\b[^>]*\bid\s*=\s*[\"']?roster\b")
+_PLAYER_CELL = re.compile(rb"<td\b[^>]*\bdata-append-csv\s*=[^>]*>")
+_ATTRIBUTE = re.compile(rb"([\w-]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+
+
+def find_roster_pages(archive_dir):
+    """
+    Returns a dict mapping (team_id, year) to the path of its saved page, for every roster page
+    found below archive_dir (see the top of this file for the layouts that are recognized).
+    """
+    pages = dict()
+    keys_dir = os.path.join(archive_dir, "keys")
+    if os.path.isdir(keys_dir) and os.path.isdir(os.path.join(archive_dir, "objects")):
+        # Cache of scraper.py: keys/<team_id>/<year> holds the sha256 of objects/<sha[:2]>/<sha>.html.gz
+        for team_id in os.listdir(keys_dir):
+            for year in os.listdir(os.path.join(keys_dir, team_id)):
+                if not year.isdigit():
+                    continue
+                with open(os.path.join(keys_dir, team_id, year), "r") as file:
+                    digest = file.read().strip()
+                path = os.path.join(archive_dir, "objects", digest[:2], f"{digest}.html.gz")
+                if os.path.exists(path):
+                    pages[(team_id, int(year))] = path
+        return pages
+
+    for dirpath, _, filenames in os.walk(archive_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            match = _PAGE_PATH.search(os.path.relpath(path, archive_dir).replace(os.sep, "/"))
+            if match:
+                pages[(match.group(1), int(match.group(2)))] = path
+    return pages
+
+
+def read_roster_page(path):
+    """
+    Returns the content (bytes) of a saved page, decompressed if its name ends in .gz.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        return file.read()
+
+
+def extract_roster(page, team_id, year):
+    """
+    Same result as scraper.parse_roster_html, without building a document tree: finds the
+    "#roster" table in the raw page (bytes) and reads the data-append-csv / csk attributes of its
+    player cells. Returns a dict mapping player_id to lastname_comma_firstname, or None if the
+    page has no roster table.
+    """
+    table = _ROSTER_TABLE.search(page)
+    if table is None:
+        print(f"Table not found for {team_id} in {year}.")
+        return None
+    end = page.find(b"</table>", table.end())
+    body_start = page.find(b"<tbody", table.end(), end)
+    rows = page[body_start if body_start != -1 else table.end() : end if end != -1 else len(page)]
+
+    roster_dict = {}
+    for cell in _PLAYER_CELL.finditer(rows):
+        attributes = {name: double or single for name, double, single in _ATTRIBUTE.findall(cell.group())}
+        if b"csk" not in attributes:
+            continue
+        player_id = html.unescape(attributes[b"data-append-csv"].decode("utf-8", "replace"))
+        last_comma_first = html.unescape(attributes[b"csk"].decode("utf-8", "replace")) # may contain accents
+        roster_dict[player_id] = last_comma_first
+    return roster_dict
+
+
+def _parse_page(job):
+    team_id, year, path = job
+    try:
+        page = read_roster_page(path)
+    except OSError as err:
+        print(err)
+        return team_id, year, None
+    return team_id, year, extract_roster(page, team_id, year)
+
+
+def parse_archive(pages, processes=None):
+    """
+    Reads and parses a list of saved pages, given as (team_id, year, path), in a pool of
+    processes (default: one per CPU; processes=1 parses them in this process).
+    Returns the list of (team_id, year, roster_dict), with roster_dict None for unreadable pages.
+    """
+    pages = list(pages)
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(pages) < 2:
+        return [_parse_page(job) for job in pages]
+
+    # Big chunks: each page is quick to parse, so sending one job at a time would dominate.
+    chunksize = max(1, len(pages) // (processes * 4))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_parse_page, pages, chunksize=chunksize))
@@ -0,0 +1,158 @@
+# Non-interactive batch lookups: answer many players' distance (and path) to Jagr (or another root) at once.
+# Loads everything needed from the database once, then answers each line of input from memory.
+
+import csv, json
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import snapshot # my snapshot.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# get_lookup_tables(db_filename, root='jagrja01')
+# load_lookup_tables(db_filename, root='jagrja01')
+# lookup_player(query, tables)
+# normalize_name(name)
+# resolve_player_id(query, tables)
+# run_batch(db_filename, input_file, output_file, output_format="jsonl", tables=None, root='jagrja01')
+#
+########################################################################
+
+CSV_COLUMNS = ["query", "player_id", "name", "distance", "path", "error"]
+
+
+def normalize_name(name):
+    """
+    Normalizes a player name for lookups: no diacritics, lower case, single spaces.
+    """
+    return " ".join(database.remove_diacritics(name).lower().split())
+
+
+def get_lookup_tables(db_filename, root='jagrja01'):
+    """
+    Same as load_lookup_tables, but loaded from a snapshot (see snapshot.py) while the database is unchanged.
+    """
+    return snapshot.cached(db_filename, f"tables-{root}", load_lookup_tables, db_filename, root=root)
+
+
+def load_lookup_tables(db_filename, root='jagrja01'):
+    """
+    Reads, in four queries, everything a lookup of distances to root needs, and returns it as a dict:
+        "names"       -> dict player_id -> "First Last"
+        "name_to_ids" -> dict normalized name (see normalize_name) -> list of player_ids
+        "parent"      -> dict player_id -> BFS parent (the tree of root in "bfs_parent_by_root")
+        "label"       -> dict player_id -> team + season shared with the BFS parent
+        "depth"       -> dict player_id -> distance to the root (None if disconnected), as stored with the tree
+
+    Assumes the BFS tree of root and "teammate_edges" were built.
+    """
+    cursor = database.get_connection(db_filename).cursor()
+
+    names = dict()
+    name_to_ids = dict()
+    cursor.execute("SELECT id, first_name, last_name FROM players;")
+    for player_id, first, last in cursor:
+        full_name = f"{first} {last}"
+        names[player_id] = full_name
+        name_to_ids.setdefault(normalize_name(full_name), []).append(player_id)
+
+    parent = database.get_all_bfs_parents(cursor, root=root)
+
+    label_query = """
+    SELECT tree.player_id, teams.name, edge.first_season
+    FROM bfs_parent_by_root tree
+    JOIN teammate_edges edge
+    ON edge.teammate1_id = min(tree.player_id, tree.parent_id)
+    AND edge.teammate2_id = max(tree.player_id, tree.parent_id)
+    JOIN teams ON teams.id = edge.first_team_id
+    WHERE tree.root_id = ?
+    ;"""
+    label = dict()
+    cursor.execute(label_query, (root,))
+    for player_id, team, season in cursor:
+        label[player_id] = f"{team} ({season-1}-{season})"
+
+    depth = database.get_all_bfs_depths(cursor, root=root)
+
+    return {"names": names, "name_to_ids": name_to_ids, "parent": parent, "label": label, "depth": depth}
+
+
+def lookup_player(query, tables):
+    """
+    Answers one line of batch input, which is either a player id or a player's full name.
+
+    Returns a dict with keys "query", "player_id", "name", "distance" (None if there is no
+    connection to the root) and "path" (the lines of the usual program output), or with an
+    "error" key if the player is unknown or the name is ambiguous.
+    """
+    query = query.strip()
+    player_id, error = resolve_player_id(query, tables)
+    if error:
+        return {"query": query, "error": error}
+
+    names, parent, label = tables["names"], tables["parent"], tables["label"]
+    distance = tables["depth"].get(player_id)
+
+    hops = []
+    if distance is not None:
+        curr_id = player_id
+        while parent[curr_id] != "HIMSELF":
+            hops.append( (curr_id, names.get(curr_id), label.get(curr_id)) )
+            curr_id = parent[curr_id]
+        hops.append( (curr_id, names.get(curr_id), None) )
+    _, result = graph_operations.format_path(hops)
+
+    return {"query": query, "player_id": player_id, "name": names[player_id],
+            "distance": distance, "path": result.splitlines()}
+
+
+def resolve_player_id(query, tables):
+    """
+    Returns (player_id, None) for a query that is a player id or a unique full name,
+    or (None, error message) otherwise.
+    """
+    query = query.strip()
+    if query in tables["names"]:
+        return query, None
+
+    candidates = tables["name_to_ids"].get(normalize_name(query), [])
+    if len(candidates) == 0:
+        return None, "No such player exists in our database."
+    if len(candidates) > 1:
+        return None, "Ambiguous name; use one of these ids: " + ", ".join(sorted(candidates))
+    return candidates[0], None
+
+
+def run_batch(db_filename, input_file, output_file, output_format="jsonl", tables=None, root='jagrja01'):
+    """
+    Reads one player id or name per line of input_file (blank lines are skipped), and writes one
+    result per line to output_file as soon as it is computed, as JSON lines or CSV
+    (columns: CSV_COLUMNS, with the path lines joined by spaces).
+
+    The lookup tables (distances to root) are loaded once (unless supplied). Returns the number of lookups.
+    """
+    if tables is None:
+        tables = get_lookup_tables(db_filename, root=root)
+
+    if output_format == "csv":
+        writer = csv.DictWriter(output_file, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+    elif output_format != "jsonl":
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    count = 0
+    for line in input_file:
+        if not line.strip():
+            continue
+        record = lookup_player(line, tables)
+        if output_format == "csv":
+            record = dict(record)
+            record["path"] = " ".join(record.get("path", []))
+            writer.writerow(record)
+        else:
+            output_file.write(json.dumps(record) + "\n")
+        count += 1
+
+    output_file.flush()
+    return count
+
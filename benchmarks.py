@@ -0,0 +1,260 @@
+# Benchmarks: time and peak memory of every stage of the pipeline, and a comparison of the graph engines.
+# Run as: python3 benchmarks.py <db_file> [--root jagrja01] [--stages] [--json]
+#     or: python3 benchmarks.py --synthetic TEAMS,SEASONS,ROSTER_SIZE,CAREER_LENGTH [--stages] [--output results.json]
+
+import argparse, datetime, json, os, platform, random, shutil, sqlite3, subprocess, tempfile, time, tracemalloc
+import numpy as np
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import name_search # my name_search.py file
+import synthetic # my synthetic.py file
+import union_find # my union_find.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# benchmark_stages(db_filename, root='jagrja01', num_queries=200, seed=0)
+# compare_graph_engines(db_filename, root='jagrja01')
+# git_commit()
+# measure(function, *args, **kwargs)
+#
+########################################################################
+
+
+def measure(function, *args, **kwargs):
+    """
+    Calls function(*args, **kwargs), and returns (result, seconds, peak MB allocated during the call).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+def _db_size_mb(db_filename):
+    conn = sqlite3.connect(db_filename)
+    page_count = conn.execute("PRAGMA page_count;").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+    conn.close()
+    return page_count * page_size / 2**20
+
+
+def git_commit():
+    """
+    Returns the hash of the current git commit of this repository (None if unavailable),
+    so that results can be compared across commits.
+    """
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def _reset_derived_tables(db_filename):
+    # Drops everything built from team_membership, so every stage starts from scratch.
+    conn = sqlite3.connect(db_filename)
+    conn.execute("DROP VIEW IF EXISTS teammates;")
+    for table in ["teammates", "teammate_edges", "team_bits", "union_find", "bfs_parent", "bfs_parent_by_root",
+                  "bfs_ancestors", "bfs_roots", "centrality"]:
+        conn.execute(f"DROP TABLE IF EXISTS {table};")
+    conn.commit()
+    conn.execute("VACUUM;")
+    conn.close()
+
+
+def benchmark_stages(db_filename, root='jagrja01', num_queries=200, seed=0):
+    """
+    Runs every stage of the pipeline on a copy of db_filename, from the raw tables to answers:
+        make_teammates_table, build_union_find, make_graph, BFS, BFS_csr, make_BFS_parent_table,
+        traverse_bfs_path and name lookups (name_search index build, then searches),
+    and measures each one's wall-clock time and peak memory (see measure). The last two are
+    run for num_queries players drawn with the given seed, and also report the time per query.
+
+    Returns a dict: {"stages": {stage: {"seconds": ..., "peak_mb": ...}}, plus database sizes}.
+    """
+    stages = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = os.path.join(tmp_dir, "benchmark.db")
+        shutil.copyfile(db_filename, db_copy)
+        _reset_derived_tables(db_copy)
+
+        def run(stage, function, *args, **kwargs):
+            result, seconds, peak_mb = measure(function, *args, **kwargs)
+            stages[stage] = {"seconds": seconds, "peak_mb": peak_mb}
+            return result
+
+        def build_components():
+            conn = database._connect(db_copy)
+            union_find.build_union_find(conn.cursor())
+            conn.commit()
+            conn.close()
+        run("make_teammates_table", database.make_teammates_table, db_copy)
+        run("build_union_find", build_components)
+        teammates_graph = run("make_graph", graph_operations.make_graph, db_copy)
+        run("BFS", graph_operations.BFS, db_copy, root=root)
+        bfs_parent_dict = run("BFS_csr", graph_operations.BFS_csr, db_copy, root=root)
+        run("make_BFS_parent_table", database.make_BFS_parent_table, bfs_parent_dict, db_copy, root=root)
+
+        players = sorted(database.get_all_players(db_copy))
+        sample = random.Random(seed).sample(players, min(num_queries, len(players)))
+
+        def traverse_all():
+            for player_id in sample:
+                graph_operations.traverse_bfs_path(player_id, db_copy, root=root)
+        run("traverse_bfs_path", traverse_all)
+
+        names = [database.get_player_name_from_id(player_id, db_copy) for player_id in sample]
+        name_index = run("build_name_index", name_search.build_name_index, db_copy)
+
+        def search_all():
+            for name in names:
+                name_index.search(name)
+        run("name_lookup", search_all)
+
+        for stage in ["traverse_bfs_path", "name_lookup"]:
+            stages[stage]["per_query_ms"] = 1000 * stages[stage]["seconds"] / max(len(sample), 1)
+
+        num_players = len(players)
+        num_edges = sum(len(teammates) for teammates in teammates_graph.values()) // 2
+        db_size_mb = _db_size_mb(db_copy)
+        database.close_connections()
+
+    return {"num_players": num_players, "num_edges": num_edges, "db_size_mb": db_size_mb,
+            "num_queries": len(sample), "stages": stages}
+
+
+def compare_graph_engines(db_filename, root='jagrja01'):
+    """
+    Compares, on a copy of db_filename:
+        - the clique-based engine: building "teammate_edges" (every roster expanded into all of
+          its pairs), make_csr_graph, and BFS_csr,
+        - the bipartite engine: make_bipartite_graph (straight from team_membership) and BFS_bipartite,
+    in wall-clock time, peak Python/NumPy memory, graph size, and database growth.
+    Also checks that both engines give every player the same distance to root, and that every
+    parent in the bipartite BFS tree is a teammate one step closer to root, labelled with the same
+    shared team as in "teammate_edges".
+
+    Returns the results as a dict (and prints them).
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = os.path.join(tmp_dir, "benchmark.db")
+        shutil.copyfile(db_filename, db_copy)
+
+        # Start the clique engine from scratch.
+        conn = sqlite3.connect(db_copy)
+        conn.execute("DROP VIEW IF EXISTS teammates;")
+        conn.execute("DROP TABLE IF EXISTS teammates;")
+        conn.execute("DROP TABLE IF EXISTS teammate_edges;")
+        conn.commit()
+        conn.execute("VACUUM;")
+        conn.close()
+        size_before = _db_size_mb(db_copy)
+
+        _, build_seconds, build_peak = measure(database.make_teammates_table, db_copy)
+        csr_graph, graph_seconds, graph_peak = measure(graph_operations.make_csr_graph, db_copy)
+        (_, csr_distance), bfs_seconds, bfs_peak = measure(graph_operations.csr_BFS_arrays,
+                                                           csr_graph, csr_graph.index_of[root])
+        results["clique"] = {
+            "build_edges_s": build_seconds, "build_edges_peak_mb": build_peak,
+            "db_growth_mb": _db_size_mb(db_copy) - size_before,
+            "make_graph_s": graph_seconds, "make_graph_peak_mb": graph_peak,
+            "graph_arrays_mb": (csr_graph.offsets.nbytes + csr_graph.neighbors.nbytes) / 2**20,
+            "num_edges": int(csr_graph.neighbors.size // 2),
+            "bfs_s": bfs_seconds, "bfs_peak_mb": bfs_peak,
+        }
+
+        bipartite_graph, graph_seconds, graph_peak = measure(graph_operations.make_bipartite_graph, db_copy)
+        (bipartite_parent, bipartite_distance, _), bfs_seconds, bfs_peak = measure(graph_operations.bipartite_BFS_arrays,
+                                                                             bipartite_graph, bipartite_graph.index_of[root])
+        arrays = (bipartite_graph.player_offsets, bipartite_graph.player_rosters,
+                  bipartite_graph.roster_offsets, bipartite_graph.roster_players)
+        results["bipartite"] = {
+            "build_edges_s": 0.0, "build_edges_peak_mb": 0.0, "db_growth_mb": 0.0,
+            "make_graph_s": graph_seconds, "make_graph_peak_mb": graph_peak,
+            "graph_arrays_mb": sum(a.nbytes for a in arrays) / 2**20,
+            "num_memberships": int(bipartite_graph.roster_players.size),
+            "num_rosters": len(bipartite_graph.rosters),
+            "bfs_s": bfs_seconds, "bfs_peak_mb": bfs_peak,
+        }
+
+        # Same player order in both graphs, so distances compare index by index.
+        results["same_distances"] = bool(csr_graph.player_ids == bipartite_graph.player_ids
+                                         and np.array_equal(csr_distance, bipartite_distance))
+        # The BFS trees may differ, but every bipartite parent must be a teammate of its child
+        # that is one step closer to root in the CSR BFS.
+        children = np.flatnonzero(bipartite_parent >= 0)
+        children = children[children != csr_graph.index_of[root]]
+        parents = bipartite_parent[children]
+        positions = np.minimum(graph_operations.csr_edge_positions(csr_graph, children, parents),
+                               csr_graph.neighbors.size - 1)
+        results["parents_match"] = bool(results["same_distances"]
+                                        and np.array_equal(bipartite_parent == -1, csr_distance == -1)
+                                        and np.array_equal(csr_distance[parents], csr_distance[children] - 1)
+                                        and np.array_equal(csr_graph.neighbors[positions], parents))
+
+        # Every tree edge gets the same shared-team label from both engines.
+        tree, labels = graph_operations.BFS_bipartite(None, root=root, graph=bipartite_graph, shared_teams=True)
+        conn = sqlite3.connect(db_copy)
+        edge_labels = {(teammate1_id, teammate2_id): (team_id, season) for teammate1_id, teammate2_id, team_id, season
+                       in conn.execute("SELECT teammate1_id, teammate2_id, first_team_id, first_season FROM teammate_edges;")}
+        conn.close()
+        results["same_labels"] = all(edge_labels.get( tuple(sorted( (player_id, tree[player_id]) )) ) == label
+                                     for player_id, label in labels.items())
+
+    print(f"{'':24}{'clique':>12}{'bipartite':>12}")
+    for key in ["build_edges_s", "build_edges_peak_mb", "db_growth_mb", "make_graph_s",
+                "make_graph_peak_mb", "graph_arrays_mb", "bfs_s", "bfs_peak_mb"]:
+        print(f"{key:24}{results['clique'][key]:12.4f}{results['bipartite'][key]:12.4f}")
+    print(f"same distances: {results['same_distances']}")
+    print(f"bipartite parents match BFS_csr distances: {results['parents_match']}")
+    print(f"same shared-team labels: {results['same_labels']}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline or the graph engines on a database file.")
+    parser.add_argument("db_file", nargs="?", default=None)
+    parser.add_argument("--root", default="jagrja01")
+    parser.add_argument("--synthetic", metavar="T,S,R,C", default=None,
+                        help="benchmark a synthetic league (teams, seasons, roster size, career length) instead")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic league and of the sampled queries")
+    parser.add_argument("--stages", action="store_true",
+                        help="time every stage of the pipeline (default: compare the graph engines)")
+    parser.add_argument("--json", action="store_true", help="also print the results as JSON")
+    parser.add_argument("--output", metavar="FILE", default=None, help="write the results as JSON to FILE")
+    args = parser.parse_args()
+    if (args.db_file is None) == (args.synthetic is None):
+        parser.error("give either a database file or --synthetic.")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = args.db_file
+        params = {"db_file": db_file}
+        if args.synthetic:
+            num_teams, num_seasons, roster_size, career_length = map(int, args.synthetic.split(","))
+            db_file = os.path.join(tmp_dir, "synthetic.db")
+            synthetic.generate_league(db_file, num_teams=num_teams, num_seasons=num_seasons, roster_size=roster_size,
+                                      career_length=career_length, seed=args.seed)
+            params = {"synthetic": {"teams": num_teams, "seasons": num_seasons, "roster_size": roster_size,
+                                    "career_length": career_length, "seed": args.seed}}
+
+        if args.stages:
+            results = benchmark_stages(db_file, root=args.root, seed=args.seed)
+            print(f"{'stage':24}{'seconds':>12}{'peak MB':>12}")
+            for stage, measured in results["stages"].items():
+                print(f"{stage:24}{measured['seconds']:12.4f}{measured['peak_mb']:12.2f}")
+        else:
+            results = compare_graph_engines(db_file, root=args.root)
+
+    results = {"commit": git_commit(), "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+               "python": platform.python_version(), "root": args.root, **params, **results}
+    if args.json:
+        print(json.dumps(results))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,327 @@
+# Who is the real center of the league: closeness, harmonic and betweenness centrality of every
+# player in the teammates graph, and the rank of any player (e.g. Jagr) by each of them.
+# One BFS per source (Brandes' algorithm) gives both the distances from that source and, walking
+# the levels back up, the share of the shortest paths from it that go through every other player.
+# Sources are spread over a process pool sharing the graph arrays read-only (as distance_matrix.py);
+# a random sample of sources gives estimates with a Hoeffding error bound instead.
+# Results are stored in the table "centrality" (player_id, closeness, harmonic, betweenness).
+# Run as: python3 centrality.py <db_file> [--sources K | --error E] [--confidence 0.95]
+#                                         [--processes N] [--seed 0] [--player jagrja01] [--top 10]
+
+import argparse, json, math, os, tempfile, time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import instrumentation # my instrumentation.py file
+import union_find # my union_find.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# brandes_BFS(offsets, neighbors, source)
+# centrality_rank(player_id, db_filename, measure)
+# compute_centrality(db_filename, num_sources=None, confidence=0.95, processes=None, seed=0)
+# create_centrality_table(cursor)
+# sampling_error(num_players, num_sources, confidence=0.95)
+# sources_for_error(num_players, error, confidence=0.95)
+# store_centrality(db_filename, result)
+# top_players(db_filename, measure, limit=10)
+#
+########################################################################
+
+# All three measures are normalized to [0, 1], larger meaning more central, for n players:
+#   closeness[i]   -> (r - 1) / (n - 1)  *  (r - 1) / (sum of distances from i), r = size of the
+#                     component of i (Wasserman-Faust, so small components do not score high)
+#   harmonic[i]    -> sum of 1 / distance from i over all other players, / (n - 1)
+#   betweenness[i] -> share of the shortest paths between two other players that go through i,
+#                     summed over all such pairs, / ((n - 1)(n - 2) / 2)
+#   num_sources    -> BFS sources used (n if exact); error -> bound on the error of harmonic and
+#                     betweenness for every player at once, with probability confidence (0 if exact)
+Centrality = namedtuple("Centrality", ["player_ids", "closeness", "harmonic", "betweenness",
+                                       "num_sources", "error", "confidence", "seconds"])
+
+MEASURES = ("closeness", "harmonic", "betweenness")
+
+# Sources per worker task: enough to amortize sending back three arrays of n values.
+CHUNK_SIZE = 256
+
+# Set in each worker process by _init_worker.
+_worker = dict()
+
+
+def brandes_BFS(offsets, neighbors, source):
+    """
+    Level-synchronous BFS from source over a CSR graph (see graph_operations.CSRGraph), which
+    counts the shortest paths to every node (as shortest_paths.shortest_path_dag, in floats),
+    then goes back up the levels accumulating the dependency of source on every node:
+        dependency[v] = sum over the neighbors w of v one level further of
+                        num_paths[v] / num_paths[w] * (1 + dependency[w])
+    i.e. the number of nodes t for which v is on a shortest path from source to t, each counted
+    by the fraction of those paths through v. Each edge is gathered once per direction on the way
+    down; only the edges of the DAG of shortest paths are kept for the way back up.
+
+    Returns (distance (int32, -1 if unreachable), dependency (float64, 0 at source)).
+    """
+    num_nodes = offsets.size - 1
+    distance = np.full(num_nodes, -1, dtype=np.int32)
+    num_paths = np.zeros(num_nodes, dtype=np.float64)
+    distance[source] = 0
+    num_paths[source] = 1.0
+
+    # The edges from one level to the next, as (closer, further) node arrays for each level:
+    # the edges of the DAG of shortest paths, walked back up for the dependencies.
+    levels = []
+    frontier = np.array([source], dtype=np.int32)
+    level = 0
+    while frontier.size:
+        level += 1
+        candidates, discoverers = graph_operations._gather(offsets, neighbors, frontier)
+        undiscovered = distance[candidates] == -1
+        candidates, discoverers = candidates[undiscovered], discoverers[undiscovered]
+        distance[candidates] = level
+        num_paths += np.bincount(candidates, weights=num_paths[discoverers], minlength=num_nodes)
+        levels.append( (discoverers, candidates) )
+        frontier = np.flatnonzero(distance == level).astype(np.int32)
+
+    # The source itself is the only node on level 0, and its dependency is not counted.
+    dependency = np.zeros(num_nodes, dtype=np.float64)
+    for closer, further in reversed(levels[1:]):
+        share = num_paths[closer] / num_paths[further] * (1.0 + dependency[further])
+        dependency += np.bincount(closer, weights=share, minlength=num_nodes)
+    return distance, dependency
+
+
+def _accumulate(offsets, neighbors, sources):
+    """
+    Runs brandes_BFS from every one of sources, and returns the sums over them, for every node,
+    of (distance to the source, 1 / distance to the source, dependency of the source on the node).
+    The graph is undirected, so summing the distances from the sources to a node gives the
+    distances from that node to the sources.
+    """
+    num_nodes = offsets.size - 1
+    total_distance = np.zeros(num_nodes, dtype=np.int64)
+    harmonic = np.zeros(num_nodes, dtype=np.float64)
+    dependency = np.zeros(num_nodes, dtype=np.float64)
+    for source in sources:
+        distance, source_dependency = brandes_BFS(offsets, neighbors, int(source))
+        reached = distance > 0
+        total_distance[reached] += distance[reached]
+        harmonic[reached] += 1.0 / distance[reached]
+        dependency += source_dependency
+    return total_distance, harmonic, dependency
+
+
+def _init_worker(offsets_path, neighbors_path):
+    # The graph arrays are memory-mapped read-only, so all workers share the same pages.
+    _worker["offsets"] = np.load(offsets_path, mmap_mode="r")
+    _worker["neighbors"] = np.load(neighbors_path, mmap_mode="r")
+
+
+def _process_sources(sources):
+    """
+    Worker task: _accumulate over one chunk of sources.
+    """
+    return _accumulate(_worker["offsets"], _worker["neighbors"], sources)
+
+
+def sampling_error(num_players, num_sources, confidence=0.95):
+    """
+    Returns the error bound of harmonic and betweenness centrality estimated from num_sources
+    sources drawn at random (without replacement) among num_players, for all players at once.
+
+    For one player, each sampled source contributes a value in [0, 1] (1 / distance, or the
+    dependency / (n - 2)), whose mean is the exact centrality times (n - 1) / n. By Hoeffding's
+    inequality (which also holds when sampling without replacement), the mean of k samples is off
+    by more than e with probability at most 2 exp(-2 k e^2); a union bound over the n players
+    then gives e = sqrt(ln(2 n / (1 - confidence)) / (2 k)), scaled back by n / (n - 1).
+    """
+    if num_sources >= num_players or num_players < 3:
+        return 0.0
+    epsilon = math.sqrt(math.log(2 * num_players / (1 - confidence)) / (2 * num_sources))
+    return epsilon * num_players / (num_players - 1)
+
+
+def sources_for_error(num_players, error, confidence=0.95):
+    """
+    Returns the number of sources needed for a sampling_error of at most error (at most num_players).
+    """
+    epsilon = error * (num_players - 1) / num_players
+    needed = math.ceil(math.log(2 * num_players / (1 - confidence)) / (2 * epsilon ** 2))
+    return min(needed, num_players)
+
+
+def compute_centrality(db_filename, num_sources=None, confidence=0.95, processes=None, seed=0):
+    """
+    Computes the closeness, harmonic and betweenness centrality of every player of db_filename
+    (see Centrality at the top of this file): exactly, from every player, if num_sources is None,
+    otherwise estimated from num_sources players drawn at random (with the given seed), with the
+    sums over them scaled by n / num_sources.
+
+    Sources are split into chunks of CHUNK_SIZE and spread over a process pool of "processes"
+    workers (default: one per core), which memory-map the CSR graph arrays read-only;
+    processes=1 runs everything in this process.
+
+    Returns a Centrality.
+    """
+    start_time = time.perf_counter()
+    graph = graph_operations.get_csr_graph(db_filename)
+    player_ids = graph.player_ids
+    num_nodes = len(player_ids)
+
+    if num_sources is None or num_sources >= num_nodes:
+        sources = np.arange(num_nodes, dtype=np.int32)
+    else:
+        rng = np.random.default_rng(seed)
+        sources = np.sort(rng.choice(num_nodes, size=num_sources, replace=False)).astype(np.int32)
+    chunks = [ sources[start:start + CHUNK_SIZE] for start in range(0, sources.size, CHUNK_SIZE) ]
+
+    total_distance = np.zeros(num_nodes, dtype=np.int64)
+    harmonic = np.zeros(num_nodes, dtype=np.float64)
+    dependency = np.zeros(num_nodes, dtype=np.float64)
+    with instrumentation.span("centrality.brandes"):
+        if processes == 1:
+            partials = ( _accumulate(graph.offsets, graph.neighbors, chunk) for chunk in chunks )
+            for partial in partials:
+                total_distance += partial[0]
+                harmonic += partial[1]
+                dependency += partial[2]
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                offsets_path = os.path.join(tmp_dir, "offsets.npy")
+                neighbors_path = os.path.join(tmp_dir, "neighbors.npy")
+                np.save(offsets_path, graph.offsets)
+                np.save(neighbors_path, graph.neighbors)
+                with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                         initargs=(offsets_path, neighbors_path)) as pool:
+                    for partial in pool.map(_process_sources, chunks):
+                        total_distance += partial[0]
+                        harmonic += partial[1]
+                        dependency += partial[2]
+    instrumentation.count("centrality.sources", int(sources.size))
+
+    # Size of the component of every player (players on no roster are alone).
+    components = union_find.load_components(db_filename)
+    sizes = Counter(components.values())
+    component_size = np.array([ sizes[components[player_id]] if player_id in components else 1
+                                for player_id in player_ids ], dtype=np.float64)
+
+    scale = num_nodes / sources.size if sources.size else 0.0
+    others = max(num_nodes - 1, 1)
+    total_distance = total_distance * scale
+    with np.errstate(divide="ignore", invalid="ignore"):
+        closeness = np.where(total_distance > 0,
+                             (component_size - 1) ** 2 / (others * total_distance), 0.0)
+    harmonic = harmonic * scale / others
+    # Every pair was counted from both ends.
+    betweenness = dependency * scale / max((num_nodes - 1) * (num_nodes - 2), 1)
+
+    return Centrality(player_ids, closeness, harmonic, betweenness, int(sources.size),
+                      sampling_error(num_nodes, int(sources.size), confidence), confidence,
+                      time.perf_counter() - start_time)
+
+
+def create_centrality_table(cursor):
+    """
+    Creates the "centrality" table, if needed.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS centrality (
+        player_id TEXT PRIMARY KEY,
+        closeness REAL NOT NULL,
+        harmonic REAL NOT NULL,
+        betweenness REAL NOT NULL,
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    ) WITHOUT ROWID;
+    """)
+
+
+def store_centrality(db_filename, result):
+    """
+    Replaces the content of the "centrality" table with a Centrality. How it was computed (number
+    of sources, error bound, and the database version it is up to date with) goes to "db_meta"
+    (see database.set_db_meta), since the scores are not updated when rosters are added.
+    """
+    conn = database._connect(db_filename)
+    cursor = conn.cursor()
+    create_centrality_table(cursor)
+    cursor.execute("DELETE FROM centrality;")
+    cursor.executemany("INSERT INTO centrality (player_id, closeness, harmonic, betweenness) VALUES (?,?,?,?);",
+                       zip(result.player_ids, result.closeness.tolist(), result.harmonic.tolist(),
+                           result.betweenness.tolist()))
+    conn.commit()
+    conn.close()
+    database.set_db_meta(db_filename, centrality_sources=result.num_sources, centrality_error=result.error,
+                         centrality_confidence=result.confidence,
+                         centrality_version=database.get_db_version(db_filename))
+
+
+def _check_measure(measure):
+    if measure not in MEASURES:
+        raise ValueError(f"Unknown centrality measure {measure!r}, expected one of {', '.join(MEASURES)}")
+
+
+def centrality_rank(player_id, db_filename, measure):
+    """
+    Returns (rank, number of players) of player_id by one of MEASURES in the "centrality" table,
+    where rank 1 is the most central (ties share the best rank), or None if it has no score.
+    """
+    _check_measure(measure)
+    cursor = database.get_connection(db_filename).cursor()
+    cursor.execute(f"SELECT {measure} FROM centrality WHERE player_id = ?;", (player_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute(f"SELECT COUNT(*) FROM centrality WHERE {measure} > ?;", row)
+    rank = cursor.fetchone()[0] + 1
+    cursor.execute("SELECT COUNT(*) FROM centrality;")
+    return rank, cursor.fetchone()[0]
+
+
+def top_players(db_filename, measure, limit=10):
+    """
+    Returns the limit most central players by one of MEASURES, as (player_id, name, score) tuples.
+    """
+    _check_measure(measure)
+    cursor = database.get_connection(db_filename).cursor()
+    cursor.execute(f"""
+    SELECT centrality.player_id, players.first_name || ' ' || players.last_name, centrality.{measure}
+    FROM centrality JOIN players ON players.id = centrality.player_id
+    ORDER BY centrality.{measure} DESC, centrality.player_id
+    LIMIT ?;""", (limit,))
+    return cursor.fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank players by closeness, harmonic and betweenness centrality.")
+    parser.add_argument("db_file")
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument("--sources", type=int, default=None, help="BFS sources to sample (default: all players)")
+    sampling.add_argument("--error", type=float, default=None, help="sample enough sources for this error bound")
+    parser.add_argument("--confidence", type=float, default=0.95, help="probability that the error bound holds")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--player", default="jagrja01", help="player whose ranks are reported")
+    parser.add_argument("--top", type=int, default=10, help="number of top players listed per measure")
+    args = parser.parse_args()
+
+    database.make_teammates_table(args.db_file) # builds "teammate_edges" if the database has none yet
+    num_sources = args.sources
+    if args.error is not None:
+        num_players = len(graph_operations.get_csr_graph(args.db_file).player_ids)
+        num_sources = sources_for_error(num_players, args.error, args.confidence)
+    result = compute_centrality(args.db_file, num_sources=num_sources, confidence=args.confidence,
+                                processes=args.processes, seed=args.seed)
+    store_centrality(args.db_file, result)
+    print(json.dumps({"num_players": len(result.player_ids), "num_sources": result.num_sources,
+                      "error": result.error, "confidence": result.confidence,
+                      "seconds": round(result.seconds, 3)}))
+
+    for measure in MEASURES:
+        print(f"\nTop {args.top} by {measure}:")
+        for position, (player_id, name, score) in enumerate(top_players(args.db_file, measure, args.top), start=1):
+            print(f"  {position:3d}. {name} ({player_id}): {score:.6f}")
+        rank = centrality_rank(args.player, args.db_file, measure)
+        if rank is not None:
+            print(f"  {args.player} is #{rank[0]} of {rank[1]}")
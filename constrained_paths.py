@@ -0,0 +1,295 @@
+# Shortest paths restricted to some seasons and/or teams, e.g. "using only seasons before 1990"
+# or "avoiding the Penguins". Every pair of teammates keeps bitmasks of the seasons and teams of
+# the rosters they shared (see database.make_teammates_table). A query turns its constraints into
+# the same masks, tests all the edges at once with array operations, and runs the usual BFS over
+# the edges that pass (graph_operations.csr_BFS_arrays), without going back to team_membership.
+#
+# The two masks of a pair are separate, so they do not say which season went with which team:
+# a pair that shared PIT in 1985 and NYR in 1995 passes both tests of "before 1990, avoiding PIT"
+# without having shared a roster that satisfies both. When a query restricts seasons and teams
+# together, such pairs (and only those) are checked against team_membership.
+# Run as: python3 constrained_paths.py <db_file> <player> [<player>] [--seasons 1917-1989] [--teams ...] [--avoid-teams PIT]
+
+import argparse, sys
+from collections import namedtuple
+import numpy as np
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import helpers # my helpers.py file
+import instrumentation # my instrumentation.py file
+import snapshot # my snapshot.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# constrained_BFS(db_filename, root, seasons=None, teams=None, avoid_teams=(), graph=None, masks=None)
+# constrained_path(source_id, target_id, db_filename, seasons=None, teams=None, avoid_teams=(), graph=None,
+#                  masks=None)
+# edge_filter(db_filename, graph, masks, seasons=None, teams=None, avoid_teams=())
+# filter_graph(graph, keep)
+# get_edge_masks(db_filename, graph)
+# load_edge_masks(db_filename, graph)
+# render_constrained_path(player_id_sequence, db_filename, seasons=None, teams=None, avoid_teams=())
+# season_mask(seasons)
+# team_mask(team_ids, team_bits)
+#
+########################################################################
+
+# Masks of every edge of a graph_operations.CSRGraph, aligned with graph.neighbors:
+#   seasons[:, p] -> 2 uint64 words, bit (season - database.FIRST_MASK_SEASON) set for each season shared
+#   teams[:, p]   -> 2 uint64 words, bit team_bits[team_id] set for each team shared
+# (each word is a contiguous array over the edges, so that a mask test is two passes over memory)
+#   team_bits  -> dict team_id -> bit (from "team_bits")
+EdgeMasks = namedtuple("EdgeMasks", ["seasons", "teams", "team_bits"])
+
+MASK_BITS = 128  # two 64-bit words
+
+
+def _to_words(bits):
+    # Bit numbers (0 to MASK_BITS - 1) -> mask of 2 uint64 words.
+    words = np.zeros(2, dtype=np.uint64)
+    for bit in bits:
+        words[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+    return words
+
+
+def season_mask(seasons):
+    """
+    Returns the mask (2 uint64 words) of the given seasons. Raises ValueError for a season
+    outside the ones the masks cover (database.FIRST_MASK_SEASON and the 127 after it).
+    """
+    bits = [season - database.FIRST_MASK_SEASON for season in seasons]
+    if any(bit < 0 or bit >= MASK_BITS for bit in bits):
+        raise ValueError(f"Seasons must be between {database.FIRST_MASK_SEASON} and "
+                         f"{database.FIRST_MASK_SEASON + MASK_BITS - 1}.")
+    return _to_words(bits)
+
+
+def team_mask(team_ids, team_bits):
+    """
+    Returns the mask (2 uint64 words) of the given teams. Raises ValueError for a team that no
+    edge can have (not in the database, or beyond the first MASK_BITS teams).
+    """
+    unknown = [team_id for team_id in team_ids if team_bits.get(team_id, MASK_BITS) >= MASK_BITS]
+    if unknown:
+        raise ValueError(f"No team mask bit for: {', '.join(unknown)}.")
+    return _to_words(team_bits[team_id] for team_id in team_ids)
+
+
+def _intersects(edge_words, mask):
+    # Whether each edge's mask (2 x number of edges words) has a bit in common with mask.
+    return ((edge_words[0] & mask[0]) | (edge_words[1] & mask[1])) != 0
+
+
+def load_edge_masks(db_filename, graph):
+    """
+    Returns the EdgeMasks of graph, read from "teammate_edges".
+    """
+    index_of = graph.index_of
+    first, second, words = [], [], []
+    cursor = database._connect(db_filename).cursor()
+    for teammate1_id, teammate2_id, *edge_words in cursor.execute(
+            "SELECT teammate1_id, teammate2_id, season_mask_lo, season_mask_hi, team_mask_lo, team_mask_hi "
+            "FROM teammate_edges;"):
+        first.append(index_of[teammate1_id])
+        second.append(index_of[teammate2_id])
+        words.append(edge_words)
+    team_bits = dict(cursor.execute("SELECT team_id, bit FROM team_bits;").fetchall())
+    cursor.connection.close()
+
+    # SQLite integers are signed: the same 64 bits, read as unsigned.
+    words = np.array(words, dtype=np.int64).reshape(-1, 4).view(np.uint64).T
+    seasons = np.zeros( (2, len(graph.neighbors)), dtype=np.uint64 )
+    teams = np.zeros( (2, len(graph.neighbors)), dtype=np.uint64 )
+    for positions in [graph_operations.csr_edge_positions(graph, first, second),
+                      graph_operations.csr_edge_positions(graph, second, first)]:
+        seasons[:, positions] = words[0:2]
+        teams[:, positions] = words[2:4]
+    return EdgeMasks(seasons, teams, team_bits)
+
+
+def get_edge_masks(db_filename, graph):
+    """
+    load_edge_masks, through its snapshot (see snapshot.py); it is kept at the same database
+    version as the CSRGraph of graph_operations.get_csr_graph. Read-only: a "teammate_edges" table
+    built before the masks existed gets them when the database is set up (see database.set_up_db).
+    """
+    return snapshot.cached(db_filename, "edge_masks", load_edge_masks, db_filename, graph)
+
+
+def _check_edges(db_filename, graph, positions, seasons, teams):
+    """
+    Returns, for the edges at the given positions of graph.neighbors, whether the two players
+    shared a roster of one of the teams in the set "teams" during one of the seasons in the set
+    "seasons", read from team_membership.
+    """
+    sources = np.repeat(np.arange(len(graph.player_ids), dtype=np.int64), np.diff(graph.offsets))[positions]
+    pairs = [ (graph.player_ids[u], graph.player_ids[v]) for u, v in zip(sources.tolist(), graph.neighbors[positions].tolist()) ]
+    pairs = [ (min(pair), max(pair)) for pair in pairs ]  # both directions of an edge are the same pair
+    unique_pairs = list(dict.fromkeys(pairs))
+    passed = set()
+    cursor = database.get_connection(db_filename).cursor()
+
+    BATCH_SIZE = 400  # two "?" per pair, well under SQLite's limit
+    for start in range(0, len(unique_pairs), BATCH_SIZE):
+        batch = unique_pairs[start:start + BATCH_SIZE]
+        values = ", ".join("(?,?)" for _ in batch)
+        shared_query = f"""
+        WITH pairs(player1_id, player2_id) AS (VALUES {values})
+        SELECT pairs.player1_id, pairs.player2_id, tm1.team_id, tm1.season
+        FROM pairs
+        JOIN team_membership tm1 ON tm1.player_id = pairs.player1_id
+        JOIN team_membership tm2 ON tm2.player_id = pairs.player2_id
+        AND tm1.team_id = tm2.team_id
+        AND tm1.season = tm2.season
+        ;"""
+        cursor.execute(shared_query, [player_id for pair in batch for player_id in pair])
+        for player1_id, player2_id, team_id, season in cursor.fetchall():
+            if team_id in teams and season in seasons:
+                passed.add( (player1_id, player2_id) )
+    return np.array([pair in passed for pair in pairs], dtype=bool)
+
+
+def edge_filter(db_filename, graph, masks, seasons=None, teams=None, avoid_teams=()):
+    """
+    Returns a boolean array over graph.neighbors: which edges the two players could use, having
+    shared a roster during one of "seasons" (any season if None), of one of "teams" (any team if
+    None) but not of one of avoid_teams.
+
+    Each condition is one mask test over all the edges. With both a season and a team condition,
+    the edges that pass both tests but also have seasons and teams outside them are checked with
+    _check_edges (see the top of this file).
+    """
+    keep = np.ones(len(graph.neighbors), dtype=bool)
+    season_words = team_words = None
+    if seasons is not None:
+        seasons = set(seasons)
+        season_words = season_mask(seasons)
+        keep &= _intersects(masks.seasons, season_words)
+    if teams is not None or avoid_teams:
+        if teams is None:
+            teams = [team_id for team_id, bit in masks.team_bits.items() if bit < MASK_BITS]
+        teams = set(teams) - set(avoid_teams)
+        team_words = team_mask(teams, masks.team_bits)
+        keep &= _intersects(masks.teams, team_words)
+
+    if season_words is not None and team_words is not None:
+        uncertain = keep & _intersects(masks.seasons, ~season_words) & _intersects(masks.teams, ~team_words)
+        positions = np.flatnonzero(uncertain)
+        instrumentation.count("constrained.edges_checked", positions.size)
+        if positions.size:
+            keep[positions] = _check_edges(db_filename, graph, positions, seasons, teams)
+    return keep
+
+
+def filter_graph(graph, keep):
+    """
+    Returns the CSRGraph with only the edges where keep (a boolean array over graph.neighbors) is
+    True; the nodes and their indices are unchanged.
+    """
+    kept_before = np.concatenate( ([0], np.cumsum(keep, dtype=np.int64)) )
+    return graph_operations.CSRGraph(graph.player_ids, graph.index_of, kept_before[graph.offsets], graph.neighbors[keep])
+
+
+def constrained_BFS(db_filename, root, seasons=None, teams=None, avoid_teams=(), graph=None, masks=None):
+    """
+    BFS from root using only the edges allowed by the constraints (see edge_filter).
+    The graph and its masks are read from their snapshots, unless supplied.
+
+    Returns (graph, parent, distance): the filtered CSRGraph and the arrays of
+    graph_operations.csr_BFS_arrays over it.
+    """
+    if graph is None:
+        graph = graph_operations.get_csr_graph(db_filename)
+    if masks is None:
+        masks = get_edge_masks(db_filename, graph)
+    with instrumentation.span("constrained.filter_edges"):
+        filtered = filter_graph(graph, edge_filter(db_filename, graph, masks, seasons, teams, avoid_teams))
+    with instrumentation.span("constrained.BFS"):
+        parent, distance = graph_operations.csr_BFS_arrays(filtered, filtered.index_of[root])
+    return filtered, parent, distance
+
+
+def constrained_path(source_id, target_id, db_filename, seasons=None, teams=None, avoid_teams=(), graph=None,
+                     masks=None):
+    """
+    Returns a shortest path between two players using only the edges allowed by the constraints
+    (see edge_filter), as a list of player ids, or None if there is none.
+    """
+    filtered, parent, _ = constrained_BFS(db_filename, target_id, seasons, teams, avoid_teams, graph, masks)
+    index = filtered.index_of[source_id]
+    if parent[index] == -1:
+        return None
+    path = [index]
+    while path[-1] != parent[path[-1]]:
+        path.append(int(parent[path[-1]]))
+    return [filtered.player_ids[i] for i in path]
+
+
+def render_constrained_path(player_id_sequence, db_filename, seasons=None, teams=None, avoid_teams=()):
+    """
+    Same output as graph_operations.render_path, but each hop is labelled with the earliest roster
+    the two players shared within the constraints (rather than their earliest roster overall).
+    """
+    seasons = None if seasons is None else set(seasons)
+    teams = None if teams is None else set(teams)
+    cursor = database.get_connection(db_filename).cursor()
+    shared_query = """
+    SELECT tm1.team_id, teams.name, tm1.season
+    FROM team_membership tm1
+    JOIN team_membership tm2
+    ON tm1.team_id = tm2.team_id
+    AND tm1.season = tm2.season
+    JOIN teams ON teams.id = tm1.team_id
+    WHERE tm1.player_id = ? AND tm2.player_id = ?
+    ORDER BY tm1.season, tm1.team_id
+    ;"""
+    hops = []
+    for idx, player_id in enumerate(player_id_sequence):
+        shared_team = None
+        if idx + 1 < len(player_id_sequence):
+            cursor.execute(shared_query, (player_id, player_id_sequence[idx+1]))
+            for team_id, team, season in cursor.fetchall():
+                if (seasons is None or season in seasons) and (teams is None or team_id in teams) \
+                        and team_id not in avoid_teams:
+                    shared_team = f"{team} ({season-1}-{season})"
+                    break
+        hops.append( (player_id, database.get_player_name_from_id(player_id, db_filename), shared_team) )
+    return graph_operations.format_path(hops)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shortest path between two players, within some seasons or teams.")
+    parser.add_argument("db_file")
+    parser.add_argument("source", help="player id or unique name")
+    parser.add_argument("target", nargs="?", default="jagrja01", help="player id or unique name (default: Jagr)")
+    parser.add_argument("--seasons", metavar="FIRST-LAST", default=None,
+                        help="only use rosters of these seasons (end years, e.g. 1917-1989)")
+    parser.add_argument("--teams", metavar="IDS", default=None, help="only use rosters of these teams (comma-separated)")
+    parser.add_argument("--avoid-teams", metavar="IDS", default="", help="never use rosters of these teams (comma-separated)")
+    args = parser.parse_args()
+
+    seasons = None
+    if args.seasons:
+        first, _, last = args.seasons.partition("-")
+        seasons = range(int(first), int(last or first) + 1)
+    teams = [team_id for team_id in args.teams.split(",") if team_id] if args.teams else None
+    avoid_teams = [team_id for team_id in args.avoid_teams.split(",") if team_id]
+
+    # Builds "teammate_edges", or adds the masks to one built before they existed (queries only read).
+    database.make_teammates_table(args.db_file)
+    source_id = helpers.resolve_player_query(args.source, args.db_file)
+    target_id = helpers.resolve_player_query(args.target, args.db_file)
+    if source_id is None or target_id is None:
+        sys.exit(1)
+    try:
+        path = constrained_path(source_id, target_id, args.db_file, seasons=seasons, teams=teams, avoid_teams=avoid_teams)
+    except ValueError as err:
+        parser.error(str(err))
+    if path is None:
+        print("No path within these constraints.")
+    else:
+        distance, result = render_constrained_path(path, args.db_file, seasons=seasons, teams=teams,
+                                                   avoid_teams=avoid_teams)
+        print(f"Distance = {distance}:")
+        print(result)
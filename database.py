@@ -1,66 +1,370 @@
 # Python code for building and updating the database.
 import sqlite3, os, time
 import unicodedata # for removing diacritics from player names.
-import scraper # my custom scraper, in scraper.py
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv_helpers # in csv_helpers.py
+import instrumentation # in instrumentation.py
 
 ########################################################################
 # Function signatures for functions herein:
 #
 # add_teams_to_table(db_filename, team_id_to_name_dict) 
-# add_to_database(db_filename, team_names_csv, team_seasons_csv)
+# add_to_database(db_filename, team_names_csv, team_seasons_csv, cache_dir=None, replay=False, ttl=None)
+# add_to_database_from_archive(db_filename, team_names_csv, team_seasons_csv, archive_dir, processes=None,
+#                              batch_size=500)
 # add_to_database_from_roster_dict(db_filename, roster_dict, team_id, year) 
-# check_bfs_parent_ready(db_filename):
+# add_roster_teammates(cursor, team_id, year)
+# add_to_database_pipelined(db_filename, team_names_csv, team_seasons_csv, requests_per_minute=None, num_workers=4,
+#                           base_url=None, cache_dir=None, ttl=None, batch_size=100, flush_interval=30)
+# bump_db_version(cursor)
+# check_bfs_parent_ready(db_filename, root='jagrja01'):
+# close_connections()
 # common_team(player1_id, player2_id, db_filename)
+# evict_bfs_roots(db_filename, max_roots=MAX_BFS_ROOTS, keep=())
+# get_all_bfs_depths(cursor, root='jagrja01')
+# get_all_bfs_parents(cursor, root='jagrja01')
 # get_all_players(db_filename)
-# get_bfs_parent(player_id, db_filename)
+# get_bfs_parent(player_id, db_filename, root='jagrja01')
+# get_bfs_depth(player_id, db_filename, root='jagrja01')
+# get_bfs_depths(cursor, player_ids, root='jagrja01')
+# get_bfs_roots(db_filename)
+# get_connection(db_filename)
+# get_db_meta(db_filename)
+# get_db_version(db_filename)
+# get_depth_histogram(db_filename, root='jagrja01')
+# get_pending_seasons(db_filename, team_seasons_csv)
+# get_shared_teams(pairs, db_filename)
 # get_player_name_from_id(player_id, db_filename)
-# make_BFS_parent_table(bfs_parent_dict, db_filename)
+# get_teammate_ids(cursor, player_id)
+# make_BFS_parent_table(bfs_parent_dict, db_filename, root='jagrja01')
 # make_teammates_table(db_filename)
-# remove_diacritics(name)                                  
+# set_bfs_parents(cursor, changed_parents, depths, root='jagrja01')
+# set_db_meta(db_filename, **values)
+# remove_diacritics(name)
+# resolve_bfs_path(player_id, db_filename, root='jagrja01')
+# resolve_bfs_paths(player_ids, db_filename, root='jagrja01')
 # set_up_db(db_filename)
+# touch_bfs_root(db_filename, root)
+#
+# class BulkWriter(db_filename, batch_size=100, flush_interval=None, rebuild_derived=False, keep_wal=False)
 #
 ########################################################################
 
-def add_to_database(db_filename, team_names_csv, team_seasons_csv):
+# Templates for inserting rosters (see _insert_roster and _insert_rosters).
+PLAYER_QUERY = "INSERT OR REPLACE INTO players (id, first_name, last_name) VALUES (?,?,?)"
+TEAM_MEMBERSHIP_QUERY = "INSERT OR REPLACE INTO team_membership (player_id, team_id, season) VALUES (?,?,?)"
+
+# Team of the earliest roster shared by a pair of teammates, aggregated over their shared rosters
+# (tm1 memberships): the first by (season, team_id), so that ties within a season always go to the
+# same team (see graph_operations.bipartite_shared_team). Seasons are 4-digit years, so that order
+# is also the order of season || team_id.
+FIRST_TEAM_ID = "substr(MIN(tm1.season || tm1.team_id), 5)"
+
+# Connection settings of BulkWriter: a write-ahead log during the load (checkpointed and switched back
+# to the previous journal mode on close, unless keep_wal=True), fsync at checkpoints only, and a
+# 64 MB page cache.
+BULK_PRAGMAS = ["PRAGMA journal_mode = WAL;", "PRAGMA synchronous = NORMAL;", "PRAGMA cache_size = -65536;"]
+
+# Long-lived connections for read queries, one per database file (see get_connection).
+_connections = dict()
+
+# Per-edge bitmasks of "teammate_edges" (see make_teammates_table), each kept in two 64-bit words:
+#   season_mask_lo / _hi: bit (season - FIRST_MASK_SEASON), for seasons FIRST_MASK_SEASON to FIRST_MASK_SEASON + 127,
+#   team_mask_lo / _hi:   bit "bit" of the team in "team_bits", for the first 128 teams seen.
+# Bits 63 and 127 make the words negative: SQLite integers are signed.
+FIRST_MASK_SEASON = 1917
+EDGE_MASKS = f"""
+    SUM(DISTINCT CASE WHEN tm1.season - {FIRST_MASK_SEASON} BETWEEN 0 AND 63 THEN 1 << (tm1.season - {FIRST_MASK_SEASON}) ELSE 0 END) AS season_mask_lo,
+    SUM(DISTINCT CASE WHEN tm1.season - {FIRST_MASK_SEASON} BETWEEN 64 AND 127 THEN 1 << (tm1.season - {FIRST_MASK_SEASON} - 64) ELSE 0 END) AS season_mask_hi,
+    SUM(DISTINCT CASE WHEN team_bits.bit BETWEEN 0 AND 63 THEN 1 << team_bits.bit ELSE 0 END) AS team_mask_lo,
+    SUM(DISTINCT CASE WHEN team_bits.bit BETWEEN 64 AND 127 THEN 1 << (team_bits.bit - 64) ELSE 0 END) AS team_mask_hi"""
+
+# Revision of the table layout that _set_up_tables migrates older databases to (e.g. the bitmasks
+# of "teammate_edges"); incremented with every such migration, so that main.prepare_database runs
+# set_up_db again on a database prepared under an older revision.
+SCHEMA_REVISION = 2
+
+# Number of BFS trees (one per root player) kept in "bfs_parent_by_root"; the least recently
+# used ones beyond this are deleted by evict_bfs_roots.
+MAX_BFS_ROOTS = 16
+
+
+class BulkWriter:
+    """
+    Writes many rosters to db_filename through one connection, for ingestion runs:
+        - the connection is opened once, in WAL mode, with synchronous=NORMAL and a larger page cache
+          (BULK_PRAGMAS), and the tables are set up on it (see set_up_db),
+        - rosters given to add_roster are buffered and written batch_size at a time, one transaction
+          per batch (or sooner, once flush_interval seconds passed since the last one, if given),
+          each roster together with its "scrape_log" entry,
+        - if the derived tables are not kept up to date roster by roster (they are empty, or
+          rebuild_derived=True, see _insert_rosters), the roster index of "team_membership" is
+          dropped during the load and built once in close(),
+        - close() checkpoints the write-ahead log into the database file and restores the journal
+          mode the database had before, so it is left as a single file. With keep_wal=True it stays
+          in WAL mode instead (readers then never block a later writer, nor it them).
+    With derived tables to keep up to date, each roster goes through _insert_roster instead, as in
+    add_to_database_from_roster_dict, but still batch_size rosters per transaction.
+
+    Use as a context manager (or call close()); stats() gives the rows written per second.
+    """
+
+    def __init__(self, db_filename, batch_size=100, flush_interval=None, rebuild_derived=False, keep_wal=False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_wal = keep_wal
+        self.conn = _connect(db_filename)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("PRAGMA journal_mode;")
+        self.journal_mode = self.cursor.fetchone()[0]
+        for pragma in BULK_PRAGMAS:
+            self.cursor.execute(pragma)
+        _set_up_tables(self.cursor)
+
+        self.incremental = False
+        if not rebuild_derived and _table_exists(self.cursor, "teammate_edges"):
+            self.cursor.execute("SELECT COUNT(*) FROM (SELECT 1 FROM teammate_edges LIMIT 1);")
+            self.incremental = self.cursor.fetchone()[0] > 0
+        if not self.incremental:
+            self.cursor.execute("DROP INDEX IF EXISTS team_membership_roster_idx;")
+        self.conn.commit()
+
+        self.pending = []       # (team_id, year, roster_dict) not written yet
+        self.num_rosters = 0
+        self.num_rows = 0       # rows written to "players", "team_membership" and "scrape_log"
+        self.start = self.last_flush = time.perf_counter()
+        self.seconds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def add_teams(self, team_id_to_name_dict):
+        """
+        Same as add_teams_to_table, in the current transaction.
+        """
+        self.cursor.executemany("INSERT OR REPLACE INTO teams (id, name) VALUES (?,?)", team_id_to_name_dict.items())
+
+    def add_roster(self, roster_dict, team_id, year):
+        """
+        Queues one roster (None counts as an empty one), and writes the queue if it is due.
+        """
+        self.pending.append( (team_id, year, roster_dict) )
+        if len(self.pending) >= self.batch_size or \
+                (self.flush_interval is not None and time.perf_counter() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the queued rosters in one transaction.
+        """
+        with instrumentation.span("database.bulk_flush"):
+            if self.incremental:
+                for team_id, year, roster_dict in self.pending:
+                    _insert_roster(self.cursor, roster_dict or dict(), team_id, year)
+            elif self.pending:
+                _insert_rosters(self.cursor, self.pending)
+            self.conn.commit()
+        self.num_rosters += len(self.pending)
+        self.num_rows += sum(2 * len(roster_dict or ()) + 1 for _, _, roster_dict in self.pending)
+        self.pending = []
+        self.last_flush = time.perf_counter()
+
+    def close(self):
+        """
+        Writes what is left, builds the indexes dropped for the load, leaves WAL mode (unless
+        keep_wal) and closes the connection.
+        """
+        if self.seconds is not None:
+            return
+        self.flush()
+        with instrumentation.span("database.bulk_indexes"):
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS team_membership_roster_idx "
+                                "ON team_membership (team_id, season, player_id);")
+            self.conn.commit()
+        if not self.keep_wal and self.journal_mode.lower() != "wal":
+            # Results are fetched, so that no statement is left running when the connection closes.
+            self.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+            try:
+                self.cursor.execute(f"PRAGMA journal_mode = {self.journal_mode};").fetchall()
+            except sqlite3.OperationalError:
+                # Another connection is reading the file (leaving WAL needs exclusive access):
+                # the log was emptied by the checkpoint, and the file stays in WAL mode.
+                pass
+        self.conn.close()
+        self.seconds = time.perf_counter() - self.start
+        instrumentation.count("database.bulk_rows", self.num_rows)
+
+    def stats(self):
+        """
+        Returns {"rosters", "rows", "seconds", "rows_per_second"} for the rosters written so far
+        (seconds from the opening of the writer to close(), or to now).
+        """
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.start
+        return {"rosters": self.num_rosters, "rows": self.num_rows, "seconds": seconds,
+                "rows_per_second": self.num_rows / seconds if seconds > 0 else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        print(f"Wrote {stats['rosters']} roster(s), {stats['rows']} rows in {stats['seconds']:.2f} s "
+              f"({stats['rows_per_second']:,.0f} rows/s).")
+
+
+def _connect(db_filename, **kwargs):
+    """
+    sqlite3.connect, used for every connection of this file. When instrumentation is enabled
+    (see instrumentation.py), counts the connections opened and the statements run on them.
+    """
+    conn = sqlite3.connect(db_filename, **kwargs)
+    if instrumentation.ENABLED:
+        instrumentation.count("sqlite.connections")
+        conn.set_trace_callback(lambda statement: instrumentation.count("sqlite.statements"))
+    return conn
+
+
+def add_to_database(db_filename, team_names_csv, team_seasons_csv, cache_dir=None, replay=False, ttl=None):
     """
     Fills "players", "teams", "team_membership" tables of database at db_filename, 
     using 2 CSV files: 
       one for mapping team_ids to team names, 
       other maps team_id to both inaugural and most recent seasons. 
+
+    With a cache_dir, roster pages are read from / saved to that local HTML cache (see scraper.py),
+    and we only wait between requests that actually go to the network.
+    With replay=True, the database is rebuilt from the cache alone: no network calls, no sleeps.
+    ttl defaults to scraper.CURRENT_SEASON_TTL.
+
+    Only (team_id, season) pairs not yet marked "done" in the "scrape_log" table are fetched,
+    and each roster is committed together with its log entry. So an interrupted run resumes
+    where it stopped, and adding a season to the CSV only fetches that season.
+    (With replay=True, rosters are committed 100 at a time.)
     """
-    set_up_db(db_filename)
+    import scraper # imported here, so that lookups never pay for importing requests and bs4
+    if ttl is None:
+        ttl = scraper.CURRENT_SEASON_TTL
+    if replay and cache_dir is None:
+        cache_dir = scraper.DEFAULT_CACHE_DIR
 
-    # Extract team ids, names from CSV:
-    team_id_to_name = csv_helpers.get_team_ids_and_names(team_names_csv) 
-    # For each item in this dict, make/replace an entry in the "teams" table.
-    add_teams_to_table( db_filename, team_id_to_name )  
+    # One connection for the whole run (see BulkWriter). Scraped rosters are committed one by one,
+    # since each takes seconds to fetch; replayed ones, in batches.
+    with BulkWriter(db_filename, batch_size=100 if replay else 1) as writer:
+        # Extract team ids, names from CSV:
+        team_id_to_name = csv_helpers.get_team_ids_and_names(team_names_csv)
+        # For each item in this dict, make/replace an entry in the "teams" table.
+        writer.add_teams( team_id_to_name )
 
-    # Extract team_id and season range for each team, store in a dict
-    team_id_to_seasons = csv_helpers.get_team_ids_and_seasons(team_seasons_csv) 
-    
-    # Fetch and add team_membership data for each team_id and the specified years.
-    for team_id in team_id_to_seasons.keys():
+        # Fetch and add team_membership data for each team_id and year not ingested yet.
+        for team_id, year in get_pending_seasons(db_filename, team_seasons_csv):
+            if not replay and not scraper.is_roster_cached(cache_dir, team_id, year, ttl):
+                with instrumentation.span("scraper.sleep"):
+                    time.sleep(3) # Wait 3 seconds, to respect scraping rule on HockeyReference (<= 20 requests/mins)
+            roster_dict = scraper.scrape_roster(team_id, year, cache_dir=cache_dir, offline=replay, ttl=ttl)
 
-        inaugural, most_recent = team_id_to_seasons[team_id]
-        inaugural = int(inaugural)
-        most_recent = int(most_recent)
+            writer.add_roster(roster_dict, team_id, year)
+    writer.report()
+    return
 
-        for year in range(inaugural, most_recent + 1):
-            time.sleep(3) # Wait 5 seconds, to respect scraping rule on HockeyReference (<= 20 requests/mins)
-            roster_dict = scraper.scrape_roster(team_id,year)
 
-            add_to_database_from_roster_dict(db_filename, roster_dict, team_id, year)  
+def add_to_database_pipelined(db_filename, team_names_csv, team_seasons_csv,
+                              requests_per_minute=None, num_workers=4, base_url=None, cache_dir=None, ttl=None,
+                              batch_size=100, flush_interval=30):
+    """
+    Same result as add_to_database(), but pipelined so that the rate limit is the only bottleneck:
+        - num_workers threads share one scraper.RateLimiter, which spaces requests exactly
+          60 / requests_per_minute seconds apart (no fixed sleep on top of the request time),
+        - they share one keep-alive session (scraper.make_session), so connections are reused,
+        - each worker parses its own page while the others wait on the network,
+        - the calling thread writes the parsed rosters through one BulkWriter, batch_size rosters
+          per transaction, and at least every flush_interval seconds (so an interrupted run
+          only loses that much work).
 
+    Like add_to_database(), only fetches pairs not marked "done" in "scrape_log".
+    base_url can point at a local stub server for testing.
+    With a cache_dir, cached pages are used without taking a rate-limiter token.
+    requests_per_minute, base_url and ttl default to the constants of scraper.py.
+    """
+    import scraper # imported here, so that lookups never pay for importing requests and bs4
+    requests_per_minute = requests_per_minute or scraper.REQUESTS_PER_MINUTE
+    base_url = base_url or scraper.HOCKEY_REFERENCE_URL
+    ttl = scraper.CURRENT_SEASON_TTL if ttl is None else ttl
+
+    writer = BulkWriter(db_filename, batch_size=batch_size, flush_interval=flush_interval)
+    writer.add_teams( csv_helpers.get_team_ids_and_names(team_names_csv) )
+
+    jobs = get_pending_seasons(db_filename, team_seasons_csv)
+
+    limiter = scraper.RateLimiter(requests_per_minute)
+    session = scraper.make_session(pool_size=num_workers)
+
+    def fetch_and_parse(team_id, year):
+        if year == scraper.LOCKOUT_SEASON:
+            return dict()
+        html = scraper.get_roster_html(team_id, year, cache_dir=cache_dir, ttl=ttl,
+                                       session=session, limiter=limiter, base_url=base_url)
+        if html is None:
+            return dict()
+        roster_dict = scraper.parse_roster_html(html, team_id, year)
+        return roster_dict if roster_dict is not None else dict()
+
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            futures = { pool.submit(fetch_and_parse, team_id, year): (team_id, year) for team_id, year in jobs }
+            for future in as_completed(futures):
+                team_id, year = futures[future]
+                writer.add_roster(future.result(), team_id, year)
+    finally:
+        session.close()
+        writer.close()
+    writer.report()
+    return
+
+
+def add_to_database_from_archive(db_filename, team_names_csv, team_seasons_csv, archive_dir, processes=None,
+                                 batch_size=500):
+    """
+    Same result as add_to_database(), offline, from a directory of saved roster pages
+    (see archive.py for the layouts recognized, including the HTML cache of scraper.py).
+
+    The pages of the pending (team_id, season) pairs are read and parsed by a pool of processes
+    (default: one per CPU), with a targeted extractor instead of BeautifulSoup, and the rosters
+    are written by a BulkWriter, batch_size per transaction. Pairs without a saved page are
+    logged as "failed" (except the lock-out season), as in a replay of the HTML cache.
+    """
+    import archive # in archive.py
+
+    set_up_db(db_filename)
+    pending = get_pending_seasons(db_filename, team_seasons_csv)
+    with instrumentation.span("archive.find_pages"):
+        pages = archive.find_roster_pages(archive_dir)
+    jobs = [ (team_id, year, pages[(team_id, year)]) for team_id, year in pending if (team_id, year) in pages ]
+    if len(jobs) < len(pending):
+        print(f"No saved page for {len(pending) - len(jobs)} roster(s) in {archive_dir}.")
+
+    with instrumentation.span("archive.parse"):
+        rosters = archive.parse_archive(jobs, processes=processes)
+    instrumentation.count("archive.pages_parsed", len(rosters))
+    rosters.extend( (team_id, year, None) for team_id, year in pending if (team_id, year) not in pages )
+
+    # The writer's connection is opened after the pool is done, so it is never shared with a forked process.
+    with instrumentation.span("archive.insert"):
+        with BulkWriter(db_filename, batch_size=batch_size, rebuild_derived=True) as writer:
+            writer.add_teams( csv_helpers.get_team_ids_and_names(team_names_csv) )
+            for team_id, year, roster_dict in rosters:
+                writer.add_roster(roster_dict, team_id, year)
+    writer.report()
     return
 
+
 def add_teams_to_table(db_filename, team_id_to_name_dict):
     """
     Uses a dictionary mapping team_id to team name and adds corr. entries to the database at db_filename. 
 
     Supposes that the database at db_filename has been correctly set up.
     """
-    conn = sqlite3.connect(db_filename)
+    conn = _connect(db_filename)
     cursor = conn.cursor() 
     cursor.executemany("INSERT OR REPLACE INTO teams (id, name) VALUES (?,?)", team_id_to_name_dict.items() )
     conn.commit()
@@ -75,88 +379,361 @@ def add_to_database_from_roster_dict(db_filename, roster_dict, team_id, year):
         - team_id (supplied as argument)
         - year (supplied as argument)
 
+    Also records the roster in "scrape_log", in the same transaction:
+        - "done" if players were found (or for the cancelled lock-out season),
+        - "failed" otherwise, so that a later run retries it.
+
+    The roster's players are joined into one component of the "union_find" table (see union_find.py).
+    If the "teammate_edges" table was already built, only this roster's teammate pairs are
+    added / updated in it, and every BFS tree in "bfs_parent_by_root" is repaired from the affected
+    players (see graph_operations.repair_BFS_tree) instead of being recomputed.
+
     Assumes it is being called within a call to [database.] add_to_database() 
     """
 
     # Connect to the database and make a cursor:
-    conn = sqlite3.connect(db_filename)
+    conn = _connect(db_filename)
     cursor = conn.cursor()
 
-    # Prepare template for insertion queries:
-    player_query = "INSERT OR REPLACE INTO players (id, first_name, last_name) VALUES (?,?,?)"
-    team_membership_query = "INSERT OR REPLACE INTO team_membership (player_id, team_id, season) VALUES (?,?,?)"
+    _insert_roster(cursor, roster_dict, team_id, year)
+
+    conn.commit()
+    conn.close()
+    return 
+
+
+def _insert_roster(cursor, roster_dict, team_id, year):
+    """
+    Executes (without committing) the inserts of add_to_database_from_roster_dict on an open cursor,
+    including its "scrape_log" entry.
+    """
+    player_fill_data, team_membership_fill_data = _roster_rows(roster_dict, team_id, year)
+
+    # Once batch instructions for SQL inserting is done, execute:
+    cursor.executemany(PLAYER_QUERY, player_fill_data)
+    cursor.executemany(TEAM_MEMBERSHIP_QUERY, team_membership_fill_data)
+    instrumentation.count("database.rosters_inserted")
+    instrumentation.count("database.memberships_inserted", len(team_membership_fill_data))
+    if roster_dict:
+        import union_find # imported here, since union_find imports this file
+        union_find.union_groups(cursor, [roster_dict.keys()])
+    bump_db_version(cursor)
+
+    import scraper # imported here (see add_to_database)
+    status = "done" if roster_dict or int(year) == scraper.LOCKOUT_SEASON else "failed"
+    cursor.execute("INSERT OR REPLACE INTO scrape_log (team_id, season, status, num_players, updated_at) "
+                   "VALUES (?,?,?,?,CURRENT_TIMESTAMP)", (team_id, year, status, len(roster_dict)))
+
+    # Keep the derived tables up to date, if they exist.
+    if roster_dict and _table_exists(cursor, "teammate_edges"):
+        new_pairs = add_roster_teammates(cursor, team_id, year)
+        if _table_exists(cursor, "bfs_roots"):
+            import graph_operations # imported here, since graph_operations imports this file
+            cursor.execute("SELECT root_id FROM bfs_roots;")
+            for root in [row[0] for row in cursor.fetchall()]:
+                graph_operations.repair_BFS_tree(cursor, new_pairs, roster_dict.keys(), root=root)
+    return
+
+
+def _insert_rosters(cursor, rosters):
+    """
+    Bulk version of _insert_roster, for many rosters in one transaction (on an open cursor, without
+    committing): rosters is a list of (team_id, year, roster_dict), with None counting as an empty roster.
+
+    Instead of merging each roster into "teammate_edges" and repairing the BFS trees one roster at
+    a time, the derived tables are emptied, and make_teammates_table / main.ensure_bfs_parent
+    rebuild them in one pass.
+    """
+    import scraper # imported here (see add_to_database)
+    player_fill_data, team_membership_fill_data, scrape_log_fill_data = [], [], []
+    for team_id, year, roster_dict in rosters:
+        roster_dict = roster_dict or dict()
+        players, memberships = _roster_rows(roster_dict, team_id, year)
+        player_fill_data.extend(players)
+        team_membership_fill_data.extend(memberships)
+        status = "done" if roster_dict or int(year) == scraper.LOCKOUT_SEASON else "failed"
+        scrape_log_fill_data.append( (team_id, year, status, len(roster_dict)) )
+
+    cursor.executemany(PLAYER_QUERY, player_fill_data)
+    cursor.executemany(TEAM_MEMBERSHIP_QUERY, team_membership_fill_data)
+    cursor.executemany("INSERT OR REPLACE INTO scrape_log (team_id, season, status, num_players, updated_at) "
+                       "VALUES (?,?,?,?,CURRENT_TIMESTAMP)", scrape_log_fill_data)
+    instrumentation.count("database.rosters_inserted", len(scrape_log_fill_data))
+    instrumentation.count("database.memberships_inserted", len(team_membership_fill_data))
+    import union_find # imported here, since union_find imports this file
+    union_find.union_groups(cursor, [roster_dict.keys() for _, _, roster_dict in rosters if roster_dict])
+
+    if team_membership_fill_data:
+        if _table_exists(cursor, "teammate_edges"):
+            cursor.execute("DELETE FROM teammate_edges;")
+        if _table_exists(cursor, "bfs_roots"):
+            cursor.execute("DELETE FROM bfs_parent_by_root;")
+            cursor.execute("DELETE FROM bfs_ancestors;")
+            cursor.execute("DELETE FROM bfs_roots;")
+    bump_db_version(cursor)
+
 
+def _roster_rows(roster_dict, team_id, year):
+    """
+    Returns the rows to insert for one roster: (player_id, first, last) for PLAYER_QUERY
+    and (player_id, team_id, year) for TEAM_MEMBERSHIP_QUERY.
+    """
     # Prepare list for batch execution of SQL commands (for efficiency)
-    player_fill_data = []   # for filling player_query
-    team_membership_fill_data = [] # for team_membership_query
-    
+    player_fill_data = []   # for filling PLAYER_QUERY
+    team_membership_fill_data = [] # for TEAM_MEMBERSHIP_QUERY
+
     # Loop over all players:
     for player_id in roster_dict.keys():
         last, first = roster_dict[player_id].split(',')
-        
+
         first = first.strip()
-        first = remove_diacritics(first) 
+        first = remove_diacritics(first)
 
         last = last.strip()
-        last = remove_diacritics(last) 
+        last = remove_diacritics(last)
 
         player_fill_data.append( (player_id, first, last) )
         team_membership_fill_data.append( (player_id, team_id, year))
-        
-    # Once batch instructions for SQL inserting is done, execute:
-    cursor.executemany(player_query, player_fill_data)
-    cursor.executemany(team_membership_query, team_membership_fill_data)
+    return player_fill_data, team_membership_fill_data
 
-    conn.commit()
-    conn.close()
-    return 
+
+def _create_db_meta(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID;")
+
+
+def bump_db_version(cursor):
+    """
+    Gives the database a new version stamp (a random token in "db_meta"), on an open cursor,
+    without committing. Called by every function that changes the players, rosters, teammates
+    or BFS trees, so that anything derived from an older version (e.g. a snapshot) is rebuilt.
+    """
+    _create_db_meta(cursor)
+    cursor.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES ('version', lower(hex(randomblob(8))));")
 
 
-def check_bfs_parent_ready(db_filename):
+def _table_exists(cursor, table_name):
+    cursor.execute( "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,) )
+    return cursor.fetchone() is not None
+
+
+def add_roster_teammates(cursor, team_id, year):
+    """
+    Merges the pairs of players on the (team_id, year) roster into the "teammate_edges" table
+    (on an open cursor, without committing): each pair's row is recomputed from team_membership,
+    so re-ingesting a roster never double-counts its shared seasons.
+
+    Returns the list of pairs (teammate1_id, teammate2_id), with teammate1_id < teammate2_id,
+    that were not teammates before.
+    """
+    new_pairs_query = """
+    SELECT tm1.player_id, tm2.player_id
+    FROM team_membership tm1
+    JOIN team_membership tm2
+    ON tm1.team_id = tm2.team_id
+    AND tm1.season = tm2.season
+    WHERE tm1.team_id = ? AND tm1.season = ?
+    AND tm1.player_id < tm2.player_id
+    AND NOT EXISTS (
+        SELECT 1 FROM teammate_edges
+        WHERE teammate1_id = tm1.player_id AND teammate2_id = tm2.player_id
+        )
+    ;
+    """
+    cursor.execute(new_pairs_query, (team_id, year))
+    new_pairs = cursor.fetchall()
+    _assign_team_bits(cursor, [team_id])
+
+    update_edges_query = f"""
+    WITH roster_pairs AS (
+        SELECT r1.player_id AS teammate1_id, r2.player_id AS teammate2_id
+        FROM team_membership r1
+        JOIN team_membership r2
+        ON r1.team_id = r2.team_id
+        AND r1.season = r2.season
+        WHERE r1.team_id = ? AND r1.season = ?
+        AND r1.player_id < r2.player_id
+        )
+    --
+    INSERT OR REPLACE INTO teammate_edges (teammate1_id, teammate2_id, shared_seasons, first_team_id, first_season,
+                                           season_mask_lo, season_mask_hi, team_mask_lo, team_mask_hi)
+        SELECT tm1.player_id, tm2.player_id, COUNT(*), {FIRST_TEAM_ID}, MIN(tm1.season), {EDGE_MASKS}
+        FROM roster_pairs
+        JOIN team_membership tm1 ON tm1.player_id = roster_pairs.teammate1_id
+        JOIN team_membership tm2 ON tm2.player_id = roster_pairs.teammate2_id
+        AND tm1.team_id = tm2.team_id
+        AND tm1.season = tm2.season
+        LEFT JOIN team_bits ON team_bits.team_id = tm1.team_id
+        GROUP BY tm1.player_id, tm2.player_id
+    ;
+    """
+    cursor.execute(update_edges_query, (team_id, year))
+    return new_pairs
+
+
+def _assign_team_bits(cursor, team_ids):
+    """
+    Gives each team of team_ids that has none yet the next free bit of the team masks of
+    "teammate_edges" (in "team_bits"), on an open cursor. Teams beyond the first 128 get bits
+    that do not fit in the masks: constrained_paths.team_mask refuses them.
     """
-    Checks whether the table "bfs_parent" has been made yet.
+    cursor.execute("CREATE TABLE IF NOT EXISTS team_bits (team_id TEXT PRIMARY KEY, bit INTEGER UNIQUE);")
+    cursor.executemany("INSERT OR IGNORE INTO team_bits (team_id, bit) SELECT ?, COUNT(*) FROM team_bits;",
+                       [ (team_id,) for team_id in team_ids ])
+
+
+def _add_edge_masks(cursor):
+    """
+    Adds the bitmask columns to a "teammate_edges" table built before they existed, and fills them
+    from team_membership (on an open cursor, without committing). Does nothing if they exist.
+    """
+    cursor.execute("PRAGMA table_info(teammate_edges);")
+    if "season_mask_lo" in [row[1] for row in cursor.fetchall()]:
+        return
+    for column in ["season_mask_lo", "season_mask_hi", "team_mask_lo", "team_mask_hi"]:
+        cursor.execute(f"ALTER TABLE teammate_edges ADD COLUMN {column} INTEGER;")
+    cursor.execute("SELECT DISTINCT team_id FROM team_membership ORDER BY team_id;")
+    _assign_team_bits(cursor, [row[0] for row in cursor.fetchall()])
+    cursor.execute(f"""
+    UPDATE teammate_edges
+    SET season_mask_lo = masks.season_mask_lo, season_mask_hi = masks.season_mask_hi,
+        team_mask_lo = masks.team_mask_lo, team_mask_hi = masks.team_mask_hi
+    FROM (
+        SELECT tm1.player_id AS teammate1_id, tm2.player_id AS teammate2_id, {EDGE_MASKS}
+        FROM team_membership tm1
+        JOIN team_membership tm2
+        ON tm1.team_id = tm2.team_id
+        AND tm1.season = tm2.season
+        LEFT JOIN team_bits ON team_bits.team_id = tm1.team_id
+        WHERE tm1.player_id < tm2.player_id
+        GROUP BY tm1.player_id, tm2.player_id
+        ) AS masks
+    WHERE teammate_edges.teammate1_id = masks.teammate1_id AND teammate_edges.teammate2_id = masks.teammate2_id
+    ;""")
+    bump_db_version(cursor)
+
+
+def _create_bfs_tables(cursor):
+    """
+    Creates the tables holding BFS trees, if needed:
+        - "bfs_parent_by_root": one row per (root, player), with the player's BFS parent and depth
+          (distance to root) in the tree of root,
+        - "bfs_ancestors": the binary-lifting table of each tree, one row per (root, player, level)
+          with the ancestor 2**level steps above the player (see graph_operations.bfs_ancestor_rows),
+        - "bfs_roots": one row per root whose tree is stored, with when it was built and last used.
+    Trees stored before depths existed get their "depth" column and ancestors filled in here.
+    """
+    bfs_parent_query = """
+    CREATE TABLE IF NOT EXISTS bfs_parent_by_root (
+        root_id TEXT,
+        player_id TEXT,
+        parent_id TEXT, -- "HIMSELF" for the root, "DISCONNECTED" if not connected to the root
+        depth INTEGER,  -- number of hops to the root, NULL if not connected to the root
+        FOREIGN KEY (root_id) REFERENCES players(id),
+        FOREIGN KEY (player_id) REFERENCES players(id),
+        PRIMARY KEY (root_id, player_id)
+    ) WITHOUT ROWID;"""
+    cursor.execute(bfs_parent_query)
+
+    cursor.execute("PRAGMA table_info(bfs_parent_by_root);")
+    missing_depths = "depth" not in [row[1] for row in cursor.fetchall()]
+    if missing_depths:
+        cursor.execute("ALTER TABLE bfs_parent_by_root ADD COLUMN depth INTEGER;")
+
+    # Covering index for histograms of depths (see get_depth_histogram).
+    cursor.execute("CREATE INDEX IF NOT EXISTS bfs_depth_idx ON bfs_parent_by_root (root_id, depth);")
+
+    bfs_ancestors_query = """
+    CREATE TABLE IF NOT EXISTS bfs_ancestors (
+        root_id TEXT,
+        player_id TEXT,
+        level INTEGER,
+        ancestor_id TEXT,
+        PRIMARY KEY (root_id, player_id, level)
+    ) WITHOUT ROWID;"""
+    cursor.execute(bfs_ancestors_query)
+
+    bfs_roots_query = """
+    CREATE TABLE IF NOT EXISTS bfs_roots (
+        root_id TEXT PRIMARY KEY,
+        built_at TEXT, -- UTC timestamps
+        last_used TEXT,
+        FOREIGN KEY (root_id) REFERENCES players(id)
+    );"""
+    cursor.execute(bfs_roots_query)
+
+    if missing_depths:
+        cursor.execute("SELECT DISTINCT root_id FROM bfs_parent_by_root;")
+        for (root,) in cursor.fetchall():
+            parent = get_all_bfs_parents(cursor, root=root)
+            _store_bfs_rows(cursor, parent, parent, root)
+        bump_db_version(cursor)
+
+
+def _store_bfs_rows(cursor, tree, players, root):
+    """
+    Writes the rows of the players in "players" (an iterable of player ids) of the BFS tree of root,
+    given in full as the dict "tree" (player_id -> parent_id): their parents, depths and ancestors,
+    computed from the whole tree (on an open cursor, without committing).
+    """
+    import graph_operations # imported here, since graph_operations imports this file
+    depth = graph_operations.bfs_tree_depths(tree)
+    players = set(players)
+    cursor.executemany("INSERT OR REPLACE INTO bfs_parent_by_root (root_id, player_id, parent_id, depth) VALUES (?,?,?,?)",
+                       [ (root, player_id, tree[player_id], depth[player_id]) for player_id in players ])
+    cursor.executemany("DELETE FROM bfs_ancestors WHERE root_id = ? AND player_id = ?;",
+                       [ (root, player_id) for player_id in players ])
+    cursor.executemany("INSERT INTO bfs_ancestors (root_id, player_id, level, ancestor_id) VALUES (?,?,?,?)",
+                       ( (root,) + row for row in graph_operations.bfs_ancestor_rows(tree, players) ))
+
+
+def check_bfs_parent_ready(db_filename, root='jagrja01'):
+    """
+    Checks whether the BFS tree of root has been stored (in "bfs_parent_by_root") yet.
         - if not, returns 0
         - if so, returns the number of rows.
     """
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    table_name = "bfs_parent"
-    cursor.execute( "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,) )
-    as_list = cursor.fetchall()
-    if len(as_list) == 0:
+    cursor = get_connection(db_filename).cursor()
+    if not _table_exists(cursor, "bfs_parent_by_root"):
         # The table was not initialized yet.
         return 0
 
-    # otherwise, the table exists. count the number of rows.
-    cursor.execute("SELECT COUNT(*) FROM bfs_parent")
+    # otherwise, the table exists. count the number of rows of this root.
+    # Trees stored before depths existed are rebuilt (with them) by make_BFS_parent_table.
+    cursor.execute("PRAGMA table_info(bfs_parent_by_root);")
+    if "depth" not in [row[1] for row in cursor.fetchall()]:
+        return 0
+
+    cursor.execute("SELECT COUNT(*) FROM bfs_parent_by_root WHERE root_id = ?;", (root,))
     res = cursor.fetchone() # should give a tuple, which must be unpacked
     return res[0]
 
 
+def close_connections():
+    """
+    Closes the shared connections opened by get_connection.
+    """
+    for conn in _connections.values():
+        conn.close()
+    _connections.clear()
+
+
 def common_team(player1_id, player2_id, db_filename):
     """
-    Returns team name + season when players appeared on same roster.
+    Returns team name + season when players first appeared on same roster.
+
+    Reads the label precomputed in "teammate_edges" (see make_teammates_table).
     """
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
+    cursor = get_connection(db_filename).cursor()
 
     common_team_query = """
-    WITH p1_tm AS (SELECT team_id, season FROM team_membership WHERE player_id = ?),
-    p2_tm AS (SELECT team_id, season FROM team_membership WHERE player_id = ?),
-    team_and_season AS (
-        SELECT p1_tm.team_id AS team_id, p1_tm.season AS season
-        FROM p1_tm JOIN p2_tm
-        ON p1_tm.team_id = p2_tm.team_id
-        AND p1_tm.season = p2_tm.season
-        )
-    --
-    SELECT name AS team_name, season
-    FROM team_and_season JOIN teams
-    ON team_and_season.team_id = teams.id
+    SELECT teams.name AS team_name, teammate_edges.first_season AS season
+    FROM teammate_edges JOIN teams
+    ON teammate_edges.first_team_id = teams.id
+    WHERE teammate1_id = ? AND teammate2_id = ?
     ;
     """
 
-    cursor.execute(common_team_query, (player1_id, player2_id))
+    cursor.execute(common_team_query, (min(player1_id, player2_id), max(player1_id, player2_id)))
     row = cursor.fetchone()
     if row:
         team, season = row
@@ -164,12 +741,61 @@ def common_team(player1_id, player2_id, db_filename):
     return "Did not play together."
 
 
+def evict_bfs_roots(db_filename, max_roots=MAX_BFS_ROOTS, keep=()):
+    """
+    Deletes the least recently used BFS trees, so that at most max_roots are stored
+    (never deleting the roots in "keep"). Returns the list of evicted roots.
+    """
+    conn = get_connection(db_filename)
+    cursor = conn.cursor()
+    if not _table_exists(cursor, "bfs_roots"):
+        return []
+
+    cursor.execute("SELECT root_id FROM bfs_roots ORDER BY last_used DESC, root_id;")
+    roots = [row[0] for row in cursor.fetchall()]
+    kept = [root for root in roots if root in keep]
+    evicted = []
+    for root in roots:
+        if root in keep:
+            continue
+        if len(kept) < max_roots:
+            kept.append(root)
+        else:
+            evicted.append(root)
+
+    for root in evicted:
+        cursor.execute("DELETE FROM bfs_parent_by_root WHERE root_id = ?;", (root,))
+        cursor.execute("DELETE FROM bfs_ancestors WHERE root_id = ?;", (root,))
+        cursor.execute("DELETE FROM bfs_roots WHERE root_id = ?;", (root,))
+    if evicted:
+        bump_db_version(cursor)
+        conn.commit()
+    return evicted
+
+
+def get_all_bfs_parents(cursor, root='jagrja01'):
+    """
+    Returns the BFS tree of root (from "bfs_parent_by_root") as a dict mapping player_id to parent_id
+    (on an open cursor).
+    """
+    cursor.execute("SELECT player_id, parent_id FROM bfs_parent_by_root WHERE root_id = ?;", (root,))
+    return dict(cursor.fetchall())
+
+
+def get_all_bfs_depths(cursor, root='jagrja01'):
+    """
+    Returns the depths in the BFS tree of root (from "bfs_parent_by_root") as a dict mapping
+    player_id to its distance to root, or None if it is not connected (on an open cursor).
+    """
+    cursor.execute("SELECT player_id, depth FROM bfs_parent_by_root WHERE root_id = ?;", (root,))
+    return dict(cursor.fetchall())
+
+
 def get_all_players(db_filename):
     """
     Returns set of player_ids found in "players" table of db_filename.
     """
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
+    cursor = get_connection(db_filename).cursor()
 
     cursor.execute("SELECT id FROM players;")
 
@@ -180,24 +806,172 @@ def get_all_players(db_filename):
 
     return player_set
 
-def get_bfs_parent(player_id, db_filename):
+def get_bfs_parent(player_id, db_filename, root='jagrja01'):
     """
-    Returns id for BFS parent of player_id,
-    by looking it up in "bfs_parent" table of "db_filename"
+    Returns id for BFS parent of player_id in the BFS tree of root,
+    by looking it up in "bfs_parent_by_root" table of "db_filename"
 
-    Assumes that "bfs_parent" was correctly constructed already.
+    Assumes that the tree of root was correctly constructed already.
     """
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute("SELECT parent_id FROM bfs_parent WHERE player_id = ?;", (player_id,))
+    cursor = get_connection(db_filename).cursor()
+    cursor.execute("SELECT parent_id FROM bfs_parent_by_root WHERE root_id = ? AND player_id = ?;", (root, player_id))
 
     row = cursor.fetchone()
     return row[0]
 
+
+def get_bfs_depth(player_id, db_filename, root='jagrja01'):
+    """
+    Returns the distance between player_id and root, read from the "depth" column of the BFS tree
+    of root: a single lookup. Returns None if the player is not connected to root (or unknown).
+    """
+    cursor = get_connection(db_filename).cursor()
+    cursor.execute("SELECT depth FROM bfs_parent_by_root WHERE root_id = ? AND player_id = ?;", (root, player_id))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def get_bfs_depths(cursor, player_ids, root='jagrja01'):
+    """
+    Returns the depths of the players in player_ids that are in the BFS tree of root, as a dict
+    mapping player_id to its distance to root, or None if it is not connected (on an open cursor).
+    Reads only their rows, 500 players per query.
+    """
+    player_ids = list(player_ids)
+    depths = dict()
+    BATCH_SIZE = 500  # stays well under SQLite's limit on the number of "?" parameters
+    for start in range(0, len(player_ids), BATCH_SIZE):
+        batch = player_ids[start:start + BATCH_SIZE]
+        cursor.execute(f"SELECT player_id, depth FROM bfs_parent_by_root WHERE root_id = ? "
+                       f"AND player_id IN ({', '.join('?' for _ in batch)});", [root] + batch)
+        depths.update(cursor.fetchall())
+    return depths
+
+
+def get_bfs_roots(db_filename):
+    """
+    Returns the roots whose BFS tree is stored, most recently used first,
+    as a list of (root_id, built_at, last_used).
+    """
+    cursor = get_connection(db_filename).cursor()
+    if not _table_exists(cursor, "bfs_roots"):
+        return []
+    cursor.execute("SELECT root_id, built_at, last_used FROM bfs_roots ORDER BY last_used DESC, root_id;")
+    return cursor.fetchall()
+
+def get_connection(db_filename):
+    """
+    Returns a long-lived connection to db_filename, opened on first use and then shared by
+    all read queries (instead of opening a new connection for every lookup).
+
+    It sees every change committed through other connections, and may be used from several threads.
+    """
+    conn = _connections.get(db_filename)
+    if conn is None:
+        conn = _connect(db_filename, check_same_thread=False)
+        _connections[db_filename] = conn
+    return conn
+
+
+def get_db_meta(db_filename):
+    """
+    Returns the "db_meta" table (one query) as a dict of key -> value: the version stamp
+    (see bump_db_version) and whatever was stored with set_db_meta. Empty if there is no such table.
+    """
+    cursor = get_connection(db_filename).cursor()
+    try:
+        cursor.execute("SELECT key, value FROM db_meta;")
+    except sqlite3.OperationalError:
+        return dict()
+    return dict(cursor.fetchall())
+
+
+def get_db_version(db_filename):
+    """
+    Returns the current version stamp of the database (None if it has none yet).
+    """
+    return get_db_meta(db_filename).get("version")
+
+
+def get_depth_histogram(db_filename, root='jagrja01'):
+    """
+    Returns the number of players at each distance from root (e.g. of each Jagr number), as a
+    dict mapping depth to count, with the key None for players not connected to root.
+    One aggregate over the index on (root_id, depth), without reading the tree itself.
+    """
+    cursor = get_connection(db_filename).cursor()
+    cursor.execute("SELECT depth, COUNT(*) FROM bfs_parent_by_root WHERE root_id = ? GROUP BY depth;", (root,))
+    return dict(cursor.fetchall())
+
+
+def get_pending_seasons(db_filename, team_seasons_csv):
+    """
+    Returns the list of (team_id, season) pairs covered by team_seasons_csv that are not
+    marked "done" in the "scrape_log" table of db_filename (i.e. never fetched, or failed).
+    """
+    team_id_to_seasons = csv_helpers.get_team_ids_and_seasons(team_seasons_csv)
+
+    conn = _connect(db_filename)
+    cursor = conn.cursor()
+    cursor.execute("SELECT team_id, season FROM scrape_log WHERE status = 'done';")
+    done = set(cursor.fetchall())
+    conn.close()
+
+    pending = []
+    for team_id in team_id_to_seasons.keys():
+        inaugural, most_recent = team_id_to_seasons[team_id]
+        for year in range(int(inaugural), int(most_recent) + 1):
+            if (team_id, year) not in done:
+                pending.append( (team_id, year) )
+    return pending
+
+
+def get_shared_teams(pairs, db_filename):
+    """
+    Batched version of common_team: returns the list of labels (team name + first shared season)
+    for a list of (player1_id, player2_id) pairs, in a single query over the shared connection.
+    """
+    if not pairs:
+        return []
+    cursor = get_connection(db_filename).cursor()
+
+    values = ", ".join("(?, ?, ?)" for _ in pairs)
+    params = []
+    for idx, (p1_id, p2_id) in enumerate(pairs):
+        params.extend( (idx, min(p1_id, p2_id), max(p1_id, p2_id)) )
+
+    shared_teams_query = f"""
+    WITH pairs(idx, teammate1_id, teammate2_id) AS (VALUES {values})
+    SELECT pairs.idx, teams.name, edge.first_season
+    FROM pairs
+    JOIN teammate_edges edge
+    ON edge.teammate1_id = pairs.teammate1_id
+    AND edge.teammate2_id = pairs.teammate2_id
+    JOIN teams ON teams.id = edge.first_team_id
+    ;"""
+    labels = ["Did not play together."] * len(pairs)
+    cursor.execute(shared_teams_query, params)
+    for idx, team, season in cursor.fetchall():
+        labels[idx] = f"{team} ({season-1}-{season})"
+    return labels
+
+
+def get_teammate_ids(cursor, player_id):
+    """
+    Returns the list of ids of all teammates of player_id, per the "teammate_edges" table (on an open cursor).
+    """
+    teammates_query = """
+    SELECT teammate2_id FROM teammate_edges WHERE teammate1_id = ?
+    UNION ALL
+    SELECT teammate1_id FROM teammate_edges WHERE teammate2_id = ?
+    ;"""
+    cursor.execute(teammates_query, (player_id, player_id))
+    return [row[0] for row in cursor.fetchall()]
+
+
 def get_player_name_from_id(player_id, db_filename):
     "Returns player name given id"
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
+    cursor = get_connection(db_filename).cursor()
     cursor.execute("SELECT first_name, last_name FROM players WHERE id = ?;", (player_id,))
 
     row = cursor.fetchone()
@@ -207,30 +981,28 @@ def get_player_name_from_id(player_id, db_filename):
     else:
         print("No such player found in the database.")
 
-def make_BFS_parent_table(bfs_parent_dict, db_filename):
+def make_BFS_parent_table(bfs_parent_dict, db_filename, root='jagrja01'):
     """
-    Takes a python dictionary of BFS parent relationships between players and
-    constructs a table in the database to capture these relationships.
+    Takes a python dictionary of BFS parent relationships between players (the BFS tree of root)
+    and stores it in the "bfs_parent_by_root" table, replacing any previous tree of root,
+    together with the depth of every player and the ancestor jump table ("bfs_ancestors").
+    The root is recorded in "bfs_roots", as built and used now.
 
-    both columns of the resulting table will be player_ids, matching "players".id
-    EXCEPT two special values:
-        - The root of BFS (Jagr) has "HIMSELF" as parent
+    player_id and parent_id will be player_ids, matching "players".id
+    EXCEPT two special values of parent_id:
+        - The root of BFS (e.g. Jagr) has "HIMSELF" as parent
         - Players for which no connection found have "DISCONNECTED" as their parent
     """
-    conn = sqlite3.connect(db_filename)
+    conn = _connect(db_filename)
     cursor = conn.cursor()
 
-    create_query = """
-    CREATE TABLE IF NOT EXISTS bfs_parent (
-        player_id TEXT,
-        parent_id TEXT,
-        FOREIGN KEY (player_id) REFERENCES players(id),
-        FOREIGN KEY (parent_id) REFERENCES players(id),
-        PRIMARY KEY (player_id, parent_id)
-    );"""
-    cursor.execute(create_query)
-
-    cursor.executemany("INSERT OR REPLACE INTO bfs_parent (player_id, parent_id) VALUES (?,?)", bfs_parent_dict.items() )
+    _create_bfs_tables(cursor)
+    cursor.execute("DELETE FROM bfs_parent_by_root WHERE root_id = ?;", (root,))
+    cursor.execute("DELETE FROM bfs_ancestors WHERE root_id = ?;", (root,))
+    _store_bfs_rows(cursor, bfs_parent_dict, bfs_parent_dict, root)
+    cursor.execute("INSERT OR REPLACE INTO bfs_roots (root_id, built_at, last_used) "
+                   "VALUES (?, CURRENT_TIMESTAMP, strftime('%Y-%m-%d %H:%M:%f', 'now'))", (root,))
+    bump_db_version(cursor)
 
     conn.commit() # save the changes
     conn.close()  # close the database connection
@@ -240,34 +1012,206 @@ def make_BFS_parent_table(bfs_parent_dict, db_filename):
 
 def make_teammates_table(db_filename):
     """
-    Builds a table consisting of pairs of teammates, rows of form (teammate1_id, teammate2_id),
-    where teammate1_id < teammate2_id (lexicographically) and there are no duplicates.
+    Builds the table "teammate_edges", with one row per pair of teammates:
+        (teammate1_id, teammate2_id, shared_seasons, first_team_id, first_season)
+    where teammate1_id < teammate2_id (lexicographically), shared_seasons counts the rosters
+    they shared, and (first_team_id, first_season) is the earliest of those rosters, so that
+    paths can be labelled without re-joining team_membership. The seasons and the teams of all
+    the rosters they shared are kept as bitmasks (see EDGE_MASKS), for paths restricted to some
+    seasons or teams (see constrained_paths.py); teams get their bits in "team_bits".
+
+    The primary key (teammate1_id, teammate2_id) and the reverse index are covering for
+    reading the graph and for looking up a pair or a player's teammates from either side.
+    "teammates" is kept as a view of the pairs (replacing the older table of one row per
+    pair and shared season, if the database has one).
 
     Assumes that a correctly built database with players, teams, and team_memberships.
-    Assumes "teammates" table has not yet been built.
+    If "teammate_edges" was already built, it is left as is: rosters added later are
+    merged into it by add_to_database_from_roster_dict (see add_roster_teammates).
     """
 
-    conn = sqlite3.connect(db_filename)
+    conn = _connect(db_filename)
     cursor = conn.cursor()
 
-    make_teammates_query = """
-    CREATE TABLE IF NOT EXISTS teammates AS
-        SELECT
-            tm1.player_id as teammate1_id,
-            tm2.player_id as teammate2_id
-        FROM team_membership tm1
-        JOIN team_membership tm2
-        ON tm1.team_id = tm2.team_id
-        AND tm1.season = tm2.season
-        WHERE teammate1_id < teammate2_id
-    ;
-    """
+    create_query = """
+    CREATE TABLE IF NOT EXISTS teammate_edges (
+        teammate1_id TEXT,
+        teammate2_id TEXT,
+        shared_seasons INTEGER, -- number of (team, season) rosters the two players shared
+        first_team_id TEXT,     -- earliest such roster
+        first_season INTEGER,
+        season_mask_lo INTEGER, -- seasons and teams of all such rosters (see EDGE_MASKS)
+        season_mask_hi INTEGER,
+        team_mask_lo INTEGER,
+        team_mask_hi INTEGER,
+        FOREIGN KEY (teammate1_id) REFERENCES players(id),
+        FOREIGN KEY (teammate2_id) REFERENCES players(id),
+        FOREIGN KEY (first_team_id) REFERENCES teams(id),
+        PRIMARY KEY (teammate1_id, teammate2_id)
+    ) WITHOUT ROWID;"""
+    cursor.execute(create_query)
+    _add_edge_masks(cursor)
+
+    cursor.execute("SELECT COUNT(*) FROM (SELECT 1 FROM teammate_edges LIMIT 1);")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("SELECT DISTINCT team_id FROM team_membership ORDER BY team_id;")
+        _assign_team_bits(cursor, [row[0] for row in cursor.fetchall()])
+
+        make_edges_query = f"""
+        INSERT INTO teammate_edges (teammate1_id, teammate2_id, shared_seasons, first_team_id, first_season,
+                                    season_mask_lo, season_mask_hi, team_mask_lo, team_mask_hi)
+            SELECT
+                tm1.player_id,
+                tm2.player_id,
+                COUNT(*),
+                {FIRST_TEAM_ID},
+                MIN(tm1.season),
+                {EDGE_MASKS}
+            FROM team_membership tm1
+            JOIN team_membership tm2
+            ON tm1.team_id = tm2.team_id
+            AND tm1.season = tm2.season
+            LEFT JOIN team_bits ON team_bits.team_id = tm1.team_id
+            WHERE tm1.player_id < tm2.player_id
+            GROUP BY tm1.player_id, tm2.player_id
+        ;
+        """
+        cursor.execute(make_edges_query)
+        bump_db_version(cursor)
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS teammate_edges_reverse_idx ON teammate_edges (teammate2_id, teammate1_id);")
+
+    # Replace a legacy "teammates" table (one row per pair and shared season) by a view.
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = 'teammates';")
+    row = cursor.fetchone()
+    if row is not None and row[0] == "table":
+        cursor.execute("DROP TABLE teammates;")
+    cursor.execute("CREATE VIEW IF NOT EXISTS teammates AS SELECT teammate1_id, teammate2_id FROM teammate_edges;")
 
-    cursor.execute(make_teammates_query)
     conn.commit()
     conn.close()
 
 
+def resolve_bfs_path(player_id, db_filename, root='jagrja01'):
+    """
+    Returns the whole path from player_id up the BFS tree of root (see "bfs_parent_by_root") in a single query,
+    as a list of hops (player_id, player_name, shared_team):
+        - shared_team is the team + season shared with the next player of the path
+          (None for the last player),
+        - the path ends at the root if player_id is connected to it; otherwise it stops at the
+          first player with no parent ("DISCONNECTED"),
+        - the list is empty if player_id is not in the tree.
+    """
+    return resolve_bfs_paths([player_id], db_filename, root=root)[player_id]
+
+
+def resolve_bfs_paths(player_ids, db_filename, root='jagrja01'):
+    """
+    Batched version of resolve_bfs_path: returns a dict mapping each of player_ids to its path.
+
+    Uses one recursive query per batch of (up to) 500 players, over the shared connection.
+    """
+    cursor = get_connection(db_filename).cursor()
+    player_ids = list(player_ids)
+    paths = {player_id: [] for player_id in player_ids}
+
+    BATCH_SIZE = 500  # stays well under SQLite's limit on the number of "?" parameters
+    for start in range(0, len(player_ids), BATCH_SIZE):
+        batch = player_ids[start:start + BATCH_SIZE]
+        seeds = ", ".join("(?)" for _ in batch)
+
+        resolve_query = f"""
+        WITH RECURSIVE
+        seeds(start_id) AS (VALUES {seeds}),
+        chain(start_id, hop, player_id, parent_id) AS (
+            SELECT seeds.start_id, 0, tree.player_id, tree.parent_id
+            FROM seeds JOIN bfs_parent_by_root tree ON tree.root_id = ? AND tree.player_id = seeds.start_id
+            UNION ALL
+            SELECT chain.start_id, chain.hop + 1, tree.player_id, tree.parent_id
+            FROM chain JOIN bfs_parent_by_root tree ON tree.root_id = ? AND tree.player_id = chain.parent_id
+            WHERE chain.parent_id NOT IN ('HIMSELF', 'DISCONNECTED')
+            )
+        --
+        SELECT chain.start_id, chain.player_id,
+            players.first_name || ' ' || players.last_name AS player_name,
+            teams.name || ' (' || (edge.first_season - 1) || '-' || edge.first_season || ')' AS shared_team
+        FROM chain
+        LEFT JOIN players ON players.id = chain.player_id
+        LEFT JOIN teammate_edges edge
+        ON edge.teammate1_id = min(chain.player_id, chain.parent_id)
+        AND edge.teammate2_id = max(chain.player_id, chain.parent_id)
+        LEFT JOIN teams ON teams.id = edge.first_team_id
+        ORDER BY chain.start_id, chain.hop
+        ;
+        """
+        cursor.execute(resolve_query, batch + [root, root])
+        for start_id, player_id, player_name, shared_team in cursor.fetchall():
+            paths[start_id].append( (player_id, player_name, shared_team) )
+
+    return paths
+
+
+def set_bfs_parents(cursor, changed_parents, depths, root='jagrja01'):
+    """
+    Replaces the rows of the players in the dict changed_parents (player_id -> parent_id)
+    in the BFS tree of root, on an open cursor, without committing, with their new depths
+    (the dict depths: player_id -> depth, None if disconnected).
+
+    Their ancestors are rebuilt in order of depth, each level from the new parent's ancestors:
+    the ancestor 2**(k+1) steps up is the ancestor 2**k steps up of the ancestor 2**k steps up.
+    Those of unchanged players are read from "bfs_ancestors", so nothing else of the tree is read.
+    The callers must include every player whose depth changes (see graph_operations.repair_BFS_tree):
+    then every descendant of a changed player is changed too, and the stored rows read are current.
+    """
+    cursor.executemany("INSERT OR REPLACE INTO bfs_parent_by_root (root_id, player_id, parent_id, depth) VALUES (?,?,?,?)",
+                       [ (root, player_id, parent_id, depths[player_id]) for player_id, parent_id in changed_parents.items() ])
+    cursor.executemany("DELETE FROM bfs_ancestors WHERE root_id = ? AND player_id = ?;",
+                       [ (root, player_id) for player_id in changed_parents ])
+
+    # player_id -> its ancestors 1, 2, 4, ... steps up.
+    jumps = dict()
+
+    def ancestors(player_id):
+        if player_id not in jumps:
+            cursor.execute("SELECT ancestor_id FROM bfs_ancestors WHERE root_id = ? AND player_id = ? ORDER BY level;",
+                           (root, player_id))
+            jumps[player_id] = [row[0] for row in cursor.fetchall()]
+        return jumps[player_id]
+
+    rows = []
+    connected = [player_id for player_id in changed_parents if depths[player_id] is not None]
+    for player_id in sorted(connected, key=depths.get):
+        # Ancestors are strictly closer to root, so those that changed were done before.
+        jump = [changed_parents[player_id]]
+        while len(ancestors(jump[-1])) >= len(jump):
+            jump.append(ancestors(jump[-1])[len(jump) - 1])
+        jumps[player_id] = jump
+        rows.extend( (root, player_id, level, ancestor_id) for level, ancestor_id in enumerate(jump) )
+    cursor.executemany("INSERT INTO bfs_ancestors (root_id, player_id, level, ancestor_id) VALUES (?,?,?,?)", rows)
+    return
+
+
+def set_db_meta(db_filename, **values):
+    """
+    Stores key = value pairs in "db_meta" (e.g. row counts, so that they need not be recounted).
+    Does not change the version stamp.
+    """
+    conn = get_connection(db_filename)
+    cursor = conn.cursor()
+    _create_db_meta(cursor)
+    cursor.executemany("INSERT OR REPLACE INTO db_meta (key, value) VALUES (?,?)", values.items())
+    conn.commit()
+
+
+def touch_bfs_root(db_filename, root):
+    """
+    Records that the BFS tree of root was just used (see evict_bfs_roots).
+    """
+    conn = get_connection(db_filename)
+    conn.execute("UPDATE bfs_roots SET last_used = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE root_id = ?;", (root,))
+    conn.commit()
+
+
 def remove_diacritics(name):
     """
     Removes accents and the like from a given name.
@@ -284,10 +1228,18 @@ def set_up_db(db_filename):
     """
     A function to initialize the tables in a file called db_filename
     """
-    conn = sqlite3.connect(db_filename)
+    conn = _connect(db_filename)
     cursor = conn.cursor()
+    _set_up_tables(cursor)
+    conn.commit()
+    conn.close()
 
 
+def _set_up_tables(cursor):
+    """
+    Executes (without committing) the work of set_up_db on an open cursor.
+    """
+
     players_query = """
     CREATE TABLE IF NOT EXISTS players (
         id TEXT PRIMARY KEY UNIQUE, -- built to match the ids used on hockey-reference
@@ -315,5 +1267,61 @@ def set_up_db(db_filename):
     );"""
     cursor.execute(membership_query)
 
-    conn.commit()
-    conn.close()
+    # Covering index for whole-roster lookups (team_id, season) -> players, e.g. the teammates self-join.
+    cursor.execute("CREATE INDEX IF NOT EXISTS team_membership_roster_idx ON team_membership (team_id, season, player_id);")
+
+    scrape_log_query = """
+    CREATE TABLE IF NOT EXISTS scrape_log (
+        team_id TEXT,
+        season INTEGER,
+        status TEXT, -- "done" or "failed"
+        num_players INTEGER,
+        updated_at TEXT, -- UTC timestamp of the last attempt
+        PRIMARY KEY (team_id, season)
+    );"""
+    cursor.execute(scrape_log_query)
+
+    # Version stamp of the contents (see bump_db_version).
+    _create_db_meta(cursor)
+    cursor.execute("SELECT 1 FROM db_meta WHERE key = 'version';")
+    if cursor.fetchone() is None:
+        bump_db_version(cursor)
+
+    # Databases built before BFS trees were keyed by root: move the single "bfs_parent" tree
+    # (whose root is the player with parent "HIMSELF") into "bfs_parent_by_root".
+    if _table_exists(cursor, "bfs_parent"):
+        _create_bfs_tables(cursor)
+        cursor.execute("SELECT player_id FROM bfs_parent WHERE parent_id = 'HIMSELF';")
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute("SELECT player_id, parent_id FROM bfs_parent;")
+            parent = dict(cursor.fetchall())
+            _store_bfs_rows(cursor, parent, parent, row[0])
+            cursor.execute("INSERT OR REPLACE INTO bfs_roots (root_id, built_at, last_used) "
+                           "VALUES (?, CURRENT_TIMESTAMP, strftime('%Y-%m-%d %H:%M:%f', 'now'))", (row[0],))
+        cursor.execute("DROP TABLE bfs_parent;")
+        bump_db_version(cursor)
+
+    # Teammate pairs built before their season and team bitmasks existed (see make_teammates_table).
+    if _table_exists(cursor, "teammate_edges"):
+        _add_edge_masks(cursor)
+
+    # BFS trees stored before depths existed (see _create_bfs_tables).
+    if _table_exists(cursor, "bfs_parent_by_root"):
+        _create_bfs_tables(cursor)
+
+    # Connected components of the teammates graph (see union_find.py), built from the rosters
+    # already in team_membership if the database was filled before the table existed.
+    import union_find # imported here, since union_find imports this file
+    if union_find.create_union_find_table(cursor):
+        union_find.build_union_find(cursor)
+
+    # Databases built before "scrape_log" existed: count every roster already in team_membership as done.
+    cursor.execute("SELECT COUNT(*) FROM scrape_log;")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+        INSERT INTO scrape_log (team_id, season, status, num_players, updated_at)
+            SELECT team_id, season, 'done', COUNT(*), CURRENT_TIMESTAMP
+            FROM team_membership
+            GROUP BY team_id, season
+        ;""")
@@ -0,0 +1,183 @@
+# League-wide analytics: the distance between every pair of players, stored as a memory-mapped
+# uint8 matrix, plus eccentricity, diameter and average separation.
+# Run as: python3 distance_matrix.py <db_file> <output_prefix> [--processes N]
+
+import argparse, json, os, tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# bitset_BFS(offsets, neighbors, sources)
+# build_distance_matrix(db_filename, output_prefix, processes=None)
+# load_distance_matrix(output_prefix)
+# matrix_distance(matrix, index_of, player1_id, player2_id)
+#
+########################################################################
+
+# Files written by build_distance_matrix, for a given output_prefix:
+#   <prefix>.npy               (n x n) uint8 matrix, row/column i = player_ids[i]; UNREACHABLE if no path
+#   <prefix>.ids.txt           player ids, one per line, in matrix order
+#   <prefix>.eccentricity.npy  int16 eccentricity of each player (within its component; -1 if isolated)
+#   <prefix>.stats.json        diameter, average separation, numbers of players and connected pairs
+UNREACHABLE = 255
+BATCH_SIZE = 64  # sources per BFS batch: one bit of a uint64 per source
+
+# Set in each worker process by _init_worker.
+_worker = dict()
+
+
+def bitset_BFS(offsets, neighbors, sources):
+    """
+    BFS from up to 64 sources at once over a CSR graph (see graph_operations.CSRGraph).
+
+    Every node holds a uint64 bitset: bit b of frontier[v] says v is on the current level of
+    the BFS from sources[b]. One level of all the BFSs is then a single pass over the edges:
+        next[v] = OR of frontier[u] over the neighbors u of v,   minus the bits already visited at v.
+
+    Returns a (len(sources) x n) uint8 array of distances (UNREACHABLE where there is no path).
+    """
+    num_nodes = offsets.size - 1
+    num_sources = len(sources)
+    distances = np.full((num_sources, num_nodes), UNREACHABLE, dtype=np.uint8)
+
+    frontier = np.zeros(num_nodes, dtype=np.uint64)
+    for b, source in enumerate(sources):
+        frontier[source] |= np.uint64(1) << np.uint64(b)
+        distances[b, source] = 0
+    visited = frontier.copy()
+
+    # reduceat needs non-empty segments: only nodes with neighbors can be reached.
+    has_neighbors = np.nonzero(offsets[1:] > offsets[:-1])[0]
+    segment_starts = offsets[has_neighbors]
+    bit_values = np.uint64(1) << np.arange(num_sources, dtype=np.uint64)
+
+    level = 0
+    while frontier.any():
+        level += 1
+        reached = np.zeros(num_nodes, dtype=np.uint64)
+        if has_neighbors.size:
+            reached[has_neighbors] = np.bitwise_or.reduceat(frontier[neighbors], segment_starts)
+        frontier = reached & ~visited
+        visited |= frontier
+
+        new_nodes = np.nonzero(frontier)[0]
+        if new_nodes.size == 0:
+            break
+        # (sources x new nodes) boolean matrix of which BFS reached which node at this level.
+        reached_by = (frontier[new_nodes][None, :] & bit_values[:, None]) != 0
+        source_idx, node_pos = np.nonzero(reached_by)
+        distances[source_idx, new_nodes[node_pos]] = min(level, UNREACHABLE - 1)
+
+    return distances
+
+
+def _init_worker(offsets_path, neighbors_path, matrix_path):
+    # The graph arrays are memory-mapped read-only, so all workers share the same pages.
+    _worker["offsets"] = np.load(offsets_path, mmap_mode="r")
+    _worker["neighbors"] = np.load(neighbors_path, mmap_mode="r")
+    _worker["matrix"] = np.load(matrix_path, mmap_mode="r+")
+
+
+def _process_batch(start, stop):
+    """
+    Worker task: fills rows start..stop-1 of the matrix, and returns, for each of those sources,
+    (eccentricity, sum of distances, number of other players reached).
+    """
+    distances = bitset_BFS(_worker["offsets"], _worker["neighbors"], np.arange(start, stop))
+    _worker["matrix"][start:stop] = distances
+    _worker["matrix"].flush()
+
+    reachable = distances != UNREACHABLE
+    as_int = np.where(reachable, distances, 0).astype(np.int64)
+    eccentricity = np.where(reachable.sum(axis=1) > 1, as_int.max(axis=1), -1)
+    return start, eccentricity, as_int.sum(axis=1), reachable.sum(axis=1) - 1
+
+
+def build_distance_matrix(db_filename, output_prefix, processes=None):
+    """
+    Computes the distance between every pair of players in the "players" table of db_filename
+    (over the teammates graph), with bitset_BFS on batches of 64 sources spread over a process
+    pool of "processes" workers (default: one per core). Rows are written straight into a
+    memory-mapped uint8 matrix, so memory use does not grow with the number of players squared.
+
+    Writes the files listed at the top of this file, and returns the stats (also in <prefix>.stats.json).
+    """
+    graph = graph_operations.make_csr_graph(db_filename)
+    num_nodes = len(graph.player_ids)
+
+    with open(f"{output_prefix}.ids.txt", "w") as file:
+        file.write("\n".join(graph.player_ids) + "\n")
+
+    matrix_path = f"{output_prefix}.npy"
+    matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.uint8, shape=(num_nodes, num_nodes))
+    del matrix  # workers open it themselves
+
+    eccentricity = np.full(num_nodes, -1, dtype=np.int16)
+    total_distance = 0
+    connected_pairs = 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        offsets_path = os.path.join(tmp_dir, "offsets.npy")
+        neighbors_path = os.path.join(tmp_dir, "neighbors.npy")
+        np.save(offsets_path, graph.offsets)
+        np.save(neighbors_path, graph.neighbors)
+
+        batches = [ (start, min(start + BATCH_SIZE, num_nodes)) for start in range(0, num_nodes, BATCH_SIZE) ]
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(offsets_path, neighbors_path, matrix_path)) as pool:
+            futures = [ pool.submit(_process_batch, start, stop) for start, stop in batches ]
+            for future in futures:
+                start, batch_eccentricity, batch_total, batch_reached = future.result()
+                eccentricity[start:start + batch_eccentricity.size] = batch_eccentricity
+                total_distance += int(batch_total.sum())
+                connected_pairs += int(batch_reached.sum())
+
+    np.save(f"{output_prefix}.eccentricity.npy", eccentricity)
+
+    # Each unordered pair was counted from both ends.
+    stats = {
+        "num_players": num_nodes,
+        "connected_pairs": connected_pairs // 2,
+        "diameter": int(eccentricity.max()) if num_nodes else 0,
+        "average_separation": total_distance / connected_pairs if connected_pairs else None,
+    }
+    with open(f"{output_prefix}.stats.json", "w") as file:
+        json.dump(stats, file)
+    return stats
+
+
+def load_distance_matrix(output_prefix):
+    """
+    Opens the files written by build_distance_matrix (read-only, memory-mapped: nothing is read
+    until used). Returns (matrix, index_of, eccentricity, stats).
+    """
+    matrix = np.load(f"{output_prefix}.npy", mmap_mode="r")
+    with open(f"{output_prefix}.ids.txt", "r") as file:
+        index_of = {line.strip(): idx for idx, line in enumerate(file) if line.strip()}
+    eccentricity = np.load(f"{output_prefix}.eccentricity.npy", mmap_mode="r")
+    with open(f"{output_prefix}.stats.json", "r") as file:
+        stats = json.load(file)
+    return matrix, index_of, eccentricity, stats
+
+
+def matrix_distance(matrix, index_of, player1_id, player2_id):
+    """
+    O(1) lookup of the distance between two players, or None if they are not connected.
+    """
+    distance = int(matrix[index_of[player1_id], index_of[player2_id]])
+    return None if distance == UNREACHABLE else distance
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute all-pairs distances between players.")
+    parser.add_argument("db_file")
+    parser.add_argument("output_prefix")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    database.make_teammates_table(args.db_file) # builds "teammate_edges" if the database has none yet
+    print(json.dumps(build_distance_matrix(args.db_file, args.output_prefix, processes=args.processes)))
@@ -0,0 +1,260 @@
+# Approximate distances between any two players, for bulk analytics over millions of pairs.
+# A few landmark players (the best-connected ones) get a full BFS each, kept as one small array
+# per player: the distances from that player to every landmark. For any pair (u, v) and landmark L,
+# the triangle inequality gives
+#       |d(L, u) - d(L, v)|  <=  d(u, v)  <=  d(L, u) + d(L, v)
+# so the best bounds over all landmarks take a few vectorized operations per pair. When the two
+# bounds meet, that is the exact distance; otherwise an exact bidirectional search settles it.
+# Run as: python3 distance_oracle.py <db_file> [--landmarks 16] [--pairs 10000] [--seed 0]
+
+import argparse, json, time
+from collections import namedtuple
+import numpy as np
+import database # my database.py file
+import distance_matrix # my distance_matrix.py file
+import graph_operations # my graph_operations.py file
+import instrumentation # my instrumentation.py file
+import snapshot # my snapshot.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# build_oracle(db_filename, num_landmarks=16, graph=None)
+# choose_landmarks(graph, num_landmarks=16)
+# distance_bounds(oracle, player1_id, player2_id)
+# evaluate_oracle(oracle, num_pairs=10000, seed=0)
+# exact_distance(graph, source, target, upper=None)
+# get_oracle(db_filename, num_landmarks=16)
+# oracle_distance(oracle, player1_id, player2_id)
+# pair_bounds(oracle, sources, targets)
+# pair_distances(oracle, sources, targets)
+#
+########################################################################
+
+# Oracle over a graph_operations.CSRGraph (the teammates graph of make_graph, as arrays):
+#   landmarks[j]    -> node index of landmark j (int32)
+#   distances[i, j] -> distance between node i and landmark j (uint8), UNREACHABLE if not connected;
+#                      one row per node, so the landmark distances of a player are contiguous
+#   build_seconds   -> time taken by build_oracle
+LandmarkOracle = namedtuple("LandmarkOracle", ["graph", "landmarks", "distances", "build_seconds"])
+
+# Distances and bounds use the same sentinel as distance_matrix.py: a pair with both bounds at
+# UNREACHABLE is not connected, and an upper bound of UNREACHABLE alone means none is known.
+UNREACHABLE = distance_matrix.UNREACHABLE
+
+# Pairs are bounded this many at a time, so the temporary (pairs x landmarks) arrays stay small.
+CHUNK_SIZE = 65536
+
+# Sources with at least this many pairs whose bounds do not meet get one full BFS (64 at a time)
+# instead of one bidirectional search per pair (see pair_distances).
+BATCH_MIN_PAIRS = 4
+
+
+def choose_landmarks(graph, num_landmarks=16):
+    """
+    Returns the node indices of up to num_landmarks landmarks: the players with the most teammates,
+    skipping the teammates of landmarks already chosen (two teammates give nearly the same bounds).
+    """
+    degree = np.diff(graph.offsets)
+    blocked = np.zeros(len(degree), dtype=bool)
+    landmarks = []
+    for node in np.argsort(-degree, kind="stable").tolist():
+        if len(landmarks) == num_landmarks or degree[node] == 0:
+            break
+        if blocked[node]:
+            continue
+        landmarks.append(node)
+        blocked[graph.neighbors[graph.offsets[node]:graph.offsets[node + 1]]] = True
+    return np.array(landmarks, dtype=np.int32)
+
+
+def build_oracle(db_filename, num_landmarks=16, graph=None):
+    """
+    Builds the LandmarkOracle of db_filename (over the CSRGraph of graph_operations.get_csr_graph,
+    unless supplied): one BFS per landmark, run 64 at a time by distance_matrix.bitset_BFS.
+    Takes O(num_landmarks / 64 * diameter * E) time, and num_landmarks bytes per player.
+    """
+    start = time.perf_counter()
+    if graph is None:
+        graph = graph_operations.get_csr_graph(db_filename)
+    landmarks = choose_landmarks(graph, num_landmarks)
+
+    distances = np.empty( (len(graph.player_ids), len(landmarks)), dtype=np.uint8 )
+    for first in range(0, len(landmarks), distance_matrix.BATCH_SIZE):
+        batch = landmarks[first:first + distance_matrix.BATCH_SIZE]
+        distances[:, first:first + len(batch)] = distance_matrix.bitset_BFS(graph.offsets, graph.neighbors, batch).T
+
+    instrumentation.count("oracle.landmark_BFS", len(landmarks))
+    return LandmarkOracle(graph, landmarks, distances, time.perf_counter() - start)
+
+
+def get_oracle(db_filename, num_landmarks=16):
+    """
+    build_oracle, through its snapshot (see snapshot.py): rebuilt only when the database changes.
+    """
+    return snapshot.cached(db_filename, f"oracle-{num_landmarks}", build_oracle, db_filename, num_landmarks)
+
+
+def pair_bounds(oracle, sources, targets):
+    """
+    Returns the lower and upper bounds (two int32 arrays) on the distances between the nodes of two
+    equal-length arrays of node indices, pair by pair, from the landmarks:
+        - lower = max over landmarks of |d(L, u) - d(L, v)| (at least 1 for distinct nodes),
+        - upper = min over landmarks of d(L, u) + d(L, v) (UNREACHABLE if no landmark reaches them),
+        - both UNREACHABLE if some landmark reaches one node of the pair but not the other.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    lower = np.empty(sources.size, dtype=np.int32)
+    upper = np.empty(sources.size, dtype=np.int32)
+    for first in range(0, sources.size, CHUNK_SIZE):
+        chunk = slice(first, first + CHUNK_SIZE)
+        to_source = oracle.distances[sources[chunk]].astype(np.int16)
+        to_target = oracle.distances[targets[chunk]].astype(np.int16)
+        source_reached = to_source != UNREACHABLE
+        target_reached = to_target != UNREACHABLE
+        both = source_reached & target_reached
+
+        chunk_lower = np.where(both, np.abs(to_source - to_target), 0).max(axis=1, initial=0)
+        chunk_upper = np.where(both, to_source + to_target, UNREACHABLE).min(axis=1, initial=UNREACHABLE)
+        chunk_lower = np.maximum(chunk_lower, sources[chunk] != targets[chunk])
+        disconnected = (source_reached != target_reached).any(axis=1)
+
+        lower[chunk] = np.where(disconnected, UNREACHABLE, chunk_lower)
+        upper[chunk] = np.where(disconnected, UNREACHABLE, np.minimum(chunk_upper, UNREACHABLE))
+    return lower, upper
+
+
+def distance_bounds(oracle, player1_id, player2_id):
+    """
+    Returns the (lower, upper) bounds on the distance between two players, as in pair_bounds.
+    """
+    index_of = oracle.graph.index_of
+    lower, upper = pair_bounds(oracle, [index_of[player1_id]], [index_of[player2_id]])
+    return int(lower[0]), int(upper[0])
+
+
+def exact_distance(graph, source, target, upper=None):
+    """
+    Returns the distance between two nodes of a CSRGraph, or None if they are not connected:
+    a bidirectional BFS, expanding one whole level of the smaller frontier at a time, until the two
+    searches meet. Given a known upper bound, it stops as soon as the distance cannot be shorter.
+    """
+    if source == target:
+        return 0
+    visited = [np.zeros(len(graph.player_ids), dtype=bool), np.zeros(len(graph.player_ids), dtype=bool)]
+    frontiers = [np.array([source], dtype=np.int32), np.array([target], dtype=np.int32)]
+    visited[0][source] = visited[1][target] = True
+
+    # Before the searches meet, the levels expanded on both sides add up to less than the distance.
+    levels = 0
+    while frontiers[0].size and frontiers[1].size:
+        if upper is not None and levels + 1 >= upper:
+            return upper
+        side = 0 if frontiers[0].size <= frontiers[1].size else 1
+        reached = graph_operations._gather(graph.offsets, graph.neighbors, frontiers[side])[0]
+        reached = np.unique(reached[~visited[side][reached]])
+        levels += 1
+        if visited[1 - side][reached].any():
+            return levels
+        visited[side][reached] = True
+        frontiers[side] = reached
+    return None
+
+
+def pair_distances(oracle, sources, targets):
+    """
+    Returns the exact distances between the nodes of two equal-length arrays of node indices
+    (int32, UNREACHABLE if not connected): from the landmark bounds where they meet. The other
+    pairs are settled by search: sources with at least BATCH_MIN_PAIRS such pairs by one full BFS
+    (distance_matrix.bitset_BFS, 64 sources at a time), the rest by exact_distance, searching no
+    further than the upper bound.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    lower, upper = pair_bounds(oracle, sources, targets)
+    distances = upper.copy()
+    loose = np.flatnonzero(lower != upper)
+    instrumentation.count("oracle.exact_fallbacks", loose.size)
+
+    loose_sources, counts = np.unique(sources[loose], return_counts=True)
+    batched = np.isin(sources[loose], loose_sources[counts >= BATCH_MIN_PAIRS])
+    busy_sources = loose_sources[counts >= BATCH_MIN_PAIRS]
+    for first in range(0, busy_sources.size, distance_matrix.BATCH_SIZE):
+        batch = busy_sources[first:first + distance_matrix.BATCH_SIZE]
+        from_batch = distance_matrix.bitset_BFS(oracle.graph.offsets, oracle.graph.neighbors, batch)
+        positions = loose[batched & (sources[loose] >= batch[0]) & (sources[loose] <= batch[-1])]
+        distances[positions] = from_batch[np.searchsorted(batch, sources[positions]), targets[positions]]
+
+    for position in loose[~batched].tolist():
+        known_upper = int(upper[position]) if upper[position] != UNREACHABLE else None
+        distance = exact_distance(oracle.graph, int(sources[position]), int(targets[position]), upper=known_upper)
+        distances[position] = UNREACHABLE if distance is None else distance
+    return distances
+
+
+def oracle_distance(oracle, player1_id, player2_id):
+    """
+    Returns the distance between two players (see pair_distances), or None if they are not connected.
+    """
+    index_of = oracle.graph.index_of
+    distance = int(pair_distances(oracle, [index_of[player1_id]], [index_of[player2_id]])[0])
+    return None if distance == UNREACHABLE else distance
+
+
+def evaluate_oracle(oracle, num_pairs=10000, seed=0):
+    """
+    Measures the oracle on num_pairs random pairs of distinct players, against exact distances
+    (from up to 64 sources, by distance_matrix.bitset_BFS), and returns a dict with:
+        - the number of landmarks, the build time and the size of the distance arrays,
+        - the time per pair of pair_bounds and of pair_distances (exact fallback included),
+        - among connected pairs: the fraction whose bounds meet, and the average gap between
+          each bound and the distance,
+        - how many pairs are proved disconnected by the bounds alone.
+    """
+    rng = np.random.default_rng(seed)
+    num_nodes = len(oracle.graph.player_ids)
+    sources = rng.choice(num_nodes, size=min(distance_matrix.BATCH_SIZE, num_nodes), replace=False)
+    exact = distance_matrix.bitset_BFS(oracle.graph.offsets, oracle.graph.neighbors, sources)
+    rows = rng.integers(len(sources), size=num_pairs)
+    targets = rng.integers(num_nodes, size=num_pairs)
+    distinct = sources[rows] != targets
+    rows, targets = rows[distinct], targets[distinct]
+    pair_sources = sources[rows]
+    truth = exact[rows, targets].astype(np.int32)
+
+    start = time.perf_counter()
+    lower, upper = pair_bounds(oracle, pair_sources, targets)
+    bounds_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    distances = pair_distances(oracle, pair_sources, targets)
+    distances_seconds = time.perf_counter() - start
+    assert np.array_equal(distances, truth), "pair_distances disagrees with BFS"
+
+    connected = truth != UNREACHABLE
+    return {
+        "num_landmarks": len(oracle.landmarks),
+        "build_s": oracle.build_seconds,
+        "oracle_mb": oracle.distances.nbytes / 2**20,
+        "num_pairs": int(truth.size),
+        "bounds_us_per_pair": bounds_seconds / max(truth.size, 1) * 1e6,
+        "exact_us_per_pair": distances_seconds / max(truth.size, 1) * 1e6,
+        "tight_fraction": float((lower == upper)[connected].mean()) if connected.any() else None,
+        "mean_upper_gap": float((upper - truth)[connected & (upper != UNREACHABLE)].mean()) if connected.any() else None,
+        "mean_lower_gap": float((truth - lower)[connected].mean()) if connected.any() else None,
+        "disconnected_pairs": int((~connected).sum()),
+        "disconnected_proved": int(((lower == UNREACHABLE) & ~connected).sum()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a landmark distance oracle and report its accuracy.")
+    parser.add_argument("db_file")
+    parser.add_argument("--landmarks", type=int, default=16, help="number of landmark players")
+    parser.add_argument("--pairs", type=int, default=10000, help="random pairs to measure accuracy on")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    database.make_teammates_table(args.db_file) # builds "teammate_edges" if the database has none yet
+    oracle = build_oracle(args.db_file, num_landmarks=args.landmarks)
+    print(json.dumps(evaluate_oracle(oracle, num_pairs=args.pairs, seed=args.seed)))
@@ -1,18 +1,79 @@
 # A file for all graph theoretic operations involved in main.py
 
-from collections import deque
-import sqlite3
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+import heapq, importlib.util, os, sys
 import database # my database.py file
+import instrumentation # my instrumentation.py file
+import snapshot # my snapshot.py file
+import union_find # my union_find.py file
+
+
+def _lazy_import(name):
+    """
+    Returns the module "name", which is only actually loaded when one of its attributes is first
+    used. Importing numpy takes longer than answering a lookup from the database, and only the
+    array-based engines below need it.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+np = _lazy_import("numpy")
 
 ########################################################################
 # Function signatures for functions herein:
 #
 # BFS(db_filename, root='jagrja01')
+# bfs_ancestor_rows(parent, players=None)
+# bfs_tree_depths(parent)
+# bidirectional_BFS(teammates_graph, source_id, target_id, components=None)
+# BFS_bipartite(db_filename, root='jagrja01', graph=None, component_size=None, shared_teams=False)
+# BFS_csr(db_filename, root='jagrja01', graph=None, component_size=None)
+# BFS_many_roots(db_filename, roots, graph=None, processes=None)
+# bipartite_BFS_arrays(graph, root_index, component_size=None)
+# bipartite_shared_team(graph, player1_id, player2_id)
+# csr_BFS_arrays(graph, root_index, component_size=None)
+# csr_edge_positions(graph, first, second)
+# csr_neighbors(graph, index)
+# distance_upper_bound(player1_id, player2_id, db_filename, root='jagrja01')
+# make_bipartite_graph(db_filename)
+# make_csr_graph(db_filename)
+# format_path(hops)
+# get_csr_graph(db_filename)
 # make_graph(db_filename)
+# repair_BFS_tree(cursor, new_pairs, new_player_ids=(), root='jagrja01')
+# render_path(player_id_sequence, db_filename)
+# shortest_path_between(source_id, target_id, db_filename, teammates_graph=None)
 # traverse_bfs_path(starting_player_id, db_filename, root='jagrja01')
+# tree_lca(player1_id, player2_id, db_filename, root='jagrja01')
+# tree_path(player1_id, player2_id, db_filename, root='jagrja01')
 #
 ########################################################################
 
+# Compact, array-backed teammates graph (compressed sparse row format):
+#   player_ids[i]    -> player id (str) of the node with integer index i
+#   index_of[pid]    -> integer index of the node for player id pid
+#   offsets[i]:offsets[i+1] -> slice of "neighbors" holding the teammates of node i
+#   neighbors        -> concatenated, sorted, de-duplicated adjacency lists (int32)
+CSRGraph = namedtuple("CSRGraph", ["player_ids", "index_of", "offsets", "neighbors"])
+
+# Bipartite graph of players and rosters, read straight from team_membership (no teammate pairs):
+#   player_ids, index_of -> as in CSRGraph, for player nodes
+#   rosters[r]           -> (team_id, season) of roster node r
+#   player_offsets, player_rosters -> CSR lists of the rosters of each player
+#   roster_offsets, roster_players -> CSR lists of the players of each roster
+BipartiteGraph = namedtuple("BipartiteGraph", ["player_ids", "index_of", "rosters",
+                                               "player_offsets", "player_rosters",
+                                               "roster_offsets", "roster_players"])
+
 def make_graph(db_filename):
     """
     Construct a graph of teammates using the SQL db file of db_filename.
@@ -20,25 +81,27 @@ def make_graph(db_filename):
     Vertex set of graph = players in the data base, nodes labelled by player_id
 
     Implementation: undirected edge between players A and B if and only if (id_A, id_B) or (id_B, id_A)
-    appears in table "teammates", with rows of the form (teammate1_id, teammate2_id),
-        --> Requires that "teammates" is properly built, correctly populated.
+    appears in table "teammate_edges", with one row (teammate1_id, teammate2_id, ...) per pair,
+        --> Requires that "teammate_edges" is properly built, correctly populated.
         --> Depends on database.py implementation.
 
     Returns: a dict teammates_graph, where teammates[player_id] is a set of all teammates.
     (like an adjacency list representation of the graph, but with a set instead of a list)
     """
     # Open the database file with a sqlite3 connection and cursor
-    connection = sqlite3.connect(db_filename)
+    connection = database._connect(db_filename)
     cursor = connection.cursor()
 
     # Set the cursor with a SQL query for teammates:
-    teammates_query = "SELECT * FROM teammates;"
+    teammates_query = "SELECT teammate1_id, teammate2_id FROM teammate_edges;"
     cursor.execute(teammates_query)
 
     teammates_graph = dict() # map players to set of their teammates
 
     # Go row-by-row in the resulting table and add information to the graph and other dictionary.
-    for row in cursor.fetchall():
+    num_rows = 0
+    for row in cursor:
+        num_rows += 1
         p1_id, p2_id = row
         # Add one another to each other's adjacency list
         if p1_id not in teammates_graph.keys():
@@ -52,6 +115,7 @@ def make_graph(db_filename):
     # Close the data base file.
     connection.commit()
     connection.close()
+    instrumentation.count("graph.edges_loaded", num_rows)
     return teammates_graph
 
 
@@ -67,9 +131,13 @@ def BFS(db_filename, root='jagrja01'):
     will be handled separately
 
     If no connection found for player_id, parent[player_id] = "None found"
+
+    The traversal stops as soon as every player of root's component (see union_find.py) is
+    discovered, without scanning the teammates of the last ones.
     """
     # Initialize the teammates graph.
     teammates_graph = make_graph(db_filename)
+    component_size = union_find.component_size(root, db_filename)
 
     # Initialize the BFS objects:
     parent = dict()
@@ -90,6 +158,12 @@ def BFS(db_filename, root='jagrja01'):
                 BFS_q.append(teammate_id)
                 parent[teammate_id] = curr_id
 
+        if len(discovered) >= component_size:
+            break
+
+    if instrumentation.ENABLED:
+        instrumentation.count("bfs.nodes_visited", len(discovered))
+        instrumentation.count("bfs.edges_scanned", sum(len(teammates_graph[pid]) for pid in discovered))
 
     player_set = database.get_all_players(db_filename)
     for player_id in player_set.difference(discovered):
@@ -98,46 +172,727 @@ def BFS(db_filename, root='jagrja01'):
     return parent
 
 
-def traverse_bfs_path(starting_player_id, db_filename, root='jagrja01'):
+def make_csr_graph(db_filename):
     """
-    Attempts to traverse BFS path (in "bfs_parent" table of db_filename) until it finds Jagr.
-        * Except: if starting_player_id is Jagr's -> returns "This is Jagr"
-        * Except: if starting_player_id has no parent in BFS -> returns "Found no connection to Jagr"
+    Construct the teammates graph as a CSRGraph (see top of file) using the "teammate_edges"
+    table of db_filename.
 
-    If neither exception holds, computes list of player names, computes list of shared teams,
-    and returns the joined, interleaved result.
+    Rows are streamed from the cursor (no fetchall()), and each player id is mapped to an
+    integer index the first time it is seen. Endpoints are kept in typed arrays, so the
+    memory cost is a few bytes per edge rather than a Python set entry per edge.
+
+    Every player in the "players" table gets a node, including players with no teammates.
+    Duplicate pairs, if any, are collapsed to a single edge.
     """
-    curr_id = starting_player_id
-    player_id_sequence = [curr_id]
-    team_sequence = []
+    connection = database._connect(db_filename)
+    cursor = connection.cursor()
 
-    # Handle special cases:
-    if curr_id == root:
-        return 0, "This is Jagr"
-    elif database.get_bfs_parent(curr_id, db_filename) == "DISCONNECTED":
-        return "Infinity", "Found no connection to Jagr"
+    player_ids = []
+    index_of = dict()
+
+    # Nodes: every player, in a stable (sorted) order.
+    for (player_id,) in cursor.execute("SELECT id FROM players ORDER BY id;"):
+        index_of[player_id] = len(player_ids)
+        player_ids.append(player_id)
+
+    # Edges: stream (teammate1_id, teammate2_id) rows into two int arrays.
+    sources = array("i")
+    targets = array("i")
+    for p1_id, p2_id in cursor.execute("SELECT teammate1_id, teammate2_id FROM teammate_edges;"):
+        for pid in (p1_id, p2_id):
+            if pid not in index_of:  # in team_membership but missing from "players"
+                index_of[pid] = len(player_ids)
+                player_ids.append(pid)
+        sources.append(index_of[p1_id])
+        targets.append(index_of[p2_id])
+
+    connection.close()
+    instrumentation.count("graph.edges_loaded", len(sources))
+
+    num_nodes = len(player_ids)
+    key_base = max(num_nodes, 1)
+    sources = np.frombuffer(sources, dtype=np.int32)
+    targets = np.frombuffer(targets, dtype=np.int32)
+
+    # Store both directions, then de-duplicate by sorting on a single int64 key.
+    keys = np.concatenate((
+        sources.astype(np.int64) * key_base + targets,
+        targets.astype(np.int64) * key_base + sources,
+    ))
+    keys = np.unique(keys)  # sorted by (source, target)
+    edge_sources = (keys // key_base).astype(np.int32)
+    neighbors = (keys % key_base).astype(np.int32)
+
+    degrees = np.bincount(edge_sources, minlength=num_nodes)
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(degrees, out=offsets[1:])
+
+    return CSRGraph(player_ids, index_of, offsets, neighbors)
+
+
+def get_csr_graph(db_filename):
+    """
+    Same as make_csr_graph, but loaded from a snapshot (see snapshot.py) while the database is unchanged.
+    """
+    return snapshot.cached(db_filename, "csr_graph", make_csr_graph, db_filename)
+
+
+def csr_neighbors(graph, index):
+    """
+    Returns the (read-only view of the) array of neighbor indices of node "index" in a CSRGraph.
+    """
+    return graph.neighbors[graph.offsets[index]:graph.offsets[index + 1]]
+
+
+def _gather(offsets, values, nodes):
+    """
+    Concatenates the CSR lists values[offsets[n]:offsets[n+1]] of all nodes, and returns them
+    together with the node each value came from.
+    """
+    starts = offsets[nodes]
+    counts = offsets[nodes + 1] - starts
+    total = int(counts.sum())
+    run_starts = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return values[run_starts + np.arange(total)], np.repeat(nodes, counts)
+
+
+def csr_edge_positions(graph, first, second):
+    """
+    Returns the positions in graph.neighbors of the edges first[i] -> second[i] (two arrays of
+    node indices), e.g. to align per-edge data read from "teammate_edges" with the CSR lists.
+    The lists are sorted by (node, neighbor), so each edge is found by binary search on
+    node * n + neighbor.
+    """
+    num_nodes = len(graph.player_ids)
+    csr_keys = np.repeat(np.arange(num_nodes, dtype=np.int64), np.diff(graph.offsets)) * num_nodes + graph.neighbors
+    keys = np.asarray(first, dtype=np.int64) * num_nodes + np.asarray(second, dtype=np.int64)
+    return np.searchsorted(csr_keys, keys)
+
+
+def csr_BFS_arrays(graph, root_index, component_size=None):
+    """
+    Level-synchronous BFS over a CSRGraph, starting at node root_index.
+
+    Each level is expanded with whole-array operations: the adjacency slices of the
+    current frontier are gathered at once, undiscovered nodes are kept, and each one is
+    assigned the first frontier node that reached it.
+
+    If component_size (the number of nodes reachable from the root, see union_find.py) is given,
+    the search stops at the level where the last of them is discovered.
+
+    Returns two int32 arrays (parent, distance), indexed by node:
+        - parent[root_index] = root_index, parent[i] = -1 if i is unreachable
+        - distance[i] = number of hops from the root, or -1 if unreachable
+    """
+    num_nodes = len(graph.player_ids)
+    offsets, neighbors = graph.offsets, graph.neighbors
+
+    parent = np.full(num_nodes, -1, dtype=np.int32)
+    distance = np.full(num_nodes, -1, dtype=np.int32)
+    parent[root_index] = root_index
+    distance[root_index] = 0
+
+    frontier = np.array([root_index], dtype=np.int32)
+    num_discovered = 1
+    level = 0
+    while frontier.size and (not component_size or num_discovered < component_size):
+        level += 1
+        # All frontier adjacency lists, concatenated.
+        candidates, discoverers = _gather(offsets, neighbors, frontier)
+        instrumentation.count("bfs.nodes_visited", frontier.size)
+        instrumentation.count("bfs.edges_scanned", candidates.size)
+        if candidates.size == 0:
+            break
+
+        undiscovered = parent[candidates] == -1
+        candidates = candidates[undiscovered]
+        discoverers = discoverers[undiscovered]
+
+        # A node may be reached by several frontier nodes: keep its first discoverer.
+        frontier, first = np.unique(candidates, return_index=True)
+        parent[frontier] = discoverers[first]
+        distance[frontier] = level
+        num_discovered += frontier.size
+
+    return parent, distance
+
+
+def BFS_csr(db_filename, root='jagrja01', graph=None, component_size=None):
+    """
+    Array-backed equivalent of BFS(): runs BFS from root over the CSRGraph of db_filename
+    (built with make_csr_graph unless "graph" is supplied). The size of root's component is read
+    from "union_find" (unless supplied, or db_filename is None) to stop the search early.
+
+    Returns the same dict as BFS(), ready for database.make_BFS_parent_table():
+        - parent[root] = "HIMSELF"
+        - parent[player_id] = id of the BFS parent who discovered player_id
+        - parent[player_id] = "DISCONNECTED" if no connection was found
+    """
+    if graph is None:
+        graph = make_csr_graph(db_filename)
+
+    if component_size is None and db_filename is not None:
+        component_size = union_find.component_size(root, db_filename)
+
+    parent_index, _ = csr_BFS_arrays(graph, graph.index_of[root], component_size=component_size)
+
+    player_ids = graph.player_ids
+    parent = dict()
+    for idx, parent_idx in enumerate(parent_index.tolist()):
+        if parent_idx == -1:
+            parent[player_ids[idx]] = "DISCONNECTED"
+        else:
+            parent[player_ids[idx]] = player_ids[parent_idx]
+    parent[root] = "HIMSELF"
+
+    return parent
+
+
+# Set in each worker process of BFS_many_roots by _init_BFS_worker.
+_worker_graph = None
+
+
+def _init_BFS_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _BFS_worker(job):
+    root, component_size = job
+    return root, BFS_csr(None, root=root, graph=_worker_graph, component_size=component_size)
+
+
+def BFS_many_roots(db_filename, roots, graph=None, processes=None):
+    """
+    Runs BFS_csr from each of roots, in parallel over a pool of "processes" worker processes
+    (default: one per core, and never more than there are roots). The CSRGraph is loaded once
+    (from its snapshot, see get_csr_graph, unless supplied) and sent to each worker once.
+
+    Returns a dict mapping each root to its BFS parent dict.
+    """
+    roots = list(dict.fromkeys(roots))
+    if graph is None:
+        graph = get_csr_graph(db_filename)
+    if len(roots) <= 1:
+        return {root: BFS_csr(db_filename, root=root, graph=graph) for root in roots}
+
+    # Component sizes are read here, since the workers have no database connection.
+    jobs = [ (root, union_find.component_size(root, db_filename) if db_filename else None) for root in roots ]
+    num_workers = min(len(roots), processes or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_BFS_worker, initargs=(graph,)) as pool:
+        return dict(pool.map(_BFS_worker, jobs))
+
+
+def bfs_tree_depths(parent):
+    """
+    Given a BFS parent dict (as output by BFS, or read from "bfs_parent_by_root"), returns a dict
+    mapping each player_id to its distance from the root, or None if it is "DISCONNECTED".
+
+    Each chain of parents is walked only once, so this is linear in the number of players.
+    """
+    depth = dict()
+    for player_id in parent:
+        chain = []
+        curr_id = player_id
+        while curr_id not in depth:
+            parent_id = parent.get(curr_id, "DISCONNECTED")
+            if parent_id == "HIMSELF":
+                depth[curr_id] = 0
+            elif parent_id == "DISCONNECTED":
+                depth[curr_id] = None
+            else:
+                chain.append(curr_id)
+                curr_id = parent_id
+        for chained_id in reversed(chain):
+            parent_depth = depth[parent[chained_id]]
+            depth[chained_id] = None if parent_depth is None else parent_depth + 1
+    return depth
+
+
+def bfs_ancestor_rows(parent, players=None):
+    """
+    Given a BFS parent dict, returns the rows of its binary-lifting table, as a list of
+    (player_id, level, ancestor_id): the ancestor 2**level steps above player_id, for every level
+    with 2**level <= depth of player_id (the root and disconnected players have none).
+    Only the rows of the players in "players" are returned, if given.
+
+    Built level by level: the ancestor 2**(level+1) steps up is the ancestor 2**level steps up of
+    the ancestor 2**level steps up, so this takes O(n log(depth)).
+    """
+    jump = {player_id: parent_id for player_id, parent_id in parent.items()
+            if parent_id not in ("HIMSELF", "DISCONNECTED")}
+    rows = []
+    level = 0
+    while jump:
+        rows.extend( (player_id, level, ancestor_id) for player_id, ancestor_id in jump.items()
+                     if players is None or player_id in players )
+        jump = {player_id: jump[ancestor_id] for player_id, ancestor_id in jump.items() if ancestor_id in jump}
+        level += 1
+    return rows
+
+
+def tree_lca(player1_id, player2_id, db_filename, root='jagrja01'):
+    """
+    Returns the lowest common ancestor of two players in the stored BFS tree of root (the
+    deepest player that both tree paths to root go through), or None if either of them is not
+    connected to root. Uses the depths and the jump table "bfs_ancestors": O(log n) lookups.
+    """
+    cursor = database.get_connection(db_filename).cursor()
+    depth1 = database.get_bfs_depth(player1_id, db_filename, root=root)
+    depth2 = database.get_bfs_depth(player2_id, db_filename, root=root)
+    if depth1 is None or depth2 is None:
+        return None
+    if depth1 < depth2:
+        player1_id, player2_id, depth1, depth2 = player2_id, player1_id, depth2, depth1
+
+    def ancestor(player_id, level):
+        cursor.execute("SELECT ancestor_id FROM bfs_ancestors WHERE root_id = ? AND player_id = ? AND level = ?;",
+                       (root, player_id, level))
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    # Lift the deeper player to the depth of the other one, one power of two at a time.
+    difference = depth1 - depth2
+    level = 0
+    while difference:
+        if difference & 1:
+            player1_id = ancestor(player1_id, level)
+        difference >>= 1
+        level += 1
+    if player1_id == player2_id:
+        return player1_id
+
+    # Then lift both by the largest jumps that keep them apart: they end up just below the LCA.
+    for level in reversed(range(depth2.bit_length())):
+        ancestor1 = ancestor(player1_id, level)
+        ancestor2 = ancestor(player2_id, level)
+        if ancestor1 is not None and ancestor1 != ancestor2:
+            player1_id, player2_id = ancestor1, ancestor2
+    return ancestor(player1_id, 0)
+
+
+def tree_path(player1_id, player2_id, db_filename, root='jagrja01'):
+    """
+    Returns the path between two players through the stored BFS tree of root (up from player1_id
+    to their LCA, see tree_lca, then down to player2_id), as a list of player ids, or None if
+    either of them is not connected to root. It is a path of teammates, but not always a shortest one.
+    """
+    lca = tree_lca(player1_id, player2_id, db_filename, root=root)
+    if lca is None:
+        return None
 
-    while curr_id != root:
-        parent_id = database.get_bfs_parent(curr_id, db_filename)  # returns a player id
-        shared_team = database.common_team(curr_id, parent_id, db_filename) # returns a team name + season
+    def up_to_lca(player_id):
+        chain = [player_id]
+        while chain[-1] != lca:
+            chain.append(database.get_bfs_parent(chain[-1], db_filename, root=root))
+        return chain
 
-        player_id_sequence.append(parent_id)
-        team_sequence.append(shared_team)
+    return up_to_lca(player1_id) + up_to_lca(player2_id)[-2::-1]
 
-        # move to next person in sequence
-        curr_id = parent_id
 
-    # Turn player ids into recognizable names:
-    player_name_sequence = [ database.get_player_name_from_id(pid, db_filename) for pid in player_id_sequence  ]
+def distance_upper_bound(player1_id, player2_id, db_filename, root='jagrja01'):
+    """
+    Returns the length of the tree path between two players (see tree_path), without building it:
+    depth1 + depth2 - 2 * depth(LCA). Their distance is at most this (and at least |depth1 - depth2|).
+    Returns None if either of them is not connected to root.
+    """
+    lca = tree_lca(player1_id, player2_id, db_filename, root=root)
+    if lca is None:
+        return None
+    return (database.get_bfs_depth(player1_id, db_filename, root=root)
+            + database.get_bfs_depth(player2_id, db_filename, root=root)
+            - 2 * database.get_bfs_depth(lca, db_filename, root=root))
+
+
+def repair_BFS_tree(cursor, new_pairs, new_player_ids=(), root='jagrja01'):
+    """
+    Updates the BFS tree of root (on an open cursor, without committing) after the teammate
+    pairs in new_pairs were added to the "teammate_edges" table, without redoing the whole BFS.
+
+    Adding edges can only shorten distances to the root, so it is enough to:
+        1. relax each new edge (u, v): if depth(u) + 1 < depth(v), u becomes v's parent,
+        2. relax the teammates of every player whose depth decreased, in order of depth,
+           until no distance improves (a unit-weight Dijkstra started from the affected players).
+    Only the players whose parent changed are rewritten. Players in new_player_ids that are
+    still unreachable are recorded as "DISCONNECTED".
+
+    The stored depths are read only for the players reached (the ends of the new pairs and the
+    teammates of the players whose depth decreased), so the cost depends on the change, not on
+    the size of the tree.
+
+    Returns the dict of changed rows (player_id -> new parent_id).
+    """
+    # Depths of the players read so far (unreachable players, or players not in the tree yet,
+    # are infinitely far), and which of them are in the tree.
+    depth = dict()
+    in_tree = set()
+
+    def read_depths(player_ids):
+        unread = [player_id for player_id in set(player_ids) if player_id not in depth]
+        stored = database.get_bfs_depths(cursor, unread, root=root)
+        in_tree.update(stored)
+        for player_id in unread:
+            player_depth = stored.get(player_id)
+            depth[player_id] = float("inf") if player_depth is None else player_depth
+
+    changed = dict()
+    heap = []
+
+    def relax(u, v):
+        if depth[u] + 1 < depth[v]:
+            depth[v] = depth[u] + 1
+            changed[v] = u
+            heapq.heappush(heap, (depth[v], v))
+
+    new_pairs = list(new_pairs)
+    read_depths([player_id for pair in new_pairs for player_id in pair] + list(new_player_ids))
+    for p1_id, p2_id in new_pairs:
+        relax(p1_id, p2_id)
+        relax(p2_id, p1_id)
+
+    while heap:
+        curr_depth, curr_id = heapq.heappop(heap)
+        if curr_depth > depth[curr_id]:
+            continue  # stale entry: a shorter path was found since it was pushed
+        teammate_ids = database.get_teammate_ids(cursor, curr_id)
+        read_depths(teammate_ids)
+        for teammate_id in teammate_ids:
+            relax(curr_id, teammate_id)
+
+    for player_id in new_player_ids:
+        if player_id not in in_tree and player_id not in changed:
+            changed[player_id] = "DISCONNECTED"
+
+    # Every player whose depth decreased is in "changed", so these are also the only players
+    # whose depths and ancestors need rewriting.
+    database.set_bfs_parents(cursor, changed, {player_id: None if parent_id == "DISCONNECTED" else depth[player_id]
+                                               for player_id, parent_id in changed.items()}, root=root)
+    return changed
+
+
+def bidirectional_BFS(teammates_graph, source_id, target_id, components=None):
+    """
+    Finds a shortest path between two players in teammates_graph (as output by make_graph)
+    by growing one BFS ball around each endpoint until they meet.
+
+    Each round expands one full level of the side whose frontier is smaller, so a query
+    only touches the neighbourhoods of the two players instead of the whole graph.
+
+    If components (a dict mapping players to the root of their component, see
+    union_find.load_components) is given, players in different components are answered
+    at once, without any search.
+
+    Returns the list of player ids [source_id, ..., target_id], or None if no path exists.
+    """
+    if source_id == target_id:
+        return [source_id]
+    if source_id not in teammates_graph or target_id not in teammates_graph:
+        return None  # at least one of the players has no teammates in the database
+    if components is not None and components.get(source_id) != components.get(target_id):
+        return None
+
+    # parent maps for each side; the endpoints are their own parents.
+    source_parent = {source_id: None}
+    target_parent = {target_id: None}
+    source_frontier = [source_id]
+    target_frontier = [target_id]
+
+    while source_frontier and target_frontier:
+        # Expand the cheaper side.
+        expand_source = len(source_frontier) <= len(target_frontier)
+        if expand_source:
+            frontier, this_parent, other_parent = source_frontier, source_parent, target_parent
+        else:
+            frontier, this_parent, other_parent = target_frontier, target_parent, source_parent
+
+        next_frontier = []
+        meeting_id = None
+        instrumentation.count("bfs.nodes_visited", len(frontier))
+        for curr_id in frontier:
+            for teammate_id in teammates_graph[curr_id]:
+                if teammate_id in this_parent:
+                    continue
+                this_parent[teammate_id] = curr_id
+                next_frontier.append(teammate_id)
+                if teammate_id in other_parent:
+                    meeting_id = teammate_id
+                    break
+            if meeting_id is not None:
+                break
+
+        if meeting_id is not None:
+            # The two balls were disjoint before this level, so any meeting node lies on the
+            # outer layer of the other ball: the first one found already gives a shortest path.
+            return _join_bidirectional_path(meeting_id, source_parent, target_parent)
+
+        if expand_source:
+            source_frontier = next_frontier
+        else:
+            target_frontier = next_frontier
+
+    return None
+
+
+def _join_bidirectional_path(meeting_id, source_parent, target_parent):
+    """
+    Combines the two half-paths found by bidirectional_BFS at meeting_id.
+    """
+    path = []
+    curr_id = meeting_id
+    while curr_id is not None:
+        path.append(curr_id)
+        curr_id = source_parent[curr_id]
+    path.reverse()
+
+    curr_id = target_parent[meeting_id]
+    while curr_id is not None:
+        path.append(curr_id)
+        curr_id = target_parent[curr_id]
+    return path
+
+
+def format_path(hops):
+    """
+    Turns a path given as hops (player_id, player_name, shared_team), where shared_team is
+    shared with the next player (see database.resolve_bfs_path), into the human-readable
+    output of the program: player names interleaved with shared teams.
 
-    # Combine the player sequence and team sequence for human-readable output.
+    Returns (distance, result), where distance is the number of hops.
+    """
     result = ""
-    for idx in range(len(team_sequence)):
-        p1 = player_name_sequence[idx]
-        p2 = player_name_sequence[idx+1]
-        team = team_sequence[idx]
+    for idx in range(len(hops) - 1):
+        p1 = hops[idx][1]
+        p2 = hops[idx+1][1]
+        team = hops[idx][2]
         result += f"{p1} played on {team} with {p2}.\n"
 
-    distance = len(team_sequence)
+    distance = len(hops) - 1
     return distance, result
 
+
+def render_path(player_id_sequence, db_filename):
+    """
+    Turns a sequence of player ids (consecutive players being teammates) into the
+    human-readable output of the program (see format_path).
+
+    Returns (distance, result), where distance is the number of hops.
+    """
+    hops = []
+    for idx, player_id in enumerate(player_id_sequence):
+        if idx + 1 < len(player_id_sequence):
+            shared_team = database.common_team(player_id, player_id_sequence[idx+1], db_filename)
+        else:
+            shared_team = None
+        hops.append( (player_id, database.get_player_name_from_id(player_id, db_filename), shared_team) )
+
+    return format_path(hops)
+
+
+def shortest_path_between(source_id, target_id, db_filename, teammates_graph=None):
+    """
+    Answers "six degrees of X to Y" for any two players, using bidirectional_BFS over
+    the teammates graph (built with make_graph unless supplied, so that many queries
+    can share one graph). Players in different components (see union_find.py) are answered
+    without building or searching the graph.
+
+    Returns (distance, result) in the same format as traverse_bfs_path:
+        * if both ids are the same player -> (0, "These are the same player")
+        * if no path exists -> ("Infinity", "Found no connection between these players")
+    """
+    if source_id == target_id:
+        return 0, "These are the same player"
+    if not union_find.are_connected(source_id, target_id, db_filename):
+        return "Infinity", "Found no connection between these players"
+
+    if teammates_graph is None:
+        teammates_graph = make_graph(db_filename)
+
+    player_id_sequence = bidirectional_BFS(teammates_graph, source_id, target_id)
+    if player_id_sequence is None:
+        return "Infinity", "Found no connection between these players"
+
+    return render_path(player_id_sequence, db_filename)
+
+
+def make_bipartite_graph(db_filename):
+    """
+    Construct a BipartiteGraph (see top of file) from the "team_membership" table of db_filename.
+
+    Its size is linear in the number of roster memberships, whereas the teammates graph has
+    one edge per pair of players on each roster (quadratic in roster size).
+    Every player in the "players" table gets a node, as in make_csr_graph.
+    """
+    connection = database._connect(db_filename)
+    cursor = connection.cursor()
+
+    player_ids = []
+    index_of = dict()
+    for (player_id,) in cursor.execute("SELECT id FROM players ORDER BY id;"):
+        index_of[player_id] = len(player_ids)
+        player_ids.append(player_id)
+
+    # Stream memberships roster by roster (the roster index of team_membership is covering).
+    rosters = []
+    members = array("i")
+    member_rosters = array("i")
+    membership_query = "SELECT team_id, season, player_id FROM team_membership ORDER BY team_id, season;"
+    for team_id, season, player_id in cursor.execute(membership_query):
+        if not rosters or rosters[-1] != (team_id, season):
+            rosters.append( (team_id, season) )
+        if player_id not in index_of:
+            index_of[player_id] = len(player_ids)
+            player_ids.append(player_id)
+        members.append(index_of[player_id])
+        member_rosters.append(len(rosters) - 1)
+
+    connection.close()
+    instrumentation.count("graph.memberships_loaded", len(members))
+
+    num_players = len(player_ids)
+    num_rosters = len(rosters)
+    members = np.frombuffer(members, dtype=np.int32)
+    member_rosters = np.frombuffer(member_rosters, dtype=np.int32)
+
+    # Roster -> players: memberships are already grouped by roster.
+    roster_offsets = np.zeros(num_rosters + 1, dtype=np.int64)
+    np.cumsum(np.bincount(member_rosters, minlength=num_rosters), out=roster_offsets[1:])
+    roster_players = members.copy()
+
+    # Player -> rosters: group the same memberships by player instead.
+    order = np.argsort(members, kind="stable")
+    player_offsets = np.zeros(num_players + 1, dtype=np.int64)
+    np.cumsum(np.bincount(members, minlength=num_players), out=player_offsets[1:])
+    player_rosters = member_rosters[order]
+
+    return BipartiteGraph(player_ids, index_of, rosters, player_offsets, player_rosters,
+                          roster_offsets, roster_players)
+
+
+def bipartite_BFS_arrays(graph, root_index, component_size=None):
+    """
+    Level-synchronous BFS over a BipartiteGraph from player root_index. Each level goes from the
+    frontier players to their rosters, then from the rosters reached for the first time to their
+    players; a roster is expanded only once, when it is first reached.
+
+    If component_size (the number of players reachable from the root, see union_find.py) is given,
+    the search stops at the level where the last of them is discovered.
+
+    Returns three int32 arrays indexed by player (as csr_BFS_arrays, plus the roster used):
+        - parent[i]: player who discovered i (root: itself; unreachable: -1)
+        - distance[i]: number of teammate hops from the root (unreachable: -1)
+        - via_roster[i]: roster that i shares with parent[i] (root, unreachable: -1)
+    """
+    num_players = len(graph.player_ids)
+    parent = np.full(num_players, -1, dtype=np.int32)
+    distance = np.full(num_players, -1, dtype=np.int32)
+    via_roster = np.full(num_players, -1, dtype=np.int32)
+    roster_expanded = np.zeros(len(graph.rosters), dtype=bool)
+    parent[root_index] = root_index
+    distance[root_index] = 0
+
+    frontier = np.array([root_index], dtype=np.int32)
+    num_discovered = 1
+    level = 0
+    while frontier.size and (not component_size or num_discovered < component_size):
+        level += 1
+
+        # Players -> rosters not expanded yet (each one attributed to its first discoverer).
+        rosters, discoverers = _gather(graph.player_offsets, graph.player_rosters, frontier)
+        instrumentation.count("bfs.nodes_visited", frontier.size)
+        instrumentation.count("bfs.edges_scanned", rosters.size)
+        keep = ~roster_expanded[rosters]
+        rosters, first = np.unique(rosters[keep], return_index=True)
+        discoverers = discoverers[keep][first]
+        roster_expanded[rosters] = True
+        if rosters.size == 0:
+            break
+
+        # Rosters -> players not discovered yet.
+        players, player_rosters = _gather(graph.roster_offsets, graph.roster_players, rosters)
+        instrumentation.count("bfs.rosters_visited", rosters.size)
+        instrumentation.count("bfs.edges_scanned", players.size)
+        keep = parent[players] == -1
+        players, first = np.unique(players[keep], return_index=True)
+        found_rosters = player_rosters[keep][first]
+
+        # "rosters" is sorted (np.unique), so each roster's discoverer is found by binary search.
+        parent[players] = discoverers[np.searchsorted(rosters, found_rosters)]
+        distance[players] = level
+        via_roster[players] = found_rosters
+        num_discovered += players.size
+        frontier = players
+
+    return parent, distance, via_roster
+
+
+def BFS_bipartite(db_filename, root='jagrja01', graph=None, component_size=None, shared_teams=False):
+    """
+    Bipartite equivalent of BFS_csr(): runs BFS over the players/rosters graph of db_filename
+    (built with make_bipartite_graph unless "graph" is supplied), without ever materializing
+    the teammate pairs. Distances are the same as over the teammates graph. The size of root's
+    component is read from "union_find" (unless supplied, or db_filename is None) to stop early.
+
+    Returns the same dict as BFS(), ready for database.make_BFS_parent_table().
+    With shared_teams=True, returns (that dict, labels), where labels maps every player with a
+    BFS parent to the (team_id, season) of the earliest roster they shared (see
+    bipartite_shared_team), the label that "teammate_edges" gives the same tree edge.
+    """
+    if graph is None:
+        graph = make_bipartite_graph(db_filename)
+
+    if component_size is None and db_filename is not None:
+        component_size = union_find.component_size(root, db_filename)
+
+    parent_index, _, _ = bipartite_BFS_arrays(graph, graph.index_of[root], component_size=component_size)
+
+    player_ids = graph.player_ids
+    parent = dict()
+    for idx, parent_idx in enumerate(parent_index.tolist()):
+        if parent_idx == -1:
+            parent[player_ids[idx]] = "DISCONNECTED"
+        else:
+            parent[player_ids[idx]] = player_ids[parent_idx]
+    parent[root] = "HIMSELF"
+
+    if shared_teams:
+        labels = {player_id: bipartite_shared_team(graph, player_id, parent_id) for player_id, parent_id in parent.items()
+                  if parent_id not in ("HIMSELF", "DISCONNECTED")}
+        return parent, labels
+    return parent
+
+
+def bipartite_shared_team(graph, player1_id, player2_id):
+    """
+    Returns (team_id, season) of the earliest roster shared by two players of a BipartiteGraph
+    (the same label as first_team_id / first_season in "teammate_edges": ties within a season go
+    to the smallest team_id, see database.FIRST_TEAM_ID), or None.
+    """
+    def rosters_of(player_id):
+        idx = graph.index_of[player_id]
+        return set(graph.player_rosters[graph.player_offsets[idx]:graph.player_offsets[idx + 1]].tolist())
+
+    shared = rosters_of(player1_id) & rosters_of(player2_id)
+    if not shared:
+        return None
+    return min( (graph.rosters[r] for r in shared), key=lambda roster: (roster[1], roster[0]) )
+
+
+def traverse_bfs_path(starting_player_id, db_filename, root='jagrja01'):
+    """
+    Attempts to traverse BFS path (in the BFS tree of root, see "bfs_parent_by_root") until it finds root.
+        * Except: if starting_player_id is root -> returns "This is <root's name>"
+        * Except: if starting_player_id has no parent in BFS -> returns "Found no connection to <root's name>"
+
+    If neither exception holds, returns the joined, interleaved list of player names and
+    shared teams. The whole chain (ids, names, shared teams) is resolved by a single query
+    (see database.resolve_bfs_path).
+    """
+    # Handle special cases:
+    if starting_player_id == root:
+        return 0, f"This is {database.get_player_name_from_id(root, db_filename)}"
+
+    hops = database.resolve_bfs_path(starting_player_id, db_filename, root=root)
+    if not hops or hops[-1][0] != root:
+        return "Infinity", f"Found no connection to {database.get_player_name_from_id(root, db_filename)}"
+
+    return format_path(hops)
@@ -1,90 +1,70 @@
 # File to store various small helper functions for the main.py file.
-import sqlite3
+import name_search # my name_search.py file
 
 ########################################################################
 # Function signatures for functions herein:
 #
-# count_relevant_players(first, last, db_file)
 # get_and_validate_user_input(db_file)
-# get_id_from_player_name(first, last, db_filename)
-# get_relevant_players(first, last, db_file)
-# print_relevant_players(first, last, db_file):
-# set_of_relevant_players(first, last, db_file)
+# resolve_player_query(query, db_file)
 #
 ########################################################################
 
-def count_relevant_players(first, last, db_file):
-    list_of_rows = get_relevant_players(first, last, db_file)
-    return len(list_of_rows)
-
-
 def get_and_validate_user_input(db_file):
     """
     Returns first name, last name, and player id for player selected by user.
+
+    The name is looked up in the in-memory name index (see name_search.py), so any number of
+    tokens, accents or not, and small typos are accepted. If several players have that exact
+    name, all of them are listed; if none does, up to 10 close matches are. Either way the user
+    picks one by id.
     """
-    player_name = input("Type a player's name: ").strip().split()
-    if len(player_name) != 2:
+    player_name = input("Type a player's name: ").strip()
+    if not name_search.normalize_tokens(player_name):
         print("\nPlease supply input as <first_name> <last_name>.")
         return False, False, False
 
-    first = player_name[0].title()
-    last = player_name[1].title()
+    name_index = name_search.get_name_index(db_file)
+    exact = name_index.exact_matches(player_name)
+    if len(exact) == 1:
+        match = exact[0]
+        return match["first_name"], match["last_name"], match["player_id"]
 
-    name_count = count_relevant_players(first, last, db_file)
-    if name_count == 0:
-        print("\nNo such player exists in our database.")
-        return False, False, False
-    elif name_count > 1:
-        s = set_of_relevant_players(first, last, db_file)
+    if exact:
         print("\nWe found multiple players with that name in our database:")
-        print_relevant_players(first, last, db_file) # prints birth year and id, to distinguish players with same name.
-        player_id = input("\nPlease type the ID of the player: ")
-        while player_id not in s:
-            player_id = input("\nPlease type the ID of the player: ")
+        choices = exact
+    else:
+        choices = name_index.search(player_name, limit=10)
+        if len(choices) == 0:
+            print("\nNo such player exists in our database.")
+            return False, False, False
+        print("\nDid you mean:")
+    for match in choices: # prints birth year and id, to distinguish players with same name.
+        print(f"{match['first_name']} {match['last_name']} born {match['birth_year']}. id: {match['player_id']}")
 
-    elif name_count == 1:
-        player_id = get_id_from_player_name(first, last, db_file)
+    by_id = {match["player_id"]: match for match in choices}
+    player_id = input("\nPlease type the ID of the player: ").strip()
+    while player_id not in by_id:
+        player_id = input("\nPlease type the ID of the player: ").strip()
 
-    return first, last, player_id
+    match = by_id[player_id]
+    return match["first_name"], match["last_name"], player_id
 
 
-def get_id_from_player_name(first, last, db_filename):
+def resolve_player_query(query, db_file):
     """
-    Retrieves a player's id given the name... provided it's unique.
+    Non-interactive lookup of one player, given as a player id or as a name matching exactly one player
+    (e.g. for the --root option of main.py). Returns the player id, or None (after printing why).
     """
-    list_of_players = get_relevant_players(first, last, db_filename)
-
-    if len(list_of_players) == 1:
-        id_index = 0 # based on query in get_relevant_players
-        return list_of_players[0][id_index]
+    query = query.strip()
+    name_index = name_search.get_name_index(db_file)
+    if query in name_index.player_ids:
+        return query
+
+    exact = name_index.exact_matches(query)
+    if len(exact) == 1:
+        return exact[0]["player_id"]
+    if exact:
+        print(f"Several players are named {query}; use one of these ids: " + ", ".join(m["player_id"] for m in exact))
     else:
-        raise ValueError("This name does not appear uniquely in our database.")
-
-
-def get_relevant_players(first, last, db_file):
-    """
-    Returns list of rows from "players" table with matching name.
-    """
-    db_connection = sqlite3.connect(db_file)
-    db_cursor = db_connection.cursor()
-
-    player_query = "SELECT id, first_name, last_name, birth_year FROM players WHERE first_name = ? AND last_name = ?;"
-    db_cursor.execute(player_query, (first, last))
-    return db_cursor.fetchall()
-
-
-def print_relevant_players(first, last, db_file):
-    list_of_players = get_relevant_players(first, last, db_file)
-    for row in list_of_players:
-        id, F, L, birth = row
-        print(f"{F} {L} born {birth}. id: {id}")
-
-    return
-
-def set_of_relevant_players(first, last, db_file):
-    list_of_players = get_relevant_players(first, last, db_file)
-    s = set()
-    for row in list_of_players:
-        s.add( row[0] )
-    return s
-
+        print(f"No player named {query} in our database.")
+    return None
@@ -0,0 +1,139 @@
+# Optional instrumentation: timing spans and counters, to see where a run spends its time.
+# Enabled by the environment variable SIX_DEGREES_TRACE:
+#   SIX_DEGREES_TRACE=1     -> a summary table is printed (to stderr) when the program exits
+#   SIX_DEGREES_TRACE=json  -> one JSON line per finished span as it happens, and a JSON summary at exit
+# When it is not set, span() returns a shared no-op context manager and count() / add_time()
+# return immediately, so the instrumented code pays one function call and one test per call site.
+
+import atexit, json, os, sys, threading, time
+
+########################################################################
+# Function signatures for functions herein:
+#
+# add_time(name, seconds)
+# count(name, amount=1)
+# enable(mode="table")
+# report(file=None)
+# reset()
+# span(name)
+# summary()
+#
+########################################################################
+
+ENV_VAR = "SIX_DEGREES_TRACE"
+
+_mode = os.environ.get(ENV_VAR, "").strip().lower()
+ENABLED = _mode not in ("", "0", "false", "off")
+
+_counters = dict()  # name -> total
+_timings = dict()   # name -> [calls, total seconds, max seconds]
+_lock = threading.Lock()  # counters are updated from scraper worker threads too
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    """
+    Context manager timing its block under "name" (calls, total and max duration are kept).
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def add_time(name, seconds):
+    """
+    Records a duration measured elsewhere (e.g. a sleep) under "name", as if it were a span.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        timing = _timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+    if _mode == "json":
+        print(json.dumps({"event": "span", "name": name, "seconds": seconds, "time": time.time()}),
+              file=sys.stderr)
+
+
+def count(name, amount=1):
+    """
+    Adds amount to the counter "name".
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def enable(mode="table"):
+    """
+    Turns instrumentation on from code (mode "table" or "json", as for SIX_DEGREES_TRACE).
+    Only affects what happens afterwards; the summary is not printed automatically.
+    """
+    global ENABLED, _mode
+    ENABLED = True
+    _mode = mode
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+
+
+def summary():
+    """
+    Returns everything recorded so far as a dict:
+        {"spans": {name: {"calls", "seconds", "max_seconds"}}, "counters": {name: total}}
+    """
+    with _lock:
+        spans = {name: {"calls": calls, "seconds": total, "max_seconds": longest}
+                 for name, (calls, total, longest) in sorted(_timings.items())}
+        counters = dict(sorted(_counters.items()))
+    return {"spans": spans, "counters": counters}
+
+
+def report(file=None):
+    """
+    Prints the summary, as a table (or as one JSON object in "json" mode), to file (default: stderr).
+    """
+    file = file or sys.stderr
+    results = summary()
+    if _mode == "json":
+        print(json.dumps({"event": "summary", **results}), file=file)
+        return
+
+    print(f"\n{'span':36}{'calls':>8}{'total s':>12}{'max s':>12}", file=file)
+    for name, timing in results["spans"].items():
+        print(f"{name:36}{timing['calls']:8d}{timing['seconds']:12.4f}{timing['max_seconds']:12.4f}", file=file)
+    print(f"\n{'counter':36}{'total':>12}", file=file)
+    for name, total in results["counters"].items():
+        print(f"{name:36}{total:12d}", file=file)
+
+
+if ENABLED:
+    atexit.register(report)
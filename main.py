@@ -1,64 +1,326 @@
 # Main .py file for this project.
 
+import argparse, os, sys
+import batch
 import database
 import helpers
 import graph_operations
+import instrumentation
 
-def main():
+# Declare which database file to construct
+DB_FILE = "1980_to_2025.db"  # got an error 2025/03/06 when scraping for 45 years of data.
+#DB_FILE = "auto.db"
+
+# Specify CSV file for meta data used to make database (teams, years)
+TEAM_NAMES_CSV = "team_info/small_names.csv"
+TEAM_SEASONS_CSV = "team_info/small_seasons.csv"
+# TEAM_NAMES_CSV = "team_info/tiny_names.csv"
+# TEAM_SEASONS_CSV = "team_info/tiny_seasons.csv"
+
+
+def prepare_database(db_file, team_names_csv, team_seasons_csv, pipelined=False, cache_dir=None, replay=False,
+                     archive_dir=None):
+    """
+    Ensures the tables have been initialized and populated (only rosters missing from the
+    "scrape_log" table are fetched), then prepares the "teammate_edges" table.
+
+    With pipelined=True, scraping uses database.add_to_database_pipelined (rate-limited
+    worker threads) instead of the serial database.add_to_database.
+    cache_dir / replay are passed on to select the local HTML cache or rebuild offline from it.
+    With an archive_dir, missing rosters are read from saved pages there instead (see
+    database.add_to_database_from_archive): offline, parsed by a pool of processes.
+
+    Returns the number of players in the database.
+
+    Fast path: if the database was fully prepared for this same team_seasons_csv and table layout
+    (database.SCHEMA_REVISION) and has not changed since (see database.get_db_meta), none of this
+    is redone, and the number of players stored then is returned. Otherwise set_up_db also
+    migrates older tables, e.g. adds the bitmasks used by constrained_paths.py.
+    """
+    csv_stat = os.stat(team_seasons_csv)
+    seasons_signature = f"{os.path.abspath(team_seasons_csv)}:{csv_stat.st_mtime_ns}:{csv_stat.st_size}"
+    with instrumentation.span("prepare.db_meta"):
+        meta = database.get_db_meta(db_file)
+    if meta.get("version") is not None and meta.get("prepared_version") == meta["version"] \
+            and meta.get("prepared_seasons_csv") == seasons_signature \
+            and meta.get("prepared_schema") == database.SCHEMA_REVISION:
+        return int(meta["num_players"])
+
+    with instrumentation.span("prepare.set_up_db"):
+        database.set_up_db(db_file)
+    with instrumentation.span("prepare.pending_seasons"):
+        pending = database.get_pending_seasons(db_file, team_seasons_csv)
+    if pending:
+        # Only fetch the rosters that have not been ingested yet (or failed last time).
+        print(f"Fetching {len(pending)} roster(s) missing from the database...")
+        with instrumentation.span("prepare.scrape"):
+            if archive_dir is not None:
+                database.add_to_database_from_archive(db_file, team_names_csv, team_seasons_csv, archive_dir)
+            elif pipelined and not replay:
+                database.add_to_database_pipelined(db_file, team_names_csv, team_seasons_csv, cache_dir=cache_dir)
+            else:
+                database.add_to_database(db_file, team_names_csv, team_seasons_csv, cache_dir=cache_dir, replay=replay)
+
+    with instrumentation.span("prepare.count_players"):
+        num_players = len(database.get_all_players(db_file))
+
+    # Prepare the "teammate_edges" table:
+    with instrumentation.span("prepare.make_teammates_table"):
+        database.make_teammates_table(db_file)
+
+    # Record that this version is ready, unless some rosters are still missing (they will be retried).
+    if not database.get_pending_seasons(db_file, team_seasons_csv):
+        database.set_db_meta(db_file, prepared_version=database.get_db_version(db_file),
+                             prepared_seasons_csv=seasons_signature, prepared_schema=database.SCHEMA_REVISION,
+                             num_players=num_players)
+    return num_players
+
+
+def ensure_bfs_parent(db_file, num_players, roots=('jagrja01',)):
+    """
+    Checks that the BFS tree of every root in roots is stored (in "bfs_parent_by_root"), or makes it.
+    Missing trees are computed in parallel, one process per root. The roots are then marked as
+    used, and the least recently used trees beyond database.MAX_BFS_ROOTS are evicted.
+    """
+    with instrumentation.span("bfs.check_ready"):
+        missing = [root for root in roots if database.check_bfs_parent_ready(db_file, root=root) < num_players]
+    if missing:
+        # Do BFS and store the trees.
+        with instrumentation.span("bfs.build_trees"):
+            trees = graph_operations.BFS_many_roots(db_file, missing)
+        with instrumentation.span("bfs.store_trees"):
+            for root, bfs_parent_dict in trees.items():
+                database.make_BFS_parent_table(bfs_parent_dict, db_file, root=root)
+
+    for root in roots:
+        database.touch_bfs_root(db_file, root)
+    database.evict_bfs_roots(db_file, keep=roots)
+
+
+def resolve_roots(db_file, root, warm_roots=()):
+    """
+    Turns the --root and --warm-roots options (player ids or unique names) into player ids,
+    the root first. Exits if one of them is not a unique player.
+    """
+    root_ids = []
+    for query in [root] + list(warm_roots):
+        player_id = helpers.resolve_player_query(query, db_file)
+        if player_id is None:
+            sys.exit(1)
+        root_ids.append(player_id)
+    return list(dict.fromkeys(root_ids))
+
+
+def main(pipelined=False, cache_dir=None, replay=False, root='jagrja01', warm_roots=(), archive_dir=None,
+         all_paths=0):
     """
     Executes all steps of the project:
     0. Set up: ensure database ready, user input is valid.
-    1. Checks if "bfs_parent" table in the data base (and constructs if isn't)
-    2. Call "traverse_bfs_path()" to get distance to Jagr and sequence of teammates + common teams
+    1. Checks if the BFS tree of root (Jagr by default) is stored in the data base (and constructs it if isn't)
+    2. Call "traverse_bfs_path()" to get distance to root and sequence of teammates + common teams
     3. Print the resulting path data in human-readable form.
+    4. If all_paths > 0: count all the shortest paths to root, and print the all_paths best ones
+       (most seasons shared along the path), see print_shortest_paths.
     """
 
     ### Step 0: Set-up
-
-    # Declare which database file to construct
-    db_file = "1980_to_2025.db"  # got an error 2025/03/06 when scraping for 45 years of data.
-    #db_file = "auto.db"
-
-    # Specify CSV file for meta data used to make database (teams, years)
-    team_names_csv = "team_info/small_names.csv"  
-    team_seasons_csv = "team_info/small_seasons.csv" 
-    # team_names_csv = "team_info/tiny_names.csv"
-    # team_seasons_csv = "team_info/tiny_seasons.csv"
-
-    # Ensure the tables have been initialized: 
-    database.set_up_db(db_file)  
-    EXPECTED_NUM_PLAYERS = 200
-    num_players = len(database.get_all_players(db_file))
-    if num_players < EXPECTED_NUM_PLAYERS:
-        # Only bother constructing the database if it appears incomplete.
-        # We use "completeness" proxy of checking it has "enough" players.
-        database.add_to_database(db_file, team_names_csv, team_seasons_csv)
-    
-    num_players = len(database.get_all_players(db_file)) # reset the number of players after adding
+    db_file = DB_FILE
+    with instrumentation.span("main.0_prepare_database"):
+        num_players = prepare_database(db_file, TEAM_NAMES_CSV, TEAM_SEASONS_CSV, pipelined=pipelined,
+                                       cache_dir=cache_dir, replay=replay, archive_dir=archive_dir)
+        roots = resolve_roots(db_file, root, warm_roots)
+    root = roots[0]
 
     # Get and Validate User Input
-    player_id = False
-    while not player_id:
-        first, last, player_id = helpers.get_and_validate_user_input(db_file)
-
-    # Prepare the "teammates" table:
-    database.make_teammates_table(db_file)
+    with instrumentation.span("main.0_user_input"):
+        player_id = False
+        while not player_id:
+            first, last, player_id = helpers.get_and_validate_user_input(db_file)
 
-    ## Step 1: Check that the table for BFS parents is ready, or make it.
-    num_rows = database.check_bfs_parent_ready(db_file)
-    if num_rows < num_players:
-        # Do BFS and make the bfs_parent table.
-        bfs_parent_dict = graph_operations.BFS(db_file, root='jagrja01')
-        database.make_BFS_parent_table(bfs_parent_dict, db_file)
+    ## Step 1: Check that the BFS tree of root is ready, or make it.
+    with instrumentation.span("main.1_ensure_bfs_parent"):
+        ensure_bfs_parent(db_file, num_players, roots)
 
-    ## Step 2:  Call "traverse_bfs_path()" to get distance to Jagr and sequence of teammates + common teams
-    distance, result = graph_operations.traverse_bfs_path( player_id, db_file, root='jagrja01')
+    ## Step 2:  Call "traverse_bfs_path()" to get distance to root and sequence of teammates + common teams
+    with instrumentation.span("main.2_traverse_bfs_path"):
+        distance, result = graph_operations.traverse_bfs_path( player_id, db_file, root=root)
 
     ## Step 3: Print the result:
-    print(f"\n{first} {last}'s distance to Jagr = {distance}:")
-    print(result, '\n')
+    with instrumentation.span("main.3_print"):
+        print(f"\n{first} {last}'s distance to {database.get_player_name_from_id(root, db_file)} = {distance}:")
+        print(result, '\n')
+
+    ## Step 4 (optional): alternatives to that path.
+    if all_paths:
+        with instrumentation.span("main.4_all_paths"):
+            print_shortest_paths(player_id, db_file, root, limit=all_paths)
     return distance
 
 
+def print_shortest_paths(player_id, db_file, root, limit=5):
+    """
+    Prints how many shortest paths there are between player_id and root, then the "limit" ones
+    whose teammates shared the most seasons (see shortest_paths.py).
+    """
+    import shortest_paths # imported here, since it needs NumPy
+    graph = graph_operations.get_csr_graph(db_file)
+    dag = shortest_paths.get_shortest_path_dag(db_file, root, graph=graph)
+    count = shortest_paths.count_shortest_paths(dag, player_id)
+    if count == 0:
+        return
+    weights = shortest_paths.get_edge_weights(db_file, graph)
+    print(f"There {'is 1 shortest path' if count == 1 else f'are {count} shortest paths'} of this length. "
+          f"With the most seasons shared along the way:\n")
+    for rank, (seasons, path) in enumerate(shortest_paths.iter_best_paths(dag, player_id, weights), start=1):
+        print(f"#{rank} ({seasons} shared seasons):")
+        print(graph_operations.render_path(path, db_file)[1])
+        if rank == limit:
+            break
+
+
+def pair_main(pipelined=False, cache_dir=None, replay=False, archive_dir=None):
+    """
+    "Six degrees of X to Y": asks for two players and prints a shortest path between them.
+
+    Uses bidirectional BFS over the in-memory teammates graph, which is built once and
+    reused for every query in the session.
+    """
+    db_file = DB_FILE
+    prepare_database(db_file, TEAM_NAMES_CSV, TEAM_SEASONS_CSV, pipelined=pipelined,
+                     cache_dir=cache_dir, replay=replay, archive_dir=archive_dir)
+    teammates_graph = graph_operations.make_graph(db_file)
+
+    another = "y"
+    while another.strip().lower().startswith("y"):
+        print("\nFirst player:")
+        player1_id = False
+        while not player1_id:
+            first1, last1, player1_id = helpers.get_and_validate_user_input(db_file)
+
+        print("Second player:")
+        player2_id = False
+        while not player2_id:
+            first2, last2, player2_id = helpers.get_and_validate_user_input(db_file)
+
+        distance, result = graph_operations.shortest_path_between(player1_id, player2_id, db_file,
+                                                                   teammates_graph=teammates_graph)
+        print(f"\n{first1} {last1}'s distance to {first2} {last2} = {distance}:")
+        print(result, '\n')
+
+        another = input("Another pair? (y/n): ")
+
+
+def batch_main(input_path, output_path="-", output_format="jsonl", pipelined=False, cache_dir=None, replay=False,
+               root='jagrja01', warm_roots=(), archive_dir=None):
+    """
+    Non-interactive mode: reads one player name or id per line of input_path ("-" for stdin)
+    and streams one result per line to output_path ("-" for stdout), as JSON lines or CSV.
+
+    The database is prepared and the lookup tables (distances to root) are loaded once for the whole batch.
+    """
+    db_file = DB_FILE
+    num_players = prepare_database(db_file, TEAM_NAMES_CSV, TEAM_SEASONS_CSV, pipelined=pipelined,
+                                   cache_dir=cache_dir, replay=replay, archive_dir=archive_dir)
+    roots = resolve_roots(db_file, root, warm_roots)
+    ensure_bfs_parent(db_file, num_players, roots)
+
+    input_file = sys.stdin if input_path == "-" else open(input_path, "r")
+    output_file = sys.stdout if output_path == "-" else open(output_path, "w", newline="")
+    try:
+        count = batch.run_batch(db_file, input_file, output_file, output_format=output_format, root=roots[0])
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    print(f"Answered {count} lookups.", file=sys.stderr)
+    return count
+
+
+def histogram_main(pipelined=False, cache_dir=None, replay=False, root='jagrja01', archive_dir=None):
+    """
+    Prints how many players are at each distance from root (their "Jagr numbers" by default),
+    read from the depths stored with the BFS tree of root (see database.get_depth_histogram).
+    """
+    db_file = DB_FILE
+    num_players = prepare_database(db_file, TEAM_NAMES_CSV, TEAM_SEASONS_CSV, pipelined=pipelined,
+                                   cache_dir=cache_dir, replay=replay, archive_dir=archive_dir)
+    roots = resolve_roots(db_file, root)
+    ensure_bfs_parent(db_file, num_players, roots)
+
+    histogram = database.get_depth_histogram(db_file, root=roots[0])
+    print(f"Players at each distance from {database.get_player_name_from_id(roots[0], db_file)}:")
+    for depth in sorted(d for d in histogram if d is not None):
+        print(f"{depth:>4}  {histogram[depth]}")
+    if None in histogram:
+        print(f"none  {histogram[None]} (not connected)")
+    return histogram
+
+
+def serve_main(host="127.0.0.1", port=8000, pipelined=False, cache_dir=None, replay=False,
+               root='jagrja01', warm_roots=(), archive_dir=None):
+    """
+    Server mode: prepares the database once, then answers HTTP/JSON queries (see server.py),
+    with distances and paths to root by default, until interrupted.
+    """
+    db_file = DB_FILE
+    num_players = prepare_database(db_file, TEAM_NAMES_CSV, TEAM_SEASONS_CSV, pipelined=pipelined,
+                                   cache_dir=cache_dir, replay=replay, archive_dir=archive_dir)
+    roots = resolve_roots(db_file, root, warm_roots)
+    ensure_bfs_parent(db_file, num_players, roots)
+
+    import asyncio, server # imported here, so that the other modes start faster
+    try:
+        asyncio.run(server.serve(db_file, host=host, port=port, root=roots[0]))
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Six Degrees of Jaromir Jagr")
+    parser.add_argument("--pair", action="store_true",
+                        help="find the shortest path between any two players (instead of to Jagr)")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="if the database must be (re)built, scrape with concurrent rate-limited workers")
+    parser.add_argument("--cache-dir", default=None,
+                        help="keep fetched roster pages in this local HTML cache")
+    parser.add_argument("--replay", action="store_true",
+                        help="build the database from the HTML cache only, without any network calls")
+    parser.add_argument("--archive", metavar="DIR", default=None,
+                        help="build the database offline from saved roster pages in DIR, parsed by a process pool")
+    parser.add_argument("--batch", metavar="FILE", default=None,
+                        help="answer every player name or id in FILE (one per line, '-' for stdin) without prompts")
+    parser.add_argument("--output", metavar="FILE", default="-",
+                        help="where to write batch results ('-' for stdout, the default)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl",
+                        help="format of batch results")
+    parser.add_argument("--histogram", action="store_true",
+                        help="print how many players are at each distance from the root, then exit")
+    parser.add_argument("--serve", action="store_true",
+                        help="run a local HTTP/JSON server (endpoints: /distance, /path, /search)")
+    parser.add_argument("--host", default="127.0.0.1", help="address the server listens on")
+    parser.add_argument("--port", type=int, default=8000, help="port the server listens on")
+    parser.add_argument("--root", default="jagrja01",
+                        help="player (id or unique name) that distances are measured to (default: Jagr)")
+    parser.add_argument("--all-paths", metavar="N", type=int, default=0,
+                        help="also count every shortest path to the root, and print the N with the most shared seasons")
+    parser.add_argument("--warm-roots", metavar="IDS", default="",
+                        help="comma-separated players (ids or unique names) whose BFS trees to build/keep as well")
+    args = parser.parse_args()
+    warm_roots = [query for query in args.warm_roots.split(",") if query.strip()]
+
+    if args.serve:
+        serve_main(args.host, args.port, pipelined=args.pipelined, cache_dir=args.cache_dir, replay=args.replay,
+                   root=args.root, warm_roots=warm_roots, archive_dir=args.archive)
+    elif args.batch:
+        batch_main(args.batch, args.output, args.format,
+                   pipelined=args.pipelined, cache_dir=args.cache_dir, replay=args.replay,
+                   root=args.root, warm_roots=warm_roots, archive_dir=args.archive)
+    elif args.histogram:
+        histogram_main(pipelined=args.pipelined, cache_dir=args.cache_dir, replay=args.replay,
+                       root=args.root, archive_dir=args.archive)
+    elif args.pair:
+        pair_main(pipelined=args.pipelined, cache_dir=args.cache_dir, replay=args.replay, archive_dir=args.archive)
+    else:
+        main(pipelined=args.pipelined, cache_dir=args.cache_dir, replay=args.replay,
+             root=args.root, warm_roots=warm_roots, archive_dir=args.archive, all_paths=args.all_paths)
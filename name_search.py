@@ -0,0 +1,213 @@
+# An in-memory index of player names, for prefix (autocomplete), multi-token and typo-tolerant lookups.
+# Built once from the "players" table, then every search is answered from memory.
+
+import bisect, re
+import database # my database.py file
+import snapshot # my snapshot.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# build_name_index(db_filename)
+# edit_distance(a, b, max_distance)
+# get_name_index(db_filename)
+# normalize_tokens(name)
+#
+# class NameIndex(players)
+#     .exact_matches(query)
+#     .search(query, limit=10)
+#
+########################################################################
+
+# Suffixes that are part of how people write some names, but not of the names in our data.
+IGNORED_TOKENS = {"jr", "sr", "ii", "iii", "iv"}
+
+# Indexes built by get_name_index, one per database file.
+_name_indexes = dict()
+
+
+def normalize_tokens(name):
+    """
+    Splits a name into lower-case tokens without diacritics, splitting on anything that is
+    not a letter or digit (so "Jean-Gabriel Pageau Jr." -> ["jean", "gabriel", "pageau"]).
+    """
+    tokens = re.split(r"[^a-z0-9]+", database.remove_diacritics(name).lower())
+    return [token for token in tokens if token and token not in IGNORED_TOKENS]
+
+
+def _trigrams(token):
+    padded = f"$${token}$"
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Levenshtein distance between strings a and b, or max_distance + 1 as soon as it is
+    certain to exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i-1] == b[j-1] else 1
+            current[j] = min(previous[j] + 1, current[j-1] + 1, previous[j-1] + cost)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def _max_edits(token):
+    """
+    Number of typos tolerated in a query token of this length.
+    """
+    if len(token) <= 3:
+        return 0
+    if len(token) <= 6:
+        return 1
+    return 2
+
+
+class NameIndex:
+    """
+    Index of player names. "players" is a list of (player_id, first_name, last_name, birth_year).
+
+    Holds:
+        - player_ids: set of the ids of all players, to recognize a query that is an id,
+        - postings: token -> set of indices of the players whose name contains the token,
+        - sorted_tokens: all distinct tokens, sorted, so a prefix maps to a contiguous range,
+        - trigram_tokens: trigram -> set of tokens containing it, to find near-misses quickly.
+    """
+
+    def __init__(self, players):
+        self.players = list(players)
+        self.player_ids = {player[0] for player in self.players}
+        self.full_names = []
+        self.postings = dict()
+        self.trigram_tokens = dict()
+
+        for idx, (player_id, first, last, birth_year) in enumerate(self.players):
+            full_name = f"{first} {last}"
+            self.full_names.append(" ".join(normalize_tokens(full_name)))
+            for token in normalize_tokens(full_name):
+                self.postings.setdefault(token, set()).add(idx)
+
+        self.sorted_tokens = sorted(self.postings)
+        for token in self.sorted_tokens:
+            for trigram in _trigrams(token):
+                self.trigram_tokens.setdefault(trigram, set()).add(token)
+
+    def _prefix_tokens(self, prefix):
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        end = start
+        while end < len(self.sorted_tokens) and self.sorted_tokens[end].startswith(prefix):
+            end += 1
+        return self.sorted_tokens[start:end]
+
+    def _fuzzy_tokens(self, token):
+        """
+        Returns a dict mapping each indexed token within _max_edits(token) of "token" to its distance.
+        """
+        max_edits = _max_edits(token)
+        query_trigrams = _trigrams(token)
+
+        # A token within k edits shares at least len(trigrams) - 3k trigrams with the query.
+        shared = dict()
+        for trigram in query_trigrams:
+            for candidate in self.trigram_tokens.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        min_shared = len(query_trigrams) - 3 * max_edits
+
+        matches = dict()
+        for candidate, count in shared.items():
+            if count >= min_shared:
+                distance = edit_distance(token, candidate, max_edits)
+                if distance <= max_edits:
+                    matches[candidate] = distance
+        return matches
+
+    def _candidates(self, tokens, fuzzy):
+        """
+        Returns a dict mapping each player index matching every query token to its number of edits.
+        Every token must match exactly (or with typos, if fuzzy); the last one may also be a prefix.
+        """
+        result = None
+        for position, token in enumerate(tokens):
+            edits_by_player = dict()
+            matched = self._fuzzy_tokens(token) if fuzzy else ({token: 0} if token in self.postings else {})
+            if position == len(tokens) - 1:
+                for prefix_token in self._prefix_tokens(token):
+                    matched.setdefault(prefix_token, 0)
+            for matched_token, distance in matched.items():
+                for idx in self.postings[matched_token]:
+                    if distance < edits_by_player.get(idx, distance + 1):
+                        edits_by_player[idx] = distance
+
+            if result is None:
+                result = edits_by_player
+            else:
+                result = {idx: result[idx] + edits for idx, edits in edits_by_player.items() if idx in result}
+            if not result:
+                return dict()
+        return result or dict()
+
+    def search(self, query, limit=10):
+        """
+        Returns up to "limit" players matching query, as a list of dicts with keys
+        "player_id", "first_name", "last_name", "birth_year", "exact" (query is the full name)
+        and "edits" (typos corrected). Exact and prefix matches are tried first; typo-tolerant
+        matching is only used if they find nothing. Best matches come first.
+        """
+        tokens = normalize_tokens(query)
+        if not tokens:
+            return []
+
+        candidates = self._candidates(tokens, fuzzy=False)
+        if not candidates:
+            candidates = self._candidates(tokens, fuzzy=True)
+
+        normalized_query = " ".join(tokens)
+        ranked = sorted(candidates.items(),
+                        key=lambda item: (self.full_names[item[0]] != normalized_query, item[1], self.full_names[item[0]]))
+
+        return [self._match(idx, edits, self.full_names[idx] == normalized_query) for idx, edits in ranked[:limit]]
+
+    def exact_matches(self, query):
+        """
+        Returns every player whose full name is query (up to case, accents and punctuation), in
+        the same format as search, with no limit: the players of the postings of all its tokens
+        whose normalized name is the whole query.
+        """
+        tokens = normalize_tokens(query)
+        if not tokens or any(token not in self.postings for token in tokens):
+            return []
+        normalized_query = " ".join(tokens)
+        indices = set.intersection(*(self.postings[token] for token in tokens))
+        exact = sorted(idx for idx in indices if self.full_names[idx] == normalized_query)
+        return [self._match(idx, 0, True) for idx in exact]
+
+    def _match(self, idx, edits, exact):
+        player_id, first, last, birth_year = self.players[idx]
+        return {"player_id": player_id, "first_name": first, "last_name": last, "birth_year": birth_year,
+                "exact": exact, "edits": edits}
+
+
+def build_name_index(db_filename):
+    """
+    Builds a NameIndex from the "players" table of db_filename (one query).
+    """
+    cursor = database.get_connection(db_filename).cursor()
+    cursor.execute("SELECT id, first_name, last_name, birth_year FROM players;")
+    return NameIndex(cursor.fetchall())
+
+
+def get_name_index(db_filename):
+    """
+    Returns the NameIndex of db_filename, loaded on first use from its snapshot
+    (see snapshot.py), or built (and saved as a snapshot) if the database changed since.
+    """
+    if db_filename not in _name_indexes:
+        _name_indexes[db_filename] = snapshot.cached(db_filename, "names", build_name_index, db_filename)
+    return _name_indexes[db_filename]
@@ -1,56 +1,243 @@
 # Functions that automatically retrieve roster information from Hockey-Reference
 # so it can be directly inserted to the database.
 
-import time, requests 
-from bs4 import BeautifulSoup 
+import datetime, gzip, hashlib, os, threading, time, requests
+from bs4 import BeautifulSoup
+import instrumentation # my instrumentation.py file
 
-def scrape_roster(team_id, year, timeout=10):
+########################################################################
+# Function signatures for functions herein:
+#
+# current_season(today=None)
+# fetch_roster_html(team_id, year, session=None, timeout=10, limiter=None, base_url=HOCKEY_REFERENCE_URL)
+# get_roster_html(team_id, year, cache_dir=None, offline=False, ttl=CURRENT_SEASON_TTL, **fetch_kwargs)
+# is_roster_cached(cache_dir, team_id, year, ttl=CURRENT_SEASON_TTL)
+# make_session(pool_size=4)
+# parse_roster_html(html, team_id, year)
+# read_cached_roster_html(cache_dir, team_id, year, ttl=CURRENT_SEASON_TTL)
+# scrape_roster(team_id, year, timeout=10, session=None, limiter=None, base_url=HOCKEY_REFERENCE_URL,
+#               cache_dir=None, offline=False, ttl=CURRENT_SEASON_TTL)
+# write_cached_roster_html(cache_dir, team_id, year, html)
+#
+# class RateLimiter(requests_per_minute=20, burst=1)
+#
+########################################################################
+
+HOCKEY_REFERENCE_URL = "https://www.hockey-reference.com"
+REQUESTS_PER_MINUTE = 20   # Hockey-Reference's limit for bot traffic
+LOCKOUT_SEASON = 2005      # the 2004-2005 NHL season was cancelled
+
+# Raw roster pages can be kept in a local, content-addressed cache:
+#   <cache_dir>/objects/<sha256[:2]>/<sha256>.html.gz   gzip-compressed page, named by the hash of its content
+#   <cache_dir>/keys/<team_id>/<year>                  text file holding the sha256 of that roster's page
+# Completed seasons never change, so their entries never expire. The current season's entry
+# is re-fetched once its key file is older than CURRENT_SEASON_TTL seconds.
+DEFAULT_CACHE_DIR = "html_cache"
+CURRENT_SEASON_TTL = 24 * 60 * 60
+
+
+class RateLimiter:
     """
-    Returns python dict mapping player_id (key) to lastname_comma_firstname (assoc. value) for each player 
-    on specified roster. 
+    Token bucket shared by all threads that make requests to the same site.
 
-    Fetches html table for roster data given a team_id (e.g. "CGY") and a year (e.g. 1989 means "1988-1989 season").
+    Tokens are added at requests_per_minute / 60 per second, up to "burst" tokens.
+    acquire() takes a token, and if none is available it reserves the next one (the count
+    goes negative) and sleeps until it is due. Reservations are handed out in order under a
+    lock, so concurrent callers are spaced exactly 60 / requests_per_minute seconds apart,
+    however long each request then takes.
+    """
 
-    Uses requests to retrieve the html and bs4 to parse it.
-    Default setting of 10 seconds before timeout.
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, burst=1):
+        self.rate = requests_per_minute / 60.0  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until the caller may make one request. Returns the time spent waiting (s).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+            instrumentation.add_time("scraper.sleep", wait)
+        return wait
+
+
+def current_season(today=None):
     """
-    # Handle NHL lock-out season (2004-2005) without making a request
-    if int(year) == 2005:
-        return dict() 
+    Returns the season (as its end year, e.g. 2025 for 2024-2025) in progress on "today".
+    A new season is counted from July, once the previous playoffs are over.
+    """
+    if today is None:
+        today = datetime.date.today()
+    return today.year + 1 if today.month >= 7 else today.year
+
+
+def _cache_key_path(cache_dir, team_id, year):
+    return os.path.join(cache_dir, "keys", team_id, str(year))
+
 
-    url = f"https://www.hockey-reference.com/teams/{team_id}/{year}.html" 
+def _cache_object_path(cache_dir, digest):
+    return os.path.join(cache_dir, "objects", digest[:2], f"{digest}.html.gz")
+
+
+def _atomic_write(path, data):
+    """
+    Writes bytes to path via a temporary file, so readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def is_roster_cached(cache_dir, team_id, year, ttl=CURRENT_SEASON_TTL):
+    """
+    Returns True if cache_dir holds a usable page for team_id in year:
+    any entry for a past season, or an entry younger than ttl seconds for the current season.
+    """
+    if cache_dir is None:
+        return False
+    key_path = _cache_key_path(cache_dir, team_id, year)
     try:
-        response = requests.get(url, timeout = timeout)
+        age = time.time() - os.path.getmtime(key_path)
+    except OSError:
+        return False
+    return int(year) < current_season() or age <= ttl
+
+
+def read_cached_roster_html(cache_dir, team_id, year, ttl=CURRENT_SEASON_TTL):
+    """
+    Returns the cached page (bytes) for team_id in year, or None if there is no usable entry
+    (see is_roster_cached). Pass ttl=float("inf") to accept a stale current-season page.
+    """
+    if not is_roster_cached(cache_dir, team_id, year, ttl):
+        return None
+    try:
+        with open(_cache_key_path(cache_dir, team_id, year), "r") as file:
+            digest = file.read().strip()
+        with gzip.open(_cache_object_path(cache_dir, digest), "rb") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def write_cached_roster_html(cache_dir, team_id, year, html):
+    """
+    Stores a fetched page in cache_dir: the compressed content under its sha256 (only once,
+    since identical pages share an object), then the team_id/year key pointing at it.
+    """
+    digest = hashlib.sha256(html).hexdigest()
+    object_path = _cache_object_path(cache_dir, digest)
+    if not os.path.exists(object_path):
+        _atomic_write(object_path, gzip.compress(html))
+    _atomic_write(_cache_key_path(cache_dir, team_id, year), digest.encode())
+    return digest
 
-        # To handle errors based on status code:
-        if response.status_code != 200:
-            time.sleep(2)
-            print(f"Failed to retrieve {url}. Status code: {response.status_code}")
-            return dict()
 
-    except requests.exceptions.Timeout as err:
+def get_roster_html(team_id, year, cache_dir=None, offline=False, ttl=CURRENT_SEASON_TTL, **fetch_kwargs):
+    """
+    Returns the roster page for team_id in year, from cache_dir if possible.
+
+    On a cache miss, the page is downloaded with fetch_roster_html(**fetch_kwargs) and stored.
+    With offline=True the network is never used (a stale current-season page is accepted),
+    and None is returned if the page was never cached.
+    """
+    if cache_dir is not None:
+        html = read_cached_roster_html(cache_dir, team_id, year, ttl=float("inf") if offline else ttl)
+        if html is not None:
+            instrumentation.count("scraper.cache_hits")
+            return html
+    if offline:
+        print(f"No cached page for {team_id} in {year}.")
+        return None
+
+    html = fetch_roster_html(team_id, year, **fetch_kwargs)
+    if html is not None and cache_dir is not None:
+        write_cached_roster_html(cache_dir, team_id, year, html)
+    return html
+
+
+def make_session(pool_size=4):
+    """
+    Returns a requests.Session whose connection pool keeps up to pool_size keep-alive
+    connections per host, so repeated roster requests reuse TCP/TLS connections.
+
+    Safe to share between pool_size worker threads.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_roster_html(team_id, year, session=None, timeout=10, limiter=None, base_url=HOCKEY_REFERENCE_URL):
+    """
+    Downloads the roster page for team_id in year and returns its content (bytes),
+    or None if the request failed.
+
+    If a RateLimiter is given, a token is acquired right before the request.
+    base_url can point at another server (e.g. a local stub for testing).
+    """
+    url = f"{base_url}/teams/{team_id}/{year}.html"
+    getter = session if session is not None else requests
+
+    if limiter is not None:
+        limiter.acquire()
+    try:
+        with instrumentation.span("scraper.fetch"):
+            response = getter.get(url, timeout = timeout)
+    except requests.exceptions.RequestException as err:
         print(err)
-        return dict() 
+        return None
+
+    # To handle errors based on status code:
+    if response.status_code != 200:
+        print(f"Failed to retrieve {url}. Status code: {response.status_code}")
+        return None
+
+    return response.content
 
-    soup = BeautifulSoup(response.content, "html.parser") 
-    roster_table = soup.find("table", id="roster") 
+
+def parse_roster_html(html, team_id, year):
+    """
+    Returns python dict mapping player_id (key) to lastname_comma_firstname (assoc. value)
+    for each player in the "#roster" table of a roster page, or None if no table was found.
+    """
+    with instrumentation.span("scraper.parse"):
+        return _parse_roster_html(html, team_id, year)
+
+
+def _parse_roster_html(html, team_id, year):
+    soup = BeautifulSoup(html, "html.parser")
+    roster_table = soup.find("table", id="roster")
 
     # If no such roster_table is found, note it and return:
     if roster_table is None:
         print(f"Table not found for {team_id} in {year}.")
-        time.sleep(2)
-        return dict() 
+        return None
 
     roster_tbody = roster_table.find("tbody")
 
     contents = roster_tbody.contents  # list of <tr> elements, some of which are empty (usually every other one)
 
     if len(contents) == 0:
-        print("Error in reading table body for {team_id} in {year}.")
-        return dict() 
+        print(f"Error in reading table body for {team_id} in {year}.")
+        return dict()
 
     # Go row-by-row in the table, extracting and adding data to a dict:
-    roster_dict = {} 
+    roster_dict = {}
     for entry in contents:
 
         # it's a meaningful row if it has around 10 tags inside of it, but certainly > 1...
@@ -62,7 +249,41 @@ def scrape_roster(team_id, year, timeout=10):
             player_id = tdata["data-append-csv"]
             last_comma_first = tdata["csk"]       # Note: this name may contain accents/diacritics.
             roster_dict[player_id] = last_comma_first
-    
-    return roster_dict 
 
+    return roster_dict
+
+
+def scrape_roster(team_id, year, timeout=10, session=None, limiter=None, base_url=HOCKEY_REFERENCE_URL,
+                  cache_dir=None, offline=False, ttl=CURRENT_SEASON_TTL):
+    """
+    Returns python dict mapping player_id (key) to lastname_comma_firstname (assoc. value) for each player
+    on specified roster.
+
+    Fetches html table for roster data given a team_id (e.g. "CGY") and a year (e.g. 1989 means "1988-1989 season").
+
+    Uses requests to retrieve the html and bs4 to parse it.
+    Default setting of 10 seconds before timeout.
+    Optionally, reuses a pooled session (see make_session) and waits on a shared RateLimiter.
+    With a cache_dir, pages are read from / saved to the local cache (see get_roster_html);
+    offline=True replays the cache without any network calls.
+    """
+    # Handle NHL lock-out season (2004-2005) without making a request
+    if int(year) == LOCKOUT_SEASON:
+        return dict()
+
+    html = get_roster_html(team_id, year, cache_dir=cache_dir, offline=offline, ttl=ttl,
+                           session=session, timeout=timeout, limiter=limiter, base_url=base_url)
+    if html is None:
+        if not offline:
+            with instrumentation.span("scraper.sleep"):
+                time.sleep(2)
+        return dict()
+
+    roster_dict = parse_roster_html(html, team_id, year)
+    if roster_dict is None:
+        if not offline:
+            with instrumentation.span("scraper.sleep"):
+                time.sleep(2)
+        return dict()
 
+    return roster_dict
@@ -0,0 +1,291 @@
+# A long-running local HTTP/JSON server answering distance, path and player-search queries.
+# The graph data is loaded once into memory, and reloaded whenever the database file changes.
+
+import asyncio, itertools, json, os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import batch # my batch.py file
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import name_search # my name_search.py file
+import shortest_paths # my shortest_paths.py file
+import snapshot # my snapshot.py file
+import union_find # my union_find.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# handle_request(state, method, target, cache, db_executor)  (coroutine)
+# load_state(db_filename, root='jagrja01')
+# serve(db_filename, host="127.0.0.1", port=8000, root='jagrja01', cache_size=10000, reload_interval=2.0)  (coroutine)
+#
+# class LRUCache(max_size)
+#
+# Endpoints (GET, JSON responses):
+#   /distance?player=<id or name>
+#   /path?from=<id or name>[&to=<id or name>]     (to defaults to the root, Jagr unless set otherwise)
+#   /paths?from=<id or name>[&to=<id or name>][&offset=0][&limit=10][&order=seasons|fixed]
+#                                                 (all shortest paths, a page at a time, see shortest_paths.py)
+#   /search?q=<name, or the start of one; typos tolerated>[&limit=10]
+#
+########################################################################
+
+
+class LRUCache:
+    """
+    Bounded mapping that evicts the least recently used entry once it holds max_size entries.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def _db_mtime(db_filename):
+    """
+    Last modification time of the database, including its write-ahead log if there is one.
+    """
+    mtime = os.path.getmtime(db_filename)
+    if os.path.exists(db_filename + "-wal"):
+        mtime = max(mtime, os.path.getmtime(db_filename + "-wal"))
+    return mtime
+
+
+def load_state(db_filename, root='jagrja01'):
+    """
+    Loads everything the server answers from: the lookup tables of batch.py (names, BFS tree,
+    depths, labels), the teammates graph and its components (see union_find.py) for arbitrary
+    pairs, and a name_search.NameIndex for player search (the tables and the index from their snapshots,
+    see snapshot.py). The DAGs of shortest paths used by /paths are added on demand (see _paths).
+    Returns them in a dict.
+    """
+    mtime = _db_mtime(db_filename)
+    tables = batch.get_lookup_tables(db_filename, root=root)
+    teammates_graph = graph_operations.make_graph(db_filename)
+    name_index = snapshot.cached(db_filename, "names", name_search.build_name_index, db_filename)
+    components = snapshot.cached(db_filename, "components", union_find.load_components, db_filename)
+
+    return {"db_filename": db_filename, "root": root, "mtime": mtime, "tables": tables,
+            "teammates_graph": teammates_graph, "name_index": name_index, "components": components,
+            "dags": OrderedDict()}
+
+
+def _distance(state, query):
+    tables = state["tables"]
+    player_id, error = batch.resolve_player_id(query, tables)
+    if error:
+        return 404, {"error": error}
+    return 200, {"player_id": player_id, "name": tables["names"][player_id],
+                 "distance": tables["depth"].get(player_id)}
+
+
+def _search(state, query, limit):
+    results = state["name_index"].search(query, limit=limit)
+    return 200, {"query": query, "results": results}
+
+
+async def _path(state, source_query, target_query, cache, db_executor):
+    tables = state["tables"]
+    source_id, error = batch.resolve_player_id(source_query, tables)
+    if error:
+        return 404, {"error": error}
+    target_id = state["root"]
+    if target_query:
+        target_id, error = batch.resolve_player_id(target_query, tables)
+        if error:
+            return 404, {"error": error}
+
+    key = (source_id, target_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return 200, cached
+
+    if target_id == state["root"]:
+        # Answered from the BFS tree, in memory.
+        record = batch.lookup_player(source_id, tables)
+        response = {"from": source_id, "to": target_id, "distance": record["distance"], "path": record["path"]}
+    else:
+        player_id_sequence = graph_operations.bidirectional_BFS(state["teammates_graph"], source_id, target_id,
+                                                                 components=state["components"])
+        if player_id_sequence is None:
+            response = {"from": source_id, "to": target_id, "distance": None, "path": []}
+        else:
+            # The shared teams come from one query, run off the event loop.
+            pairs = list(zip(player_id_sequence, player_id_sequence[1:]))
+            loop = asyncio.get_running_loop()
+            labels = await loop.run_in_executor(db_executor, database.get_shared_teams, pairs, state["db_filename"])
+            hops = [ (pid, tables["names"].get(pid), label) for pid, label in zip(player_id_sequence, labels + [None]) ]
+            distance, result = graph_operations.format_path(hops)
+            response = {"from": source_id, "to": target_id, "distance": distance, "path": result.splitlines()}
+
+    cache.put(key, response)
+    return 200, response
+
+
+# Number of DAGs of shortest paths (one per target player) kept in the state by _paths.
+MAX_DAGS = 16
+
+
+def _shortest_paths_page(state, source_id, target_id, offset, limit, order):
+    """
+    Returns the body of a /paths response (run on the database thread: it may read snapshots).
+    """
+    dags = state["dags"]
+    if target_id in dags:
+        dags.move_to_end(target_id)
+    else:
+        graph = graph_operations.get_csr_graph(state["db_filename"])
+        dags[target_id] = shortest_paths.get_shortest_path_dag(state["db_filename"], target_id, graph=graph)
+        if len(dags) > MAX_DAGS:
+            dags.popitem(last=False)
+    dag = dags[target_id]
+
+    paths = []
+    names = state["tables"]["names"]
+    if order == "seasons":
+        weights = shortest_paths.get_edge_weights(state["db_filename"], dag.graph)
+        ranked = itertools.islice(shortest_paths.iter_best_paths(dag, source_id, weights), offset, offset + limit)
+        for seasons, path in ranked:
+            paths.append({"players": path, "names": [names.get(pid) for pid in path], "shared_seasons": seasons})
+    else:
+        for path in shortest_paths.page_shortest_paths(dag, source_id, offset=offset, limit=limit):
+            paths.append({"players": path, "names": [names.get(pid) for pid in path]})
+    return {"from": source_id, "to": target_id, "count": shortest_paths.count_shortest_paths(dag, source_id),
+            "offset": offset, "order": order, "paths": paths}
+
+
+async def _paths(state, params, db_executor):
+    tables = state["tables"]
+    source_id, error = batch.resolve_player_id(params["from"], tables)
+    if error:
+        return 404, {"error": error}
+    target_id = state["root"]
+    if params.get("to"):
+        target_id, error = batch.resolve_player_id(params["to"], tables)
+        if error:
+            return 404, {"error": error}
+    try:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 10))
+    except ValueError:
+        return 400, {"error": "offset and limit must be integers."}
+    order = params.get("order", "seasons")
+    if order not in ("seasons", "fixed") or offset < 0 or limit < 0:
+        return 400, {"error": "order must be seasons or fixed, and offset and limit not negative."}
+
+    loop = asyncio.get_running_loop()
+    body = await loop.run_in_executor(db_executor, _shortest_paths_page, state, source_id, target_id,
+                                      offset, limit, order)
+    return 200, body
+
+
+async def handle_request(state, method, target, cache, db_executor):
+    """
+    Routes one request to its endpoint. Returns (status code, JSON-serializable body).
+    """
+    if method != "GET":
+        return 405, {"error": "Only GET requests are supported."}
+
+    url = urlsplit(target)
+    params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+    if url.path == "/distance" and "player" in params:
+        return _distance(state, params["player"])
+    if url.path == "/path" and "from" in params:
+        return await _path(state, params["from"], params.get("to"), cache, db_executor)
+    if url.path == "/paths" and "from" in params:
+        return await _paths(state, params, db_executor)
+    if url.path == "/search" and "q" in params:
+        try:
+            limit = int(params.get("limit", 10))
+        except ValueError:
+            return 400, {"error": "limit must be an integer."}
+        if limit < 0:
+            return 400, {"error": "limit must not be negative."}
+        return _search(state, params["q"], limit)
+    return 404, {"error": "Unknown endpoint or missing parameter."}
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+async def serve(db_filename, host="127.0.0.1", port=8000, root='jagrja01', cache_size=10000, reload_interval=2.0):
+    """
+    Runs the server until cancelled.
+
+    Requests are answered from the in-memory state (see load_state); the few that need SQLite
+    (labels of arbitrary paths) run on a single background thread over the shared connection,
+    so the event loop keeps serving other clients meanwhile. Rendered paths are kept in an
+    LRUCache of cache_size entries. Every reload_interval seconds the database file is checked,
+    and if it changed the state is rebuilt in the background, swapped in, and the cache cleared.
+    """
+    loop = asyncio.get_running_loop()
+    db_executor = ThreadPoolExecutor(max_workers=1)
+    cache = LRUCache(cache_size)
+    current = {"state": await loop.run_in_executor(db_executor, load_state, db_filename, root)}
+
+    async def client_connected(reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # headers are not needed
+            if len(request_line) != 3:
+                status, body = 400, {"error": "Malformed request."}
+            else:
+                try:
+                    status, body = await handle_request(current["state"], request_line[0], request_line[1],
+                                                        cache, db_executor)
+                except Exception as err:
+                    status, body = 500, {"error": str(err)}
+
+            payload = json.dumps(body).encode()
+            writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def watch_database():
+        while True:
+            await asyncio.sleep(reload_interval)
+            try:
+                changed = _db_mtime(db_filename) != current["state"]["mtime"]
+            except OSError:
+                continue
+            if changed:
+                new_state = await loop.run_in_executor(db_executor, load_state, db_filename, root)
+                current["state"] = new_state
+                cache.clear()
+                print(f"Reloaded {db_filename}.")
+
+    server = await asyncio.start_server(client_connected, host, port)
+    watcher = asyncio.create_task(watch_database())
+    print(f"Serving {db_filename} on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
+        db_executor.shutdown(wait=False)
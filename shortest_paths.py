@@ -0,0 +1,218 @@
+# All the shortest paths between players, not just the one stored in a BFS tree.
+# One BFS pass from a root records, for every player, its distance to the root and the number of
+# shortest paths to it. Together with the teammates graph, this is the DAG of shortest paths:
+# the next hops of a player towards the root are its teammates one step closer to the root.
+# Paths are then enumerated lazily from any player, either
+#   - in a fixed order (by node index), from any rank on, so they can be paged through, or
+#   - best first, by the total number of seasons shared along the path (top-k).
+
+from collections import namedtuple
+import heapq, itertools
+import numpy as np
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import snapshot # my snapshot.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# best_path_weights(dag, weights)
+# count_shortest_paths(dag, player_id)
+# get_edge_weights(db_filename, graph)
+# get_shortest_path_dag(db_filename, root='jagrja01', graph=None)
+# iter_best_paths(dag, player_id, weights)
+# iter_shortest_paths(dag, player_id, start=0)
+# load_edge_weights(db_filename, graph)
+# page_shortest_paths(dag, player_id, offset=0, limit=10, weights=None)
+# shortest_path_dag(graph, root_index)
+#
+########################################################################
+
+# DAG of the shortest paths to one root, over a graph_operations.CSRGraph:
+#   distance[i]  -> number of hops from node i to the root (int32), -1 if unreachable
+#   num_paths[i] -> number of distinct shortest paths between node i and the root
+#                   (Python ints in an object array, since they can exceed 64 bits), 0 if unreachable
+ShortestPathDAG = namedtuple("ShortestPathDAG", ["graph", "root_index", "distance", "num_paths"])
+
+
+def shortest_path_dag(graph, root_index):
+    """
+    Level-synchronous BFS from root_index over a CSRGraph (as graph_operations.csr_BFS_arrays),
+    which also counts the shortest paths: the count of a node is the sum of the counts of its
+    neighbors one level closer to the root. Every edge is scanned at most twice: O(V + E).
+
+    Returns a ShortestPathDAG.
+    """
+    num_nodes = len(graph.player_ids)
+    offsets, neighbors = graph.offsets, graph.neighbors
+
+    distance = np.full(num_nodes, -1, dtype=np.int32)
+    num_paths = np.zeros(num_nodes, dtype=object)
+    distance[root_index] = 0
+    num_paths[root_index] = 1
+
+    frontier = np.array([root_index], dtype=np.int32)
+    level = 0
+    while frontier.size:
+        level += 1
+        candidates, discoverers = graph_operations._gather(offsets, neighbors, frontier)
+        undiscovered = distance[candidates] == -1
+        candidates = candidates[undiscovered]
+        discoverers = discoverers[undiscovered]
+
+        # Every frontier node reaching a new node adds its own count to it.
+        distance[candidates] = level
+        np.add.at(num_paths, candidates, num_paths[discoverers])
+        frontier = np.unique(candidates)
+
+    return ShortestPathDAG(graph, root_index, distance, num_paths)
+
+
+def get_shortest_path_dag(db_filename, root='jagrja01', graph=None):
+    """
+    Returns the ShortestPathDAG of root, over the CSRGraph of db_filename (read from its snapshot,
+    see graph_operations.get_csr_graph, unless supplied).
+    """
+    if graph is None:
+        graph = graph_operations.get_csr_graph(db_filename)
+    return shortest_path_dag(graph, graph.index_of[root])
+
+
+def count_shortest_paths(dag, player_id):
+    """
+    Returns the number of shortest paths between player_id and the root of dag (0 if there is none).
+    """
+    index = dag.graph.index_of.get(player_id)
+    return 0 if index is None else dag.num_paths[index]
+
+
+def _next_hops(dag, index):
+    """
+    Returns the neighbors of node index one step closer to the root (sorted by index),
+    and their positions in graph.neighbors.
+    """
+    start, end = dag.graph.offsets[index], dag.graph.offsets[index + 1]
+    hops = dag.graph.neighbors[start:end]
+    closer = np.flatnonzero(dag.distance[hops] == dag.distance[index] - 1)
+    return hops[closer], closer + start
+
+
+def _unrank_path(dag, index, rank):
+    """
+    Returns the shortest path (node indices, from index to the root) of the given rank, in the
+    order where paths are sorted by their first hop, then their second hop, etc. At each node,
+    the path counts of the next hops tell which of them the path of that rank goes through.
+    """
+    path = [index]
+    while index != dag.root_index:
+        for hop in _next_hops(dag, index)[0].tolist():
+            if rank < dag.num_paths[hop]:
+                index = hop
+                break
+            rank -= dag.num_paths[hop]
+        path.append(index)
+    return path
+
+
+def iter_shortest_paths(dag, player_id, start=0):
+    """
+    Generates the shortest paths between player_id and the root of dag (as lists of player ids,
+    from player_id to the root) in a fixed order, beginning with the one of rank start.
+    Each path is computed on its own, in O(distance * degree), so none are kept in memory
+    and any page can be reached without going through the previous ones.
+    """
+    index = dag.graph.index_of.get(player_id)
+    if index is None:
+        return
+    player_ids = dag.graph.player_ids
+    for rank in range(start, dag.num_paths[index]):
+        yield [player_ids[i] for i in _unrank_path(dag, index, rank)]
+
+
+def load_edge_weights(db_filename, graph):
+    """
+    Returns the number of seasons shared by each pair of teammates (from "teammate_edges"), as an
+    int32 array aligned with graph.neighbors: the weight of the edge at position p of the CSR lists.
+    """
+    index_of = graph.index_of
+    first, second, seasons = [], [], []
+    cursor = database._connect(db_filename).cursor()
+    for teammate1_id, teammate2_id, shared_seasons in cursor.execute(
+            "SELECT teammate1_id, teammate2_id, shared_seasons FROM teammate_edges;"):
+        first.append(index_of[teammate1_id])
+        second.append(index_of[teammate2_id])
+        seasons.append(shared_seasons)
+    cursor.connection.close()
+
+    seasons = np.array(seasons, dtype=np.int32)
+    weights = np.zeros(len(graph.neighbors), dtype=np.int32)
+    weights[graph_operations.csr_edge_positions(graph, first, second)] = seasons
+    weights[graph_operations.csr_edge_positions(graph, second, first)] = seasons
+    return weights
+
+
+def get_edge_weights(db_filename, graph):
+    """
+    load_edge_weights, through its snapshot (see snapshot.py); it is kept at the same database
+    version as the CSRGraph of graph_operations.get_csr_graph.
+    """
+    return snapshot.cached(db_filename, "edge_weights", load_edge_weights, db_filename, graph)
+
+
+def best_path_weights(dag, weights):
+    """
+    Returns, for every node, the largest total weight of a shortest path from it to the root
+    (-1 if unreachable), computed level by level in one pass over the edges.
+    """
+    offsets, neighbors = dag.graph.offsets, dag.graph.neighbors
+    edge_positions = np.arange(len(neighbors), dtype=np.int64)
+    best = np.full(len(dag.distance), -1, dtype=np.int64)
+    best[dag.root_index] = 0
+    for level in range(1, int(dag.distance.max()) + 1):
+        nodes = np.flatnonzero(dag.distance == level).astype(np.int32)
+        positions, sources = graph_operations._gather(offsets, edge_positions, nodes)
+        hops = neighbors[positions]
+        closer = dag.distance[hops] == level - 1
+        np.maximum.at(best, sources[closer], best[hops[closer]] + weights[positions[closer]])
+    return best
+
+
+def iter_best_paths(dag, player_id, weights):
+    """
+    Generates the shortest paths between player_id and the root of dag, best first: by the total
+    weight of their edges (e.g. the seasons shared along the path, see get_edge_weights).
+    Yields (total weight, list of player ids from player_id to the root).
+
+    Best-first search over the DAG: a partial path is ranked by its weight so far plus the best
+    weight that can still be added (best_path_weights), which is exact, so complete paths come
+    out in order, and only the partial paths near the best ones are ever expanded.
+    """
+    index = dag.graph.index_of.get(player_id)
+    if index is None or dag.distance[index] == -1:
+        return
+    best = best_path_weights(dag, weights)
+    player_ids = dag.graph.player_ids
+    tie_breaker = itertools.count()
+
+    heap = [ (-int(best[index]), next(tie_breaker), 0, (index,)) ]
+    while heap:
+        _, _, weight, path = heapq.heappop(heap)
+        last = path[-1]
+        if last == dag.root_index:
+            yield weight, [player_ids[i] for i in path]
+            continue
+        hops, positions = _next_hops(dag, last)
+        for hop, position in zip(hops.tolist(), positions.tolist()):
+            hop_weight = weight + int(weights[position])
+            heapq.heappush(heap, (-(hop_weight + int(best[hop])), next(tie_breaker), hop_weight, path + (hop,)))
+
+
+def page_shortest_paths(dag, player_id, offset=0, limit=10, weights=None):
+    """
+    Returns one page of the shortest paths between player_id and the root of dag: the paths of
+    ranks offset to offset + limit - 1, as lists of player ids. Ranked best first if weights are
+    given (see iter_best_paths), otherwise in the fixed order of iter_shortest_paths.
+    """
+    if weights is not None:
+        return [path for _, path in itertools.islice(iter_best_paths(dag, player_id, weights), offset, offset + limit)]
+    return list(itertools.islice(iter_shortest_paths(dag, player_id, start=offset), limit))
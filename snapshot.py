@@ -0,0 +1,76 @@
+# Binary snapshots of data derived from the database (name index, BFS lookup tables, graph arrays),
+# so that a cold start loads each of them from one file instead of rebuilding it with queries.
+# A snapshot records the database's version stamp (see database.bump_db_version) and is only
+# used while the database is at that version; otherwise it is rebuilt and saved again.
+
+import os, pickle
+import database # my database.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# cached(db_filename, name, build, *args, **kwargs)
+# load_snapshot(db_filename, name)
+# save_snapshot(db_filename, name, data, version=None)
+# snapshot_path(db_filename, name)
+#
+########################################################################
+
+
+def snapshot_path(db_filename, name):
+    """
+    Path of the snapshot "name" of db_filename: next to the database, e.g. 1980_to_2025.db.names.snapshot
+    """
+    return f"{db_filename}.{name}.snapshot"
+
+
+def load_snapshot(db_filename, name):
+    """
+    Returns the data of the snapshot "name" of db_filename, or None if there is none, or if it
+    was saved at another version of the database (or the database has no version stamp).
+    """
+    version = database.get_db_version(db_filename)
+    path = snapshot_path(db_filename, name)
+    if version is None or not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as file:
+        try:
+            # The version comes first, so a stale snapshot is rejected without loading its data.
+            if pickle.load(file) != version:
+                return None
+            return pickle.load(file)
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+
+def save_snapshot(db_filename, name, data, version=None):
+    """
+    Saves data as the snapshot "name" of db_filename, at the given version of the database
+    (default: the current one). The file is written under a temporary name and then renamed,
+    so a reader never sees half of it. Does nothing if the database has no version stamp.
+    """
+    if version is None:
+        version = database.get_db_version(db_filename)
+    if version is None:
+        return
+    path = snapshot_path(db_filename, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(version, file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def cached(db_filename, name, build, *args, **kwargs):
+    """
+    Returns the snapshot "name" of db_filename if it is up to date; otherwise calls
+    build(*args, **kwargs), saves the result as that snapshot, and returns it.
+    """
+    # Read the version before building, so that changes made meanwhile make the snapshot stale.
+    version = database.get_db_version(db_filename)
+    data = load_snapshot(db_filename, name)
+    if data is None:
+        data = build(*args, **kwargs)
+        save_snapshot(db_filename, name, data, version=version)
+    return data
@@ -0,0 +1,120 @@
+# Deterministic synthetic leagues, for benchmarks and tests at any scale, without scraping.
+# Writes the "players", "teams", "team_membership", "scrape_log" and "union_find" tables directly.
+# Run as: python3 synthetic.py <db_file> [--teams 32] [--seasons 45] [--roster-size 28] [--career-length 8] [--seed 0]
+
+import argparse, os, random, sqlite3
+import database # my database.py file
+import union_find # my union_find.py file
+
+########################################################################
+# Function signatures for functions herein:
+#
+# generate_league(db_filename, num_teams=32, num_seasons=45, roster_size=28, career_length=8,
+#                 first_season=1981, seed=0, trade_rate=0.1)
+#
+########################################################################
+
+FIRST_NAMES = ["Jaromir", "Wayne", "Mario", "Sidney", "Alex", "Jean", "Teemu", "Nicklas", "Patrik", "Sergei",
+               "Pavel", "Mikko", "Henrik", "Daniel", "Ryan", "Connor", "Joe", "Zdeno", "Marc-André", "Ilya"]
+LAST_NAMES = ["Smith", "Novak", "Lindqvist", "Lemieux", "Kovalev", "Selänne", "Béliveau", "Hašek", "Larsson",
+              "Petrov", "Dvořák", "Koivu", "Sedin", "O'Reilly", "McDavid", "Thornton", "Chára", "Fleury",
+              "Kovalchuk", "Ovechkin", "Jagr", "Gretzky", "Crosby", "Stamkos", "Kane", "Bergeron", "Price"]
+
+
+def _player_id(first, last, taken):
+    # Same shape as Hockey-Reference ids: 5 letters of the last name, 2 of the first, a number.
+    stem = "".join(c for c in database.remove_diacritics(last).lower() if c.isalpha())[:5]
+    stem += "".join(c for c in database.remove_diacritics(first).lower() if c.isalpha())[:2]
+    number = 1
+    while f"{stem}{number:02d}" in taken:
+        number += 1
+    return f"{stem}{number:02d}"
+
+
+def generate_league(db_filename, num_teams=32, num_seasons=45, roster_size=28, career_length=8,
+                    first_season=1981, seed=0, trade_rate=0.1):
+    """
+    Writes a synthetic league into db_filename (set up with database.set_up_db), and returns
+    the number of players created. The same arguments always give the same league.
+
+    Every season, each team keeps the players whose careers go on (each career lasts between 1
+    and 2 * career_length - 1 seasons), a fraction trade_rate of them is traded to other teams,
+    and the rosters are filled up to roster_size with new players. The first player created is
+    "jagrja01" (Jaromir Jagr), and names repeat across players, as real names do. Every roster is
+    recorded as "done" in "scrape_log", so main.py does not try to scrape anything.
+    """
+    rng = random.Random(seed)
+    database.set_up_db(db_filename)
+
+    teams = [ (f"T{t:02d}", f"Synthetic Team {t}") for t in range(num_teams) ]
+    players = dict()        # player_id -> (first, last, birth_year)
+    seasons_left = dict()   # player_id -> seasons left in the career
+    rosters = {team_id: [] for team_id, _ in teams}
+    memberships = []
+
+    def new_player(season, first=None, last=None, player_id=None):
+        first = first or rng.choice(FIRST_NAMES)
+        last = last or rng.choice(LAST_NAMES)
+        player_id = player_id or _player_id(first, last, players)
+        players[player_id] = (first, last, season - rng.randint(18, 22))
+        seasons_left[player_id] = rng.randint(1, 2 * career_length - 1)
+        return player_id
+
+    for season in range(first_season, first_season + num_seasons):
+        # Players retire, then some of the remaining ones are traded.
+        for team_id in rosters:
+            rosters[team_id] = [pid for pid in rosters[team_id] if seasons_left[pid] > 0]
+        for team_id in rosters:
+            for pid in list(rosters[team_id]):
+                if num_teams > 1 and rng.random() < trade_rate:
+                    other_team = rng.choice([t for t, _ in teams if t != team_id])
+                    if len(rosters[other_team]) < roster_size:
+                        rosters[team_id].remove(pid)
+                        rosters[other_team].append(pid)
+
+        for team_id in rosters:
+            while len(rosters[team_id]) < roster_size:
+                if "jagrja01" not in players:
+                    rosters[team_id].append(new_player(season, "Jaromir", "Jagr", "jagrja01"))
+                else:
+                    rosters[team_id].append(new_player(season))
+            memberships.extend( (pid, team_id, season) for pid in rosters[team_id] )
+
+        for pid in seasons_left:
+            seasons_left[pid] -= 1
+
+    conn = sqlite3.connect(db_filename)
+    cursor = conn.cursor()
+    cursor.executemany("INSERT OR REPLACE INTO teams (id, name) VALUES (?,?)", teams)
+    cursor.executemany("INSERT OR REPLACE INTO players (id, first_name, last_name, birth_year) VALUES (?,?,?,?)",
+                       ( (pid, database.remove_diacritics(first), database.remove_diacritics(last), birth_year)
+                         for pid, (first, last, birth_year) in players.items() ))
+    cursor.executemany("INSERT OR REPLACE INTO team_membership (player_id, team_id, season) VALUES (?,?,?)", memberships)
+    cursor.execute("""
+    INSERT OR REPLACE INTO scrape_log (team_id, season, status, num_players, updated_at)
+        SELECT team_id, season, 'done', COUNT(*), CURRENT_TIMESTAMP
+        FROM team_membership
+        GROUP BY team_id, season
+    ;""")
+    union_find.build_union_find(cursor)
+    database.bump_db_version(cursor)
+    conn.commit()
+    conn.close()
+    return len(players)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic league into a database file.")
+    parser.add_argument("db_file")
+    parser.add_argument("--teams", type=int, default=32)
+    parser.add_argument("--seasons", type=int, default=45)
+    parser.add_argument("--roster-size", type=int, default=28)
+    parser.add_argument("--career-length", type=int, default=8, help="average career length, in seasons")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_file):
+        parser.error(f"{args.db_file} already exists.")
+    num_players = generate_league(args.db_file, num_teams=args.teams, num_seasons=args.seasons,
+                                  roster_size=args.roster_size, career_length=args.career_length, seed=args.seed)
+    print(f"Wrote {num_players} players to {args.db_file}.")
@@ -0,0 +1,53 @@
+# Checks that the bipartite player/roster BFS agrees with the CSR BFS over the teammates graph.
+# Run as: python3 -m pytest test_graph_operations.py
+
+import sqlite3
+import database # my database.py file
+import graph_operations # my graph_operations.py file
+import synthetic # my synthetic.py file
+
+
+def test_BFS_bipartite_matches_BFS_csr(tmp_path):
+    db_filename = str(tmp_path / "league.db")
+    synthetic.generate_league(db_filename, num_teams=4, num_seasons=10, roster_size=20, career_length=5)
+
+    # Jagr and a teammate of his first season also shared a roster of another team that season,
+    # so the label of their tree edge depends on how ties within a season are broken.
+    conn = sqlite3.connect(db_filename)
+    team_id, season = conn.execute("SELECT team_id, MIN(season) FROM team_membership WHERE player_id = 'jagrja01';").fetchone()
+    teammate_id = conn.execute("SELECT MIN(player_id) FROM team_membership WHERE team_id = ? AND season = ? "
+                               "AND player_id != 'jagrja01';", (team_id, season)).fetchone()[0]
+    conn.execute("INSERT INTO teams (id, name) VALUES ('Z99', 'Traded Together');")
+    conn.executemany("INSERT INTO team_membership (player_id, team_id, season) VALUES (?, 'Z99', ?);",
+                     [ ('jagrja01', season), (teammate_id, season) ])
+    conn.commit()
+    conn.close()
+    database.make_teammates_table(db_filename)
+
+    csr_graph = graph_operations.make_csr_graph(db_filename)
+    _, distance = graph_operations.csr_BFS_arrays(csr_graph, csr_graph.index_of['jagrja01'])
+    csr_parent = graph_operations.BFS_csr(db_filename, graph=csr_graph)
+    bipartite_parent, labels = graph_operations.BFS_bipartite(db_filename, shared_teams=True)
+
+    assert bipartite_parent.keys() == csr_parent.keys()
+    index_of = csr_graph.index_of
+    for player_id, parent_id in bipartite_parent.items():
+        csr_parent_id = csr_parent[player_id]
+        if parent_id in ("HIMSELF", "DISCONNECTED"):
+            assert parent_id == csr_parent_id
+            continue
+        # BFS trees may differ, but a parent must be a teammate one step closer to the root.
+        assert csr_parent_id not in ("HIMSELF", "DISCONNECTED")
+        assert distance[index_of[parent_id]] == distance[index_of[player_id]] - 1
+        assert index_of[parent_id] in graph_operations.csr_neighbors(csr_graph, index_of[player_id]).tolist()
+
+    # Every tree edge has the shared-team label of "teammate_edges".
+    conn = sqlite3.connect(db_filename)
+    edge_labels = {(teammate1_id, teammate2_id): (first_team_id, first_season) for teammate1_id, teammate2_id, first_team_id, first_season
+                   in conn.execute("SELECT teammate1_id, teammate2_id, first_team_id, first_season FROM teammate_edges;")}
+    conn.close()
+    assert labels.keys() == {player_id for player_id, parent_id in bipartite_parent.items()
+                             if parent_id not in ("HIMSELF", "DISCONNECTED")}
+    for player_id, label in labels.items():
+        assert edge_labels[tuple(sorted( (player_id, bipartite_parent[player_id]) ))] == label
+    assert labels[teammate_id] == (team_id, season)
@@ -0,0 +1,90 @@
+# Checks the pipelined scraper end to end, against a local stub of Hockey-Reference.
+# Run as: python3 -m pytest test_scraper.py
+
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import database # my database.py file
+
+REQUESTS_PER_MINUTE = 600   # one request every 0.1 s
+TEAM_SEASONS = { "AAA": (2010, 2012), "BBB": (2010, 2012) }
+
+
+def roster_page(team_id, year):
+    """
+    Returns the HTML of a roster page with 3 players, the way Hockey-Reference lays it out.
+    Player "share<year>" is on every roster of that season.
+    """
+    players = [ (f"{team_id.lower()}{year}a", f"Alpha, {team_id}"), (f"{team_id.lower()}{year}b", f"Beta, {team_id}"),
+                (f"share{year}", "Shared, Player") ]
+    rows = "\n".join(f'<tr><th>{i}</th><td data-append-csv="{player_id}" csk="{name}">{name}</td><td>C</td></tr>'
+                     for i, (player_id, name) in enumerate(players))
+    return f'<html><body><table id="roster"><tbody>\n{rows}\n</tbody></table></body></html>'.encode()
+
+
+def start_stub_server():
+    """
+    Serves /teams/<team_id>/<year>.html on a free local port, from a thread.
+    Returns the server and the list of (time, path) of the requests it receives.
+    """
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append( (time.monotonic(), self.path) )
+            _, teams, team_id, page = self.path.split("/")
+            if teams != "teams" or team_id not in TEAM_SEASONS:
+                self.send_error(404)
+                return
+            body = roster_page(team_id, int(page.split(".")[0]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests_seen
+
+
+def test_add_to_database_pipelined_against_stub(tmp_path):
+    team_names_csv, team_seasons_csv = tmp_path / "names.csv", tmp_path / "seasons.csv"
+    team_names_csv.write_text("team_id,team_name\n" + "".join(f"{team_id},Team {team_id}\n" for team_id in TEAM_SEASONS))
+    team_seasons_csv.write_text("team_id,inaugural_season,most_recent_season\n" +
+                                "".join(f"{team_id},{start},{end}\n" for team_id, (start, end) in TEAM_SEASONS.items()))
+    db_filename = str(tmp_path / "league.db")
+    database.set_up_db(db_filename)
+
+    server, requests_seen = start_stub_server()
+    try:
+        database.add_to_database_pipelined(db_filename, str(team_names_csv), str(team_seasons_csv),
+                                           requests_per_minute=REQUESTS_PER_MINUTE,
+                                           base_url=f"http://127.0.0.1:{server.server_port}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    expected = { (team_id, year) for team_id, (start, end) in TEAM_SEASONS.items() for year in range(start, end + 1) }
+    assert sorted(path for _, path in requests_seen) == sorted(f"/teams/{team_id}/{year}.html" for team_id, year in expected)
+
+    # Requests are spaced 60 / requests_per_minute seconds apart, up to the thread scheduling
+    # between a worker taking its token and its request reaching the stub.
+    interval = 60 / REQUESTS_PER_MINUTE
+    times = sorted(t for t, _ in requests_seen)
+    gaps = [ later - earlier for earlier, later in zip(times, times[1:]) ]
+    assert min(gaps) >= 0.5 * interval
+    assert times[-1] - times[0] >= (len(times) - 1) * interval - 0.05
+
+    conn = sqlite3.connect(db_filename)
+    memberships = set(conn.execute("SELECT player_id, team_id, season FROM team_membership;"))
+    scrape_log = conn.execute("SELECT team_id, season, status, num_players FROM scrape_log;").fetchall()
+    conn.close()
+    assert memberships == { (player_id, team_id, year) for team_id, year in expected
+                            for player_id in (f"{team_id.lower()}{year}a", f"{team_id.lower()}{year}b", f"share{year}") }
+    assert { (team_id, season) for team_id, season, _, _ in scrape_log } == expected
+    assert all(status == "done" and num_players == 3 for _, _, status, num_players in scrape_log)
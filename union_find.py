@@ -0,0 +1,206 @@
+# Connected components of the teammates graph, kept as a union-find (disjoint-set forest) in the
+# table "union_find" (player_id, parent_id, size) of the database:
+#   - every roster joins the sets of all its players, so two players are connected (by a chain of
+#     teammates) if and only if they have the same root,
+#   - a root is its own parent, and its "size" is the number of players in its component
+#     (the size stored for other players is not used),
+#   - sets are joined by size (the smaller root points to the larger one), and the paths followed
+#     while writing are compressed, so a query follows a near-constant number of parents: O(α(n)).
+# It is updated as rosters are ingested (see database._insert_roster / database._insert_rosters).
+
+import database # my database.py file
+import instrumentation # my instrumentation.py file
+
+# Database files whose "union_find" table is known to exist (see _read_cursor).
+_ready = set()
+
+########################################################################
+# Function signatures for functions herein:
+#
+# are_connected(player1_id, player2_id, db_filename)
+# build_union_find(cursor)
+# component_size(player_id, db_filename)
+# create_union_find_table(cursor)
+# find(cursor, player_id, compress=False)
+# get_component_sizes(db_filename)
+# load_components(db_filename)
+# union_groups(cursor, groups)
+#
+########################################################################
+
+
+def create_union_find_table(cursor):
+    """
+    Creates the "union_find" table, if needed. Returns True if it was just created.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'union_find';")
+    if cursor.fetchone() is not None:
+        return False
+    cursor.execute("""
+    CREATE TABLE union_find (
+        player_id TEXT PRIMARY KEY,
+        parent_id TEXT,  -- equal to player_id for the root of a component
+        size INTEGER,    -- number of players in the component, for a root
+        FOREIGN KEY (player_id) REFERENCES players(id)
+    ) WITHOUT ROWID;""")
+    return True
+
+
+def find(cursor, player_id, compress=False):
+    """
+    Returns the root of the component of player_id (on an open cursor), or None if the player
+    is on no roster. With compress=True, every player on the way is made to point at the root
+    (without committing).
+    """
+    path = []
+    curr_id = player_id
+    while True:
+        cursor.execute("SELECT parent_id FROM union_find WHERE player_id = ?;", (curr_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        if row[0] == curr_id:
+            break
+        path.append(curr_id)
+        curr_id = row[0]
+    if compress and len(path) > 1:
+        cursor.executemany("UPDATE union_find SET parent_id = ? WHERE player_id = ?;",
+                           [ (curr_id, path_id) for path_id in path[:-1] ])
+    return curr_id
+
+
+def union_groups(cursor, groups):
+    """
+    Joins the players of each group (e.g. each roster) into one component (on an open cursor,
+    without committing). Players not in "union_find" yet are added.
+
+    The roots of all players involved are found once, the groups are merged in memory, and only
+    the rows that changed are written: every player involved ends up pointing at its new root.
+    """
+    roots = dict()          # player_id -> root in the table before this call (itself if new)
+    size = dict()           # old root -> size before this call
+    for group in groups:
+        for player_id in group:
+            if player_id in roots:
+                continue
+            root = find(cursor, player_id, compress=True)
+            if root is None:
+                root = player_id
+                size[root] = 1
+            elif root not in size:
+                cursor.execute("SELECT size FROM union_find WHERE player_id = ?;", (root,))
+                size[root] = cursor.fetchone()[0]
+            roots[player_id] = root
+
+    # In-memory union-find over the old roots, by size.
+    parent = {root: root for root in size}
+
+    def find_in_memory(root):
+        while parent[root] != root:
+            parent[root] = parent[parent[root]]
+            root = parent[root]
+        return root
+
+    for group in groups:
+        group = list(group)
+        if not group:
+            continue
+        first = find_in_memory(roots[group[0]])
+        for player_id in group[1:]:
+            other = find_in_memory(roots[player_id])
+            if other == first:
+                continue
+            if size[other] > size[first]:
+                first, other = other, first
+            parent[other] = first
+            size[first] += size[other]
+
+    rows = []
+    for player_id in set(roots) | set(size):
+        new_root = find_in_memory(roots.get(player_id, player_id))
+        rows.append( (player_id, new_root, size[new_root] if player_id == new_root else 1) )
+    cursor.executemany("INSERT OR REPLACE INTO union_find (player_id, parent_id, size) VALUES (?,?,?);", rows)
+    instrumentation.count("union_find.rows_written", len(rows))
+
+
+def build_union_find(cursor):
+    """
+    (Re)builds "union_find" from all of "team_membership" (on an open cursor, without committing),
+    e.g. for a database that was filled before the table existed.
+    """
+    create_union_find_table(cursor)
+    cursor.execute("DELETE FROM union_find;")
+    rosters = dict()
+    for team_id, season, player_id in cursor.execute("SELECT team_id, season, player_id FROM team_membership;").fetchall():
+        rosters.setdefault( (team_id, season), [] ).append(player_id)
+    union_groups(cursor, rosters.values())
+    database.bump_db_version(cursor)
+
+
+def _read_cursor(db_filename):
+    """
+    Returns a cursor on the shared connection of db_filename (see database.get_connection), after
+    building "union_find" if the database was prepared before the table existed.
+    """
+    cursor = database.get_connection(db_filename).cursor()
+    if db_filename not in _ready:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'union_find';")
+        if cursor.fetchone() is None:
+            conn = database._connect(db_filename)
+            if create_union_find_table(conn.cursor()):
+                build_union_find(conn.cursor())
+                conn.commit()
+            conn.close()
+        _ready.add(db_filename)
+    return cursor
+
+
+def are_connected(player1_id, player2_id, db_filename):
+    """
+    Returns True if there is a chain of teammates between the two players, in O(α(n)) lookups.
+    """
+    cursor = _read_cursor(db_filename)
+    root1 = find(cursor, player1_id)
+    return root1 is not None and root1 == find(cursor, player2_id)
+
+
+def component_size(player_id, db_filename):
+    """
+    Returns the number of players connected to player_id (itself included), or 0 if the player
+    is on no roster.
+    """
+    cursor = _read_cursor(db_filename)
+    root = find(cursor, player_id)
+    if root is None:
+        return 0
+    cursor.execute("SELECT size FROM union_find WHERE player_id = ?;", (root,))
+    return cursor.fetchone()[0]
+
+
+def get_component_sizes(db_filename):
+    """
+    Returns the list of the sizes of all components, largest first.
+    """
+    cursor = _read_cursor(db_filename)
+    cursor.execute("SELECT size FROM union_find WHERE player_id = parent_id ORDER BY size DESC;")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_components(db_filename):
+    """
+    Returns a dict mapping every player on a roster to the root of its component, read in one
+    query, for callers that test many pairs in memory (e.g. graph_operations.bidirectional_BFS).
+    """
+    cursor = _read_cursor(db_filename)
+    parent = dict(cursor.execute("SELECT player_id, parent_id FROM union_find;").fetchall())
+    components = dict()
+    for player_id in parent:
+        chain = []
+        curr_id = player_id
+        while curr_id not in components and parent[curr_id] != curr_id:
+            chain.append(curr_id)
+            curr_id = parent[curr_id]
+        root = components.get(curr_id, curr_id)
+        for chained_id in chain + [curr_id]:
+            components[chained_id] = root
+    return components